@@ -14,9 +14,21 @@ import time
 import nuke
 import os
 import re
+import sys
 import traceback
 import unicodedata
-import nukescripts
+
+# The startup tracer, manifest, context hand-off, keys and table are shared with
+# the bootstrap scripts, which run before Toolkit can be imported, so they live in
+# the startup directory.
+sys.path.append(os.path.join(os.path.dirname(__file__), "python", "startup"))
+try:
+    import sgtk_trace
+    import sgtk_manifest
+    import sgtk_handoff
+    import sgtk_context_key
+finally:
+    sys.path.pop()
 
 class NukeEngine(tank.platform.Engine):
     """
@@ -44,7 +56,9 @@ class NukeEngine(tank.platform.Engine):
         This is the first block of logic that will be executed, regardless of whether
         it is Nuke, Nuke Studio, or Hiero that is being launched. This logic handles
         setting either the NUKE_PATH or HIERO_PLUGIN_PATH environment variables,
-        depending on which mode is being launched.
+        depending on which mode is being launched. It also starts building a startup
+        manifest in the background (see `sgtk_manifest.py`), which the engine uses
+        to skip resolving app gizmo folders and favourite directories itself.
 
     Step 2:
         With the appropriate path variable set in #1, the `tk-nuke/python/startup`
@@ -79,7 +93,11 @@ class NukeEngine(tank.platform.Engine):
     During the bootstrap process described above, event callbacks are registered with
     Nuke. The events of interest are OnScriptLoad and OnScriptSave. Interest is registered
     in these events in `tk-nuke/python/tk_nuke/__init__.py`, which is also where the
-    callbacks themselves are defined.
+    callbacks themselves are defined, and where the engine's context is switched,
+    in place when possible.
+
+    The optional startup and caching features are described in the modules of
+    `tk-nuke/python/startup` and `tk-nuke/python/tk_nuke` that implement them.
     """
 
     # Define the different areas where menu events can occur in Hiero.
@@ -97,6 +115,12 @@ class NukeEngine(tank.platform.Engine):
         self._context_change_menu_rebuild = True
         self._processed_paths = []
         self._processed_environments = []
+        self._gizmo_folders = dict()
+        self._favourite_dirs = []
+        self._farm_profile = (
+            not self._ui_enabled and bool(os.environ.get("TK_NUKE_FARM_PROFILE"))
+        )
+        self._startup_time = time.time()
 
         super(NukeEngine, self).__init__(*args, **kwargs)
 
@@ -135,15 +159,51 @@ class NukeEngine(tank.platform.Engine):
     def menu_generator(self):
         return self._menu_generator
 
+    @property
+    def farm_profile(self):
+        """
+        Whether the engine was started with the headless farm profile.
+        """
+        return self._farm_profile
+
+    def subsystem_enabled(self, subsystem):
+        """
+        Whether the given startup subsystem should run. All subsystems run
+        unless the engine was started with the farm profile, in which case
+        only those listed in the farm_profile_subsystems setting do, along
+        with those they need: the callbacks start the engine from the
+        environment set by session_env, so listing "callbacks" implies
+        "session_env".
+
+        :param subsystem:   The name of the subsystem, one of "gizmos",
+                            "callbacks", "session_env" or "metrics".
+        """
+        if not self.farm_profile:
+            return True
+        enabled = self.get_setting("farm_profile_subsystems", [])
+        if subsystem == "session_env" and "callbacks" in enabled:
+            return True
+        return subsystem in enabled
+
     #####################################################################################
     # Engine Initialization and Destruction
     
+    @sgtk_trace.traced("NukeEngine.init_engine")
     def init_engine(self):
         """
         Called at Engine startup.
         """
         self.log_debug("%s: Initializing..." % self)
 
+        if self.hiero_enabled:
+            sgtk_trace.set_process_name("Hiero")
+        elif self.studio_enabled:
+            sgtk_trace.set_process_name("Nuke Studio")
+        elif self.has_ui:
+            sgtk_trace.set_process_name("Nuke")
+        else:
+            sgtk_trace.set_process_name("Nuke (batch)")
+
         # We need to check to make sure that we are using one of the
         # supported versions of Nuke. Right now that is anything between
         # 6.3v5 and 9.0v*. For versions higher than what we know we
@@ -195,6 +255,23 @@ class NukeEngine(tank.platform.Engine):
                                  "in the context in order to start! Your "
                                  "context: %s" % self.context)
 
+        # Note! not using the import as this confuses Nuke's callback system
+        # (several of the key scene callbacks are in the main init file).
+        import tk_nuke
+
+        # The context caches outlive the engine, but their sizes are configured
+        # per environment. They pick the settings up when they are first used.
+        tk_nuke.configure_caches(
+            context_cache_size=self.get_setting("context_cache_size", 256),
+            persistent_context_cache_size=self.get_setting("persistent_context_cache_size", 10000),
+            entity_cache_ttl=self.get_setting("entity_cache_ttl", 300.0),
+            entity_prefetch_size=self.get_setting("entity_prefetch_size", 1000),
+            unmanaged_path_cache_ttl=self.get_setting("unmanaged_path_cache_ttl", 60.0),
+        )
+
+        # Paths in this engine's project resolve to its own Toolkit instance.
+        tk_nuke.get_tank_pool().add(self.tank)
+
         # Do our mode-specific initializations.
         if self.hiero_enabled:
             self.init_engine_hiero()
@@ -216,26 +293,32 @@ class NukeEngine(tank.platform.Engine):
         self._last_clicked_selection = []
         self._last_clicked_area = None
 
+    @sgtk_trace.traced("NukeEngine.init_engine_nuke")
     def init_engine_nuke(self):
         """
         The Nuke-specific portion of engine initialization.
         """
+        # We also need to pass the path to the python folder down to the init script
+        # because nuke python does not have a __file__ attribute for that file.
+        # The bootstrap in this process relies on it too, so it is always set.
+        local_python_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "python"))
+        os.environ["TANK_NUKE_ENGINE_MOD_PATH"] = local_python_path
+
+        if not self.subsystem_enabled("session_env"):
+            return
+
         # Now prepare tank so that it will be picked up by any new processes
         # created by file->new or file->open.
         # Store data needed for bootstrapping Tank in env vars. Used in startup/menu.py.
         os.environ["TANK_NUKE_ENGINE_INIT_NAME"] = self.instance_name
-        os.environ["TANK_NUKE_ENGINE_INIT_CONTEXT"] = tank.context.serialize(self.context)
+        os.environ["TANK_NUKE_ENGINE_INIT_CONTEXT"] = sgtk_handoff.encode_context(self.context)
         os.environ["TANK_NUKE_ENGINE_INIT_PROJECT_ROOT"] = self.tank.project_path
         
         # Add our startup path to the nuke init path
         startup_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "startup"))
         tank.util.append_path_to_env_var("NUKE_PATH", startup_path)        
-    
-        # We also need to pass the path to the python folder down to the init script
-        # because nuke python does not have a __file__ attribute for that file.
-        local_python_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "python"))
-        os.environ["TANK_NUKE_ENGINE_MOD_PATH"] = local_python_path
 
+    @sgtk_trace.traced("NukeEngine.pre_app_init")
     def pre_app_init(self):
         """
         Called at startup, but after QT has been initialized.
@@ -248,16 +331,16 @@ class NukeEngine(tank.platform.Engine):
         import tk_nuke
         
         # Make sure callbacks tracking the context switching are active.
-        tk_nuke.tank_ensure_callbacks_registered()
+        if self.subsystem_enabled("callbacks"):
+            tk_nuke.tank_ensure_callbacks_registered()
 
+    @sgtk_trace.traced("NukeEngine.post_app_init")
     def post_app_init(self):
         """
         Called when all apps have initialized.
         """
         # Figure out what our menu will be named.
-        menu_name = "Shotgun"
-        if self.get_setting("use_sgtk_as_menu_name", False):
-            menu_name = "Sgtk"
+        menu_name = self.__get_menu_name()
 
         # We have some mode-specific initialization to do.
         if self.hiero_enabled:
@@ -268,12 +351,29 @@ class NukeEngine(tank.platform.Engine):
             # We want to run the Nuke init, as well, to load up
             # any gizmos, but we don't want it to be part of the
             # post_app_init_studio method, since we'll also need
-            # to call just the gizmo stuff on context changes and
+            # to refresh just the gizmo stuff on context changes and
             # not the other Nuke Studio-related init stuff.
             self.post_app_init_nuke(menu_name)
         else:
             self.post_app_init_nuke(menu_name)
 
+        # Everything the launcher precomputed has been used by now.
+        sgtk_manifest.remove_manifest()
+
+        if not self.has_ui:
+            self.__log_startup_report()
+        else:
+            self.__prefetch_entities()
+
+    def __get_menu_name(self):
+        """
+        Returns the label/name of the engine's menu.
+        """
+        if self.get_setting("use_sgtk_as_menu_name", False):
+            return "Sgtk"
+        return "Shotgun"
+
+    @sgtk_trace.traced("NukeEngine.post_app_init_studio")
     def post_app_init_studio(self, menu_name="Shotgun"):
         """
         The Nuke Studio specific portion of the engine's post-init process.
@@ -283,13 +383,15 @@ class NukeEngine(tank.platform.Engine):
         if self.has_ui:
             # Note! not using the import as this confuses Nuke's callback system
             # (several of the key scene callbacks are in the main init file).
-            import tk_nuke
+            from tk_nuke.menu_generation import NukeStudioMenuGenerator
+            from tk_nuke.context import StudioContextSwitcher
             import hiero
             from hiero.core import env as hiero_env
 
             # Create the menu!
-            self._menu_generator = tk_nuke.NukeStudioMenuGenerator(self, menu_name)
-            self._menu_generator.create_menu()
+            self._menu_generator = NukeStudioMenuGenerator(self, menu_name)
+            with sgtk_trace.span("create_menu"):
+                self._menu_generator.create_menu()
 
             hiero.core.events.registerInterest(
                 "kAfterNewProjectCreated",
@@ -302,8 +404,7 @@ class NukeEngine(tank.platform.Engine):
             )
 
             # Then we need to setup our context switcher.
-            import tk_nuke
-            self._context_switcher = tk_nuke.StudioContextSwitcher(self)
+            self._context_switcher = StudioContextSwitcher(self)
 
             # On selection change we have to check what was selected and pre-load
             # the context if that environment (ie: shot_step) hasn't already been
@@ -325,6 +426,7 @@ class NukeEngine(tank.platform.Engine):
                 # ignore all errors. ex: using a core that doesn't support metrics
                 pass
 
+    @sgtk_trace.traced("NukeEngine.post_app_init_hiero")
     def post_app_init_hiero(self, menu_name="Shotgun"):
         """
         The Hiero-specific portion of the engine's post-init process.
@@ -334,12 +436,13 @@ class NukeEngine(tank.platform.Engine):
         if self.has_ui:
             # Note! not using the import as this confuses Nuke's callback system
             # (several of the key scene callbacks are in the main init file).
-            import tk_nuke
+            from tk_nuke.menu_generation import HieroMenuGenerator
             import hiero
 
             # Create the menu!
-            self._menu_generator = tk_nuke.HieroMenuGenerator(self, menu_name)
-            self._menu_generator.create_menu()
+            self._menu_generator = HieroMenuGenerator(self, menu_name)
+            with sgtk_trace.span("create_menu"):
+                self._menu_generator.create_menu()
 
             hiero.core.events.registerInterest(
                 "kAfterNewProjectCreated",
@@ -362,6 +465,7 @@ class NukeEngine(tank.platform.Engine):
                 # ignore all errors. ex: using a core that doesn't support metrics
                 pass
 
+    @sgtk_trace.traced("NukeEngine.post_app_init_nuke")
     def post_app_init_nuke(self, menu_name="Shotgun"):
         """
         The Nuke-specific portion of the engine's post-init process.
@@ -369,18 +473,15 @@ class NukeEngine(tank.platform.Engine):
         :param menu_name:   The label/name of the menu to be created.
         """
 
+        # Build the menu, favourite dirs and gizmo paths of the context.
+        self._refresh_nuke_context(menu_name)
+        self.write_state_snapshot()
+
         if self.has_ui and not self.studio_enabled:
             # Note! not using the import as this confuses Nuke's callback system
             # (several of the key scene callbacks are in the main init file).
-            import tk_nuke
+            import nukescripts
 
-            # Create the menu!
-            self._menu_generator = tk_nuke.NukeMenuGenerator(self, menu_name)
-            self._menu_generator.create_menu()
-
-            # Initialize favourite dirs in the file open/file save dialogs
-            self.__setup_favorite_dirs()
-            
             # Register all panels with nuke's callback system
             # this will be used at nuke startup in order
             # for nuke to be able to restore panels 
@@ -394,13 +495,90 @@ class NukeEngine(tank.platform.Engine):
                     panel_dict["callback"],
                 )
 
+            # Resolve the contexts of the scripts most likely to be opened
+            # next once Nuke is idle.
+            prewarm_count = self.get_setting("prewarm_recent_files", 0)
+            if prewarm_count > 0:
+                import tk_nuke
+                tk_nuke.get_context_prewarmer().start_when_idle(
+                    self,
+                    prewarm_count,
+                    self.get_setting("prewarm_time_budget", 30.0),
+                )
+
+        if not self.subsystem_enabled("metrics"):
+            return
+
+        try:
+            self.log_user_attribute_metric("Nuke version",
+                nuke.env.get("NukeVersionString"))
+        except:
+            # ignore all errors. ex: using a core that doesn't support metrics
+            pass
+
+    @sgtk_trace.traced("NukeEngine._refresh_nuke_context")
+    def _refresh_nuke_context(self, menu_name="Shotgun"):
+        """
+        The Nuke-specific setup that depends on the engine's context, run
+        at startup and again whenever the context changes.
+
+        :param menu_name:   The label/name of the menu to be created.
+        """
+        setup_ui = self.has_ui and not self.studio_enabled
+        setup_gizmos = self.subsystem_enabled("gizmos")
+
+        # Read the snapshot and manifest once for everything below.
+        precomputed = []
+        if setup_ui or setup_gizmos:
+            precomputed = self._get_precomputed_state()
+
+        if setup_ui:
+            # Note! not using the import as this confuses Nuke's callback system
+            # (several of the key scene callbacks are in the main init file).
+            from tk_nuke.menu_generation import NukeMenuGenerator
+
+            # Create the menu, or rebuild it for the new context!
+            if self._menu_generator is None:
+                self._menu_generator = NukeMenuGenerator(self, menu_name)
+            with sgtk_trace.span("create_menu"):
+                self._menu_generator.create_menu()
+
+            # Initialize favourite dirs in the file open/file save dialogs
+            self.__setup_favorite_dirs(precomputed)
+
+        if setup_gizmos:
+            self._setup_app_gizmos(precomputed)
+
+    @sgtk_trace.traced("NukeEngine._setup_app_gizmos")
+    def _setup_app_gizmos(self, precomputed):
+        """
+        Adds the gizmo folder of each app, if it has one, to Nuke's
+        plugin path.
+
+        :param precomputed: The sources of precomputed state, as returned by
+                            :meth:`_get_precomputed_state`.
+        """
         # Iterate over all apps, if there is a gizmo folder, add it to nuke path.
         for app in self.apps.values():
-            # Add gizmos to nuke path.
-            app_gizmo_folder = os.path.join(app.disk_location, "gizmos")
-            if os.path.exists(app_gizmo_folder):
-                # Now translate the path so that nuke is happy on Windows.
-                app_gizmo_folder = app_gizmo_folder.replace(os.path.sep, "/")
+            # If the launcher or the session that spawned this process already
+            # looked for this app's gizmos, there is no need to go to disk again.
+            found = False
+            for source in precomputed:
+                (found, app_gizmo_folder) = source.get_gizmo_folder(app.disk_location)
+                if found:
+                    break
+
+            if not found:
+                app_gizmo_folder = os.path.join(app.disk_location, "gizmos")
+                if os.path.exists(app_gizmo_folder):
+                    # Now translate the path so that nuke is happy on Windows.
+                    app_gizmo_folder = app_gizmo_folder.replace(os.path.sep, "/")
+                else:
+                    app_gizmo_folder = None
+
+            self._gizmo_folders[app.disk_location] = app_gizmo_folder
+
+            if app_gizmo_folder:
                 self.log_debug("Gizmos found - Adding %s to nuke.pluginAddPath() and NUKE_PATH" % app_gizmo_folder)
                 nuke.pluginAddPath(app_gizmo_folder)
                 # And also add it to the plugin path - this is so that any 
@@ -408,12 +586,99 @@ class NukeEngine(tank.platform.Engine):
                 # (for example if you do file->open or file->new)
                 tank.util.append_path_to_env_var("NUKE_PATH", app_gizmo_folder)
 
-        try:
-            self.log_user_attribute_metric("Nuke version",
-                nuke.env.get("NukeVersionString"))
-        except:
-            # ignore all errors. ex: using a core that doesn't support metrics
-            pass
+    def __log_startup_report(self):
+        """
+        Logs the time the engine startup took in a batch session, and the
+        memory the process used once it was done. A session started without
+        the farm profile records them as the baseline of its configuration,
+        which sessions started with it report what they saved against. See
+        `tk-nuke/python/tk_nuke/startup_report.py`.
+        """
+        # Note! not using the import as this confuses Nuke's callback system
+        # (several of the key scene callbacks are in the main init file).
+        from tk_nuke import startup_report
+
+        subsystems = ["gizmos", "callbacks", "session_env", "metrics"]
+        skipped = [s for s in subsystems if not self.subsystem_enabled(s)]
+        elapsed = time.time() - self._startup_time
+        memory = startup_report.get_memory()
+        key = startup_report.get_baseline_key(self)
+
+        msg = "Engine started in %.3fs, memory %s, skipped: %s" % (
+            elapsed,
+            "unknown" if memory is None else "%.1f MB" % memory,
+            ", ".join(skipped) or "nothing",
+        )
+        saved_time = None
+        saved_memory = None
+
+        if not self.farm_profile:
+            self.log_debug(msg)
+            try:
+                startup_report.write_baseline(key, elapsed, memory)
+            except (IOError, OSError), e:
+                self.log_debug("Unable to record the startup baseline: %s" % e)
+        else:
+            baseline = startup_report.read_baseline(key)
+            if baseline is None:
+                msg += (
+                    ". No baseline to compare with yet: one is recorded by every "
+                    "batch session started without %s." % startup_report.FARM_PROFILE_ENV_VAR
+                )
+            else:
+                (saved_time, saved_memory) = startup_report.get_savings(baseline, elapsed, memory)
+                msg += ". Saved %.3fs and %s against the full startup recorded %s." % (
+                    saved_time,
+                    "unknown memory" if saved_memory is None else "%.1f MB" % saved_memory,
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(baseline["time"])),
+                )
+            self.log_info("Farm profile: %s" % msg)
+
+        sgtk_trace.instant(
+            "startup_report",
+            elapsed=elapsed,
+            memory=memory,
+            skipped=skipped,
+            saved_time=saved_time,
+            saved_memory=saved_memory,
+        )
+
+    def _get_precomputed_state(self):
+        """
+        Returns the sources of engine state that were resolved outside of
+        this process and apply to the engine's current context: the snapshot
+        handed down by a parent Nuke session, and the launcher's startup
+        manifest.
+        """
+        # Note! not using the import as this confuses Nuke's callback system
+        # (several of the key scene callbacks are in the main init file).
+        import tk_nuke
+
+        sources = []
+        snapshot = tk_nuke.load_engine_snapshot()
+        if snapshot:
+            sources.append(snapshot)
+        manifest = sgtk_manifest.load_manifest(self)
+        if manifest:
+            sources.append(manifest)
+        return sources
+
+    def write_state_snapshot(self):
+        """
+        Hands what the engine has resolved down to the processes spawned by
+        file->new and file->open, so they don't have to do it again.
+        """
+        if not self.has_ui or self.hiero_enabled or self.studio_enabled:
+            return
+
+        # Note! not using the import as this confuses Nuke's callback system
+        # (several of the key scene callbacks are in the main init file).
+        import tk_nuke
+        tk_nuke.write_engine_snapshot(
+            self,
+            gizmo_folders=self._gizmo_folders,
+            favourite_dirs=self._favourite_dirs,
+        )
 
     def destroy_engine(self):
         """
@@ -421,6 +686,16 @@ class NukeEngine(tank.platform.Engine):
         """
         self.log_debug("%s: Destroying..." % self)
 
+        # Note! not using the import as this confuses Nuke's callback system
+        # (several of the key scene callbacks are in the main init file).
+        import tk_nuke
+
+        # A new engine writes its own snapshot, if it is started.
+        tk_nuke.remove_engine_snapshot()
+
+        for (label, stats) in tk_nuke.get_session_stats():
+            self.log_debug("%s: %s" % (label, stats))
+
         if self._context_switcher:
             self._context_switcher.destroy()
 
@@ -454,14 +729,39 @@ class NukeEngine(tank.platform.Engine):
         """
         self.log_debug("tk-nuke context changed to %s" % str(new_context))
 
-        # We also need to run the post init for Nuke, which will handle
-        # getting any gizmos setup.
+        # The processes spawned by file->new and file->open start in the
+        # context the engine is in now, not the one it was started in.
+        if self.subsystem_enabled("session_env"):
+            os.environ["TANK_NUKE_ENGINE_INIT_NAME"] = self.instance_name
+            os.environ["TANK_NUKE_ENGINE_INIT_CONTEXT"] = sgtk_handoff.encode_context(new_context)
+            os.environ["TANK_NUKE_ENGINE_INIT_PROJECT_ROOT"] = self.tank.project_path
+
+        # We also need to refresh what Nuke sets up for the context, which
+        # will handle getting any gizmos setup. In Nuke itself, it also
+        # rebuilds the menu for the new context. Panels and the recent files
+        # prewarm are only set up at startup.
         if not self.hiero_enabled:
-            self.post_app_init_nuke()
+            self._refresh_nuke_context(self.__get_menu_name())
 
-        if self._context_change_menu_rebuild:
+        if self._context_change_menu_rebuild and (self.hiero_enabled or self.studio_enabled):
             self.menu_generator.create_menu()
 
+        self.__prefetch_entities()
+
+    def __prefetch_entities(self):
+        """
+        Reads the Shotgun entities of the current context, and of the
+        session's other known contexts, in the background, so that switching
+        to them doesn't wait for Shotgun.
+        """
+        if not self.has_ui:
+            return
+
+        # Note! not using the import as this confuses Nuke's callback system
+        # (several of the key scene callbacks are in the main init file).
+        import tk_nuke
+        tk_nuke.get_entity_cache().prefetch_in_background(self.tank, self.context)
+
     #####################################################################################
     # Logging
 
@@ -766,22 +1066,53 @@ class NukeEngine(tank.platform.Engine):
         # isn't a way to distinguish between that and something the
         # user purposefully opened, and we don't want to hose the
         # toolkit context with that.
-        try:
-            tk = tank.tank_from_path(script_path)
+        # Note! not using the import as this confuses Nuke's callback system
+        # (several of the key scene callbacks are in the main init file).
+        import tk_nuke
+
+        if tk_nuke.use_background_resolution(self):
+            tk_nuke.get_context_resolver().resolve(
+                script_path,
+                self.context,
+                lambda tk, context: self._on_project_context_resolved(context),
+                lambda error, p=script_path: self.log_debug(
+                    "Unable to determine context for file: %s" % p
+                ),
+            )
+            return
 
+        try:
             # Extract a new context based on the file and change to that
             # context.
-            new_context = tk.context_from_path(
+            (tk, new_context) = tk_nuke.resolve_context(
                 script_path,
-                previous_context=self.context,
+                self.context,
+                on_late_result=lambda tk, context: self._on_project_context_resolved(context),
             )
 
-            if new_context != self.context:
+            if not sgtk_context_key.same_context(new_context, self.context):
                 tank.platform.change_context(new_context)
+        except tk_nuke.ContextResolveTimeout:
+            # Keep the current context until the real one is known.
+            pass
         except Exception:
             self.log_debug("Unable to determine context for file: %s" % script_path)
+
+    def _on_project_context_resolved(self, new_context):
+        """
+        Changes to the context of a newly opened project, once it has been
+        resolved in the background.
+
+        :param new_context: The project's sgtk.context.Context.
+        """
+        if not sgtk_context_key.same_context(new_context, self.context):
+            try:
+                tank.platform.change_context(new_context)
+            except Exception:
+                self.log_debug("Unable to change to context: %s" % new_context)
     
-    def __setup_favorite_dirs(self):
+    @sgtk_trace.traced("NukeEngine.__setup_favorite_dirs")
+    def __setup_favorite_dirs(self, precomputed):
         """
         Sets up nuke shortcut "favorite dirs" that are presented in the left hand side of 
         Nuke common dialogs (open, save).
@@ -789,6 +1120,9 @@ class NukeEngine(tank.platform.Engine):
         Nuke currently only writes favorites to disk in ~/.nuke/folders.nk. If you add/remove 
         one in the UI. Doing them via the api only updates them for the session (Nuke bug #3740). 
         See http://forums.thefoundry.co.uk/phpBB2/viewtopic.php?t=3481&start=15
+
+        :param precomputed: The sources of precomputed state, as returned by
+                            :meth:`_get_precomputed_state`.
         """
         engine_root_dir = self.disk_location
         sg_logo = os.path.abspath(os.path.join(engine_root_dir, "resources", "sg_logo_80px.png"))
@@ -827,6 +1161,38 @@ class NukeEngine(tank.platform.Engine):
         for favorite in self.get_setting("favourite_directories"):
             # Remove old directory
             nuke.removeFavoriteDir(favorite['display_name'])
+
+        self._favourite_dirs = self._get_favourite_dirs(precomputed)
+        for favorite in self._favourite_dirs:
+            # Add new directory 
+            nuke.addFavoriteDir(favorite['display_name'], 
+                                directory=favorite['path'],  
+                                type=(nuke.IMAGE|nuke.SCRIPT|nuke.GEO), 
+                                icon=favorite['icon'], 
+                                tooltip=favorite['path'])
+
+    def _get_favourite_dirs(self, precomputed):
+        """
+        Resolves the favourite directories from the engine's settings
+        against the current context.
+
+        :param precomputed: The sources of precomputed state, as returned by
+                            :meth:`_get_precomputed_state`.
+
+        :returns: A list of dicts with display_name, path and icon keys.
+        """
+        # The launcher or the session that spawned this process may have
+        # resolved these for the same context already.
+        for source in precomputed:
+            favourite_dirs = source.get_favourite_dirs(self.context)
+            if favourite_dirs is not None:
+                return favourite_dirs
+
+        engine_root_dir = self.disk_location
+        sg_logo = os.path.abspath(os.path.join(engine_root_dir, "resources", "sg_logo_80px.png"))
+
+        favourite_dirs = []
+        for favorite in self.get_setting("favourite_directories"):
             try:
                 template = self.get_template_by_name(favorite['template_directory'])
                 fields = self.context.as_template_fields(template)
@@ -837,14 +1203,16 @@ class NukeEngine(tank.platform.Engine):
                 self.log_exception(msg)
                 continue
 
-            # Add new directory 
             icon_path = favorite.get('icon')
             if not os.path.isfile(icon_path) or not os.path.exists(icon_path):
                 icon_path = sg_logo
 
-            nuke.addFavoriteDir(favorite['display_name'], 
-                                directory=path,  
-                                type=(nuke.IMAGE|nuke.SCRIPT|nuke.GEO), 
-                                icon=icon_path, 
-                                tooltip=path)
-        
+            favourite_dirs.append(
+                dict(
+                    display_name=favorite['display_name'],
+                    path=path,
+                    icon=icon_path,
+                )
+            )
+
+        return favourite_dirs
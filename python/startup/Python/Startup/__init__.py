@@ -8,64 +8,301 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+"""
+Startup plugin bootstrapping Toolkit in Hiero and Nuke Studio.
+
+When Hiero or Nuke Studio is launched with a project to open and the
+TK_NUKE_OVERLAP_PROJECT_LOAD environment variable set, the project is loaded
+first, while its context is resolved in the background, and the engine is
+started in that context when `kAfterProjectLoad` fires. Otherwise the engine
+is started in the launch context first, and switches to the project's once
+it is loaded. The time until the application is interactive is logged in
+either mode, so that the two can be compared.
+"""
+
 import os
+import sys
+import time
+import threading
+
+# The startup tracer, context hand-off and module index live in the root of
+# the startup directory, which is two levels above this plugin package.
+_startup_path = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+sys.path.append(_startup_path)
+try:
+    import sgtk_trace
+    import sgtk_handoff
+    import sgtk_finder
+    import sgtk_bundle
+    import sgtk_prefetch
+    import sgtk_prewarm
+    import sgtk_context_daemon
+finally:
+    sys.path.pop()
+
+sgtk_trace.trace_imports()
+
+_module_finder = sgtk_finder.install(os.path.dirname(_startup_path))
+_bundle_finder = sgtk_bundle.install()
+
+# When set, the project passed in TANK_FILE_TO_OPEN is loaded before the
+# engine is started rather than after, see _bootstrap_overlapped().
+OVERLAP_ENV_VAR = "TK_NUKE_OVERLAP_PROJECT_LOAD"
 
 def bootstrap_sgtk():
     """
     Bootstraps SGTK to Nuke Studio or Hiero.
     """
-    import hiero.core
-    _setup_sgtk()
+    start_time = time.time()
+    sgtk_trace.set_process_name("Hiero/Nuke Studio")
+    with sgtk_trace.span("sgtk_startup.bootstrap_sgtk"):
+        file_to_open = os.environ.get("TANK_FILE_TO_OPEN")
+        if file_to_open and os.environ.get(OVERLAP_ENV_VAR):
+            mode = "overlapped"
+            engine = _bootstrap_overlapped(file_to_open)
+        else:
+            mode = "sequential"
+            engine = _bootstrap_sequential(file_to_open)
 
-    # Check if we should open a file.
-    file_to_open = os.environ.get("TANK_FILE_TO_OPEN")
-    if file_to_open:
-        hiero.core.openProject(file_to_open.replace(os.path.sep, "/"))
+        sgtk_trace.instant("module_index", **sgtk_finder.stats(_module_finder))
+        sgtk_trace.instant("python_bundle", **sgtk_bundle.stats(_bundle_finder))
+
+    # Comparing this between launches with and without the overlapped mode
+    # shows what it saves.
+    elapsed = time.time() - start_time
+    sgtk_trace.instant("time_to_interactive", elapsed=elapsed, mode=mode)
+    if engine:
+        engine.log_debug(
+            "Startup: interactive after %.3fs (%s project load)" % (elapsed, mode)
+        )
+
+    # Only the project file itself is prefetched for Hiero and Nuke Studio.
+    report = sgtk_prefetch.load_report()
+    if report:
+        sgtk_prefetch.remove_report(sgtk_prefetch.get_report_path())
+        (msg, figures) = sgtk_prefetch.get_summary(report, [report["script"]])
+        sgtk_trace.instant("prefetch_report", **figures)
+        if engine:
+            engine.log_debug(msg)
 
     # Clean up temp env vars.
     _clean_env()
 
-def _clean_env():
+def _bootstrap_sequential(file_to_open):
     """
-    Cleans up SGTK related environment variables.
+    Starts the engine, then loads the project to open, if any. The engine
+    then switches to the project's context when the project load event
+    fires.
+
+    :param file_to_open:    The path of the project to open, or None.
+
+    :returns: The started engine, or None.
     """
-    for var in ["TANK_ENGINE", "TANK_CONTEXT", "TANK_FILE_TO_OPEN"]:
-        if var in os.environ:
-            del os.environ[var]
+    import hiero.core
 
-def _setup_sgtk():
+    engine = _setup_sgtk()
+
+    # Check if we should open a file.
+    if file_to_open:
+        with sgtk_trace.span("hiero.core.openProject", path=file_to_open):
+            hiero.core.openProject(file_to_open.replace(os.path.sep, "/"))
+
+    return engine
+
+def _bootstrap_overlapped(file_to_open):
     """
-    Extracts the necessary information from the environment and starts
-    the tk-nuke engine.
+    Loads the project to open while the project's context is resolved on a
+    background thread, then starts the engine straight in that context once
+    the project load event fires. The context resolution only talks to
+    Toolkit and Shotgun, never to Hiero or Qt, and it replaces the context
+    switch the engine would otherwise make right after starting.
+
+    If there is no engine to start, or Toolkit can't be imported, this falls
+    back to :func:`_bootstrap_sequential`.
+
+    :param file_to_open:    The path of the project to open.
+
+    :returns: The started engine, or None.
     """
     import hiero.core
 
+    # Without an engine to start, the project is still opened, and the
+    # sequential bootstrap reports why the engine couldn't be started.
+    if not "TANK_ENGINE" in os.environ:
+        return _bootstrap_sequential(file_to_open)
+    engine_name = os.environ.get("TANK_ENGINE")
+
+    # Only imported to have it done on the main thread, so that the
+    # background thread doesn't hold the import lock for long while the
+    # project is loading. _start_engine() uses it.
     try:
-        import tank
+        with sgtk_trace.span("import tank"):
+            __import__("tank")
+    except Exception:
+        return _bootstrap_sequential(file_to_open)
+
+    resolved = dict()
+    resolver = threading.Thread(
+        target=_resolve_project_context,
+        args=(file_to_open, resolved),
+    )
+    resolver.daemon = True
+    resolver.start()
+
+    engines = []
+
+    def _on_project_load(event):
+        hiero.core.events.unregisterInterest("kAfterProjectLoad", _on_project_load)
+        with sgtk_trace.span("sgtk_startup.wait_for_context"):
+            resolver.join()
+        engines.append(_start_engine(engine_name, resolved))
+
+    hiero.core.events.registerInterest("kAfterProjectLoad", _on_project_load)
+    try:
+        with sgtk_trace.span("hiero.core.openProject", path=file_to_open):
+            hiero.core.openProject(file_to_open.replace(os.path.sep, "/"))
     except Exception, e:
-        hiero.core.log.error("Shotgun: Could not import sgtk! Disabling: %s" % str(e))
-        return
+        hiero.core.log.error("Shotgun: Could not open %s: %s" % (file_to_open, str(e)))
 
-    if not "TANK_ENGINE" in os.environ:
-        hiero.core.log.error("Shotgun: Unable to determine engine to start!")
+    if not engines:
+        # The load failed or didn't fire its event, so start the engine
+        # anyway, in whatever context could be resolved.
+        try:
+            hiero.core.events.unregisterInterest("kAfterProjectLoad", _on_project_load)
+        except Exception:
+            pass
+        resolver.join()
+        engines.append(_start_engine(engine_name, resolved))
+
+    return engines[0]
+
+@sgtk_trace.traced("sgtk_startup._resolve_project_context")
+def _resolve_project_context(file_to_open, resolved):
+    """
+    Decodes the launch context and resolves the context of the project to
+    open from it. Runs on a background thread.
+
+    :param file_to_open:    The path of the project to open.
+    :param resolved:        A dict receiving the launch context as "context",
+                            the project's context as "project_context", and
+                            the decoding error, if any, as "error".
+    """
+    try:
+        context = sgtk_handoff.decode_context(sgtk_handoff.get_launch_payload())
+    except Exception, e:
+        resolved["error"] = e
         return
+    resolved["context"] = context
 
-    engine_name = os.environ.get("TANK_ENGINE")
     try:
-        context = tank.context.deserialize(os.environ.get("TANK_CONTEXT"))
+        # The host's context daemon may already know the project.
+        project_context = sgtk_context_daemon.resolve_context(
+            context.tank,
+            file_to_open,
+            context,
+        )
+        if project_context is None:
+            project_context = context.tank.context_from_path(
+                file_to_open,
+                previous_context=context,
+            )
+        resolved["project_context"] = project_context
+    except Exception:
+        # The project lives outside of the pipeline configuration, so the
+        # engine starts in the launch context, as it would have stayed in
+        # it after the project load anyway.
+        pass
+
+def _start_engine(engine_name, resolved):
+    """
+    Starts the engine in the context resolved by _resolve_project_context().
+
+    :param engine_name: The instance name of the engine to start.
+    :param resolved:    The dict filled in by _resolve_project_context().
+
+    :returns: The started engine, or None.
+    """
+    import hiero.core
+
+    try:
+        with sgtk_trace.span("import tank"):
+            import tank
     except Exception, e:
+        hiero.core.log.error("Shotgun: Could not import sgtk! Disabling: %s" % str(e))
+        return None
+
+    if "context" not in resolved:
         hiero.core.log.error(
             "Shotgun: Could not create context! "
-            "Shotgun Toolkit will be disabled. Details: %s" % str(e)
+            "Shotgun Toolkit will be disabled. Details: %s" % str(resolved.get("error"))
         )
-        return
+        return None
+
+    context = resolved.get("project_context") or resolved["context"]
+
+    # Warm the apps up in the background while the engine starts.
+    prewarmer = sgtk_prewarm.start_prewarm(engine_name, context)
 
+    start_time = time.time()
     try:
-        engine = tank.platform.start_engine(engine_name, context.tank, context)
+        with sgtk_trace.span("tank.platform.start_engine", engine=engine_name):
+            engine = tank.platform.start_engine(engine_name, context.tank, context)
     except Exception, e:
         hiero.core.log.error("Shotgun: Could not start engine: %s" % str(e))
-        return
+        return None
 
+    if prewarmer:
+        engine.log_debug(prewarmer.summary(time.time() - start_time))
+    return engine
 
-bootstrap_sgtk()
+def _get_engine_name():
+    """
+    Returns the name of the engine to start, logging an error if it
+    wasn't passed down by the launcher.
+    """
+    import hiero.core
 
+    if not "TANK_ENGINE" in os.environ:
+        hiero.core.log.error("Shotgun: Unable to determine engine to start!")
+        return None
+    return os.environ.get("TANK_ENGINE")
+
+def _clean_env():
+    """
+    Cleans up SGTK related environment variables.
+    """
+    for var in [
+        "TANK_ENGINE",
+        "TANK_CONTEXT",
+        sgtk_handoff.CONTEXT_ENV_VAR,
+        "TANK_FILE_TO_OPEN",
+        sgtk_prefetch.REPORT_ENV_VAR,
+    ]:
+        if var in os.environ:
+            del os.environ[var]
+
+@sgtk_trace.traced("sgtk_startup._setup_sgtk")
+def _setup_sgtk():
+    """
+    Extracts the necessary information from the environment and starts
+    the tk-nuke engine.
+
+    :returns: The started engine, or None.
+    """
+    engine_name = _get_engine_name()
+    if not engine_name:
+        return None
+
+    resolved = dict()
+    try:
+        with sgtk_trace.span("sgtk_handoff.decode_context"):
+            resolved["context"] = sgtk_handoff.decode_context(sgtk_handoff.get_launch_payload())
+    except Exception, e:
+        resolved["error"] = e
+
+    return _start_engine(engine_name, resolved)
+
+
+bootstrap_sgtk()
@@ -20,11 +20,67 @@ def bootstrap(engine_name, context, app_path, app_args, extra_args):
               Hiero, and Nuke Studio, see the engine documentation in
               `tk-nuke/engine.py`.
     """
-    import tank
-
     startup_path = os.path.dirname(
         os.path.abspath(sys.modules[bootstrap.__module__].__file__)
     )
+
+    sys.path.append(startup_path)
+    try:
+        import sgtk_trace
+        import sgtk_manifest
+        import sgtk_handoff
+        import sgtk_bundle
+        import sgtk_prefetch
+        import sgtk_context_daemon
+    finally:
+        sys.path.pop()
+
+    sgtk_trace.set_process_name("Launcher")
+    with sgtk_trace.span("bootstrap.bootstrap", app_path=app_path):
+        # Start reading the file to open as early as possible, if requested.
+        sgtk_prefetch.start_prefetch(os.environ.get("TANK_FILE_TO_OPEN"))
+
+        result = _bootstrap(startup_path, app_path, app_args)
+
+        if context is None:
+            os.environ.pop(sgtk_handoff.CONTEXT_ENV_VAR, None)
+        else:
+            # Hand the context to the DCC in the compact format, which is
+            # smaller and quicker to decode than a serialized context. The
+            # standard TANK_CONTEXT is left for the tools that read it.
+            os.environ[sgtk_handoff.CONTEXT_ENV_VAR] = sgtk_handoff.encode_context(context)
+
+            # Resolve what we can of the engine's startup state while the DCC
+            # is busy loading, rather than once the engine is up.
+            sgtk_manifest.start_manifest_build(engine_name, context)
+
+            # Have the engine and app code imported from the configuration's
+            # Python bundle, if one has been built.
+            bundle_path = sgtk_bundle.get_bundle_path(context.tank)
+            if os.path.isfile(bundle_path):
+                os.environ[sgtk_bundle.BUNDLE_ENV_VAR] = bundle_path
+            elif sgtk_bundle.BUNDLE_ENV_VAR in os.environ:
+                del os.environ[sgtk_bundle.BUNDLE_ENV_VAR]
+
+            # Have a context daemon running for the DCC to ask, if requested.
+            sgtk_context_daemon.ensure_running(
+                context.tank.pipeline_configuration.get_path()
+            )
+
+        return result
+
+def _bootstrap(startup_path, app_path, app_args):
+    """
+    Sets up the environment for the DCC that is about to be launched.
+
+    :param startup_path:    The path to the engine's startup directory.
+    :param app_path:        The path to the DCC executable.
+    :param app_args:        The arguments the DCC will be launched with.
+
+    :returns: A tuple of the (possibly modified) app path and app args.
+    """
+    import tank
+
     app_args = app_args or ""
 
     if "hiero" in app_path.lower() or "--hiero" in app_args:
@@ -0,0 +1,370 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Python bundle holding the engine's and the apps' Python code in one archive.
+
+Importing the engine and its apps from loose files means opening a great many
+small `.py` and `.pyc` files, which is slow when the pipeline configuration
+lives on network storage. A bundle is a zip archive holding the packages of
+the engine's `python` folder and of the apps' `python` folders, precompiled,
+which Python can import from directly. It is stored in the pipeline
+configuration's `config` folder, so that each version of a configuration
+carries its own bundle.
+
+To build the bundle for a pipeline configuration, run::
+
+    python tk-nuke/python/startup/sgtk_bundle.py /path/to/pipeline_config [engine_instance_name]
+
+The bundle has to be rebuilt whenever the engine or app code changes, and
+deleting it is always safe. The launcher points the DCC at the bundle when
+there is one, and everything is imported from the loose files otherwise.
+The bundle records the hash of the configuration it was built for, see
+sgtk_paths, which changes along with the descriptors of the engine and apps,
+and the modification time of each bundled package's folder, and isn't used
+once either has changed. That takes a single call per package, but only sees
+files being added to or removed from the top of a package, so a bundle must
+be rebuilt, or deleted, after editing code in place through a dev
+descriptor. The build compiles the loose modules first, so that Python
+doesn't write their compiled versions, and change their folders, later on.
+
+Data files are bundled alongside the modules, but code that opens files next
+to its `__file__` directly, rather than through its app's disk location,
+can't read them from the archive, so configurations running such apps should
+not use a bundle.
+
+Packages are only served from the bundle when the folder they were bundled
+from is on the search path a normal import would have used, and no entry
+searched before it holds a module or package of the same name, see
+sgtk_finder, so a context switch that brings in different app versions falls
+back to the loose files, and the bundle never changes which code gets
+imported. Packages found in more than one of the bundled folders are left
+out.
+"""
+
+import os
+import sys
+import imp
+import json
+import time
+import struct
+import marshal
+import zipfile
+import zipimport
+import compileall
+
+import sgtk_paths
+import sgtk_finder
+
+BUNDLE_VERSION = 3
+BUNDLE_ENV_VAR = "TK_NUKE_PYTHON_BUNDLE"
+BUNDLE_FILE_NAME = "tk-nuke-python.zip"
+
+# The bundle's own description, stored inside the archive.
+_METADATA_NAME = "tk-nuke-bundle.json"
+
+
+def get_bundle_path(tk):
+    """
+    Returns the path where the bundle of the given Toolkit instance's
+    pipeline configuration is stored.
+
+    :param tk:  A Toolkit API instance.
+    """
+    return os.path.join(
+        tk.pipeline_configuration.get_config_location(),
+        BUNDLE_FILE_NAME,
+    )
+
+
+class BundleFinder(object):
+    """
+    A PEP 302 meta path finder serving top-level packages from a bundle.
+
+    Submodules are imported through the zipimport path hook, as the
+    `__path__` of a package loaded from the bundle points inside it.
+    """
+    def __init__(self, bundle_path):
+        """
+        :param bundle_path: The path to the bundle.
+        """
+        self._bundle_path = bundle_path
+        self._importer = zipimport.zipimporter(bundle_path)
+        metadata = json.loads(self._importer.get_data(_METADATA_NAME))
+        if metadata.get("version") != BUNDLE_VERSION:
+            raise ImportError("Unsupported bundle version in %s" % bundle_path)
+        if not _is_current(metadata):
+            raise ImportError("%s is older than the code it was built from" % bundle_path)
+        self._packages = dict(
+            (str(name), folder)
+            for (name, folder) in metadata["packages"].iteritems()
+        )
+        # The names in each search path entry listed so far, see
+        # sgtk_finder.is_found_first().
+        self._listings = dict()
+        self.hits = 0
+
+    @property
+    def bundle_path(self):
+        """
+        The path to the bundle.
+        """
+        return self._bundle_path
+
+    @property
+    def package_count(self):
+        """
+        The number of top-level packages in the bundle.
+        """
+        return len(self._packages)
+
+    def find_module(self, fullname, path=None):
+        """
+        Returns a loader for the given module if it is a top-level package
+        in the bundle, as required by the PEP 302 finder protocol.
+
+        :param fullname:    The fully qualified name of the module.
+        :param path:        The parent package's __path__, or None for a
+                            top-level module.
+        """
+        if path is not None:
+            return None
+
+        source_folder = self._packages.get(fullname)
+        if source_folder is None:
+            return None
+
+        if not sgtk_finder.is_found_first(fullname, source_folder, sys.path, self._listings):
+            return None
+
+        self.hits += 1
+        return self._importer
+
+
+def _is_current(metadata):
+    """
+    Whether the configuration a bundle was built for is unchanged, and the
+    bundled packages' folders haven't changed since.
+
+    :param metadata:    The bundle's description.
+    """
+    config_path = metadata.get("config_path")
+    if config_path and sgtk_paths.get_config_hash(config_path) != metadata["config_hash"]:
+        return False
+    try:
+        for (path, mtime) in metadata["folders"].iteritems():
+            if os.path.getmtime(path) != mtime:
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def install():
+    """
+    Installs a finder for the bundle the launcher pointed the environment
+    at, if there is one and no bundle finder is installed yet.
+
+    :returns: The installed finder, or None.
+    """
+    bundle_path = os.environ.get(BUNDLE_ENV_VAR)
+    if not bundle_path or not os.path.isfile(bundle_path):
+        return None
+
+    for finder in sys.meta_path:
+        if finder.__class__.__name__ == BundleFinder.__name__:
+            return finder
+
+    try:
+        finder = BundleFinder(bundle_path)
+    except Exception:
+        # The bundle is stale or unreadable, so everything is imported from
+        # the loose files instead.
+        return None
+
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def stats(finder):
+    """
+    Returns a dict describing the given finder, for reporting.
+
+    :param finder:  An installed finder, or None.
+    """
+    if finder is None:
+        return dict(enabled=False)
+    return dict(
+        enabled=True,
+        packages=finder.package_count,
+        hits=finder.hits,
+    )
+
+
+def build_bundle(bundle_path, python_folders, config_path=None):
+    """
+    Writes a bundle holding the packages found in the given folders.
+
+    :param bundle_path:     The path of the bundle to write.
+    :param python_folders:  The python folders to bundle.
+    :param config_path:     The root path of the pipeline configuration the
+                            bundle is for, if it is only to be used while
+                            the configuration is unchanged.
+
+    :returns: A list of the names of the bundled packages.
+    """
+    # Find the packages to bundle. The engine's startup scripts are bundled
+    # with the engine, as tk_nuke loads them relative to its own location.
+    packages = dict()
+    duplicates = set()
+    for folder in python_folders:
+        folder = os.path.normpath(folder)
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            if not os.path.isfile(os.path.join(folder, name, "__init__.py")):
+                continue
+            if name in packages and packages[name] != folder:
+                duplicates.add(name)
+            packages[name] = folder
+
+    for name in duplicates:
+        del packages[name]
+
+    folders = dict()
+    for (name, folder) in packages.iteritems():
+        package_path = os.path.join(folder, name)
+        # Failing to compile, in a read-only folder for instance, is fine.
+        compileall.compile_dir(package_path, quiet=1)
+        folders[package_path] = os.path.getmtime(package_path)
+
+    temp_path = "%s.%d.tmp" % (bundle_path, os.getpid())
+    bundle = zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED)
+    try:
+        for (name, folder) in sorted(packages.iteritems()):
+            _add_package(bundle, bundle_path, folder, name)
+        bundle.writestr(
+            _METADATA_NAME,
+            json.dumps(dict(
+                version=BUNDLE_VERSION,
+                packages=packages,
+                config_path=config_path,
+                config_hash=config_path and sgtk_paths.get_config_hash(config_path),
+                folders=folders,
+            )),
+        )
+    finally:
+        bundle.close()
+
+    if os.path.exists(bundle_path):
+        os.remove(bundle_path)
+    os.rename(temp_path, bundle_path)
+
+    return sorted(packages)
+
+
+def _add_package(bundle, bundle_path, folder, package_name):
+    """
+    Adds a package's modules and data files to the bundle, along with
+    compiled versions of its modules.
+
+    :param bundle:          The open zipfile.ZipFile being written.
+    :param bundle_path:     The final path of the bundle, used as the file
+                            name of the compiled code.
+    :param folder:          The folder holding the package.
+    :param package_name:    The name of the package's folder.
+    """
+    for (dir_path, dir_names, file_names) in os.walk(os.path.join(folder, package_name)):
+        for file_name in file_names:
+            if file_name.endswith((".pyc", ".pyo")):
+                continue
+
+            path = os.path.join(dir_path, file_name)
+            arc_name = os.path.relpath(path, folder).replace(os.path.sep, "/")
+            mtime = int(os.path.getmtime(path))
+
+            with open(path, "rb") as fh:
+                data = fh.read()
+
+            info = zipfile.ZipInfo(arc_name, time.localtime(mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            bundle.writestr(info, data)
+
+            if not file_name.endswith(".py"):
+                continue
+
+            # zipimport only uses compiled code whose timestamp matches the
+            # source's entry in the archive, so use the same one.
+            code = compile(
+                data.replace("\r\n", "\n"),
+                os.path.join(bundle_path, arc_name),
+                "exec",
+            )
+            info = zipfile.ZipInfo(arc_name + "c", time.localtime(mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            bundle.writestr(
+                info,
+                imp.get_magic() + struct.pack("<I", mtime) + marshal.dumps(code),
+            )
+
+
+def build_for_config(config_path, engine_name="tk-nuke"):
+    """
+    Builds the bundle for a pipeline configuration, holding the engine's
+    code and that of every app it runs in any environment.
+
+    :param config_path: The path to the pipeline configuration.
+    :param engine_name: The instance name of the engine.
+
+    :returns: A tuple of the bundle's path and the names of the bundled
+              packages.
+    """
+    import tank
+
+    tk = tank.tank_from_path(config_path)
+    config = tk.pipeline_configuration
+
+    python_folders = []
+    for env_name in config.get_environments():
+        env = config.get_environment(env_name)
+        if engine_name not in env.get_engines():
+            continue
+        engine_location = env.get_engine_descriptor(engine_name).get_path()
+        python_folders.append(os.path.join(engine_location, "python"))
+        for app_name in env.get_apps(engine_name):
+            app_location = env.get_app_descriptor(engine_name, app_name).get_path()
+            python_folders.append(os.path.join(app_location, "python"))
+
+    bundle_path = get_bundle_path(tk)
+    return (bundle_path, build_bundle(bundle_path, python_folders, config.get_path()))
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+    """
+    if not args or len(args) > 2:
+        print "Usage: sgtk_bundle.py pipeline_config_path [engine_instance_name]"
+        return 1
+
+    # Use the pipeline configuration's own core.
+    sys.path.insert(0, os.path.join(args[0], "install", "core", "python"))
+
+    (bundle_path, packages) = build_for_config(*args)
+    print "Bundled %d packages into %s:" % (len(packages), bundle_path)
+    for name in packages:
+        print "    %s" % name
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,718 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Context resolution daemon shared by the Nuke processes of a host.
+
+Every Nuke process warms its own Toolkit instances and context caches, and
+file->open keeps starting new ones. When the TK_NUKE_CONTEXT_DAEMON
+environment variable is set, the launcher starts a daemon for the current
+user on the host, if one isn't running yet, which keeps warm Toolkit
+instances and contexts for all of them. It is run with the Python
+interpreter the pipeline configuration names in its interpreter_<os>.cfg
+file, and isn't started if there is none. The variable holds the path of the
+daemon's Unix domain socket, or 1 to use the default one in the user's
+private directory, see sgtk_userdir. Clients only talk to a socket that
+belongs to the current user, and only accept contexts of the pipeline
+configuration they asked with.
+
+The context caches of the tk_nuke package, which the script callbacks and
+the Nuke Studio context switcher go through, and the Hiero and Nuke Studio
+bootstrap, ask the daemon for the contexts they don't hold, and resolve them
+in-process as before when the daemon can't be reached, or doesn't answer
+within CLIENT_TIMEOUT seconds. Clients only stop asking the daemon for a
+while when it isn't there, not when it is busy resolving a path it doesn't
+hold yet. Contexts are passed in the hand-off format of sgtk_handoff. There
+are no Unix domain sockets on Windows, where the daemon is never used.
+
+The daemon exits once it hasn't been asked anything for IDLE_TIMEOUT
+seconds. It can also be run, queried and benchmarked by hand:
+
+    python sgtk_context_daemon.py serve pipeline_config_path
+    python sgtk_context_daemon.py query path [path ...]
+    python sgtk_context_daemon.py stats
+    python sgtk_context_daemon.py benchmark pipeline_config_path path [iterations]
+    python sgtk_context_daemon.py selftest
+
+The selftest command checks the protocol, concurrent clients and the
+fallback against a daemon with a stand-in resolver, and needs no Toolkit
+installation. The benchmark command compares the latency of resolving a
+path in-process, with a cold and a warm Toolkit instance, with that of
+asking the daemon.
+
+This module only depends on the standard library. Toolkit is imported when
+a context is resolved or decoded.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+import collections
+import SocketServer
+
+import sgtk_handoff
+import sgtk_userdir
+from sgtk_paths import normalize_path, get_config_hash
+
+DAEMON_ENV_VAR = "TK_NUKE_CONTEXT_DAEMON"
+PROTOCOL_VERSION = 1
+
+# How long a client waits for an answer, in seconds. Clients wait on Nuke's
+# main thread, so a daemon that hangs must not hold them up for long.
+CLIENT_TIMEOUT = 0.3
+
+# How long clients stop trying to reach a daemon that isn't listening.
+RETRY_INTERVAL = 30.0
+
+# How long the daemon waits for requests before exiting.
+IDLE_TIMEOUT = 4 * 3600.0
+
+# The number of contexts the daemon holds.
+MAX_CONTEXTS = 4096
+
+# When clients can try to reach the daemon again after a failure.
+_retry_after = 0.0
+
+
+def enabled():
+    """
+    Whether the daemon has been requested, and can be used on this platform.
+    """
+    return bool(os.environ.get(DAEMON_ENV_VAR)) and hasattr(socket, "AF_UNIX")
+
+
+def get_socket_path():
+    """
+    Returns the path of the daemon's socket.
+
+    :raises OSError: If the user's directory can't be used.
+    """
+    value = os.environ.get(DAEMON_ENV_VAR)
+    if value and value != "1":
+        return value
+    return os.path.join(sgtk_userdir.get_user_dir(), "contexts.sock")
+
+
+##########################################################################
+# client
+
+def request(message, socket_path=None, timeout=CLIENT_TIMEOUT):
+    """
+    Sends a request to the daemon and returns its answer.
+
+    :param message:     The request, as a dict.
+    :param socket_path: The daemon's socket. Defaults to :func:`get_socket_path`.
+    :param timeout:     How long to wait for the answer, in seconds.
+
+    :returns: The answer, as a dict.
+    :raises: `socket.error`, `OSError` or `ValueError` if the daemon can't be
+             reached, its socket belongs to another user, or it answers
+             nonsense.
+    """
+    socket_path = socket_path or get_socket_path()
+    if not sgtk_userdir.is_owned(socket_path):
+        raise ValueError("%s doesn't belong to the current user" % socket_path)
+
+    message = dict(message, version=PROTOCOL_VERSION)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message) + "\n")
+        data = ""
+        while not data.endswith("\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        sock.close()
+    return json.loads(data)
+
+
+def query(path, previous=None, check_mtime=True, socket_path=None, timeout=CLIENT_TIMEOUT):
+    """
+    Asks the daemon for the context of the given path.
+
+    :param path:        The path of the script or project.
+    :param previous:    The encoded context to inherit from, or None.
+    :param check_mtime: Whether a context the daemon holds for the path is
+                        dropped if the file has been modified since.
+    :param socket_path: The daemon's socket. Defaults to :func:`get_socket_path`.
+    :param timeout:     How long to wait for the answer, in seconds.
+
+    :returns: The encoded context, or None if the daemon couldn't resolve it
+              or can't be reached.
+    """
+    global _retry_after
+
+    if time.time() < _retry_after:
+        return None
+
+    try:
+        answer = request(
+            dict(op="resolve", path=path, previous=previous, check_mtime=check_mtime),
+            socket_path,
+            timeout,
+        )
+    except socket.timeout:
+        # The daemon is there but busy, likely resolving the path from
+        # scratch: it will hold the context the next time it is asked.
+        return None
+    except (socket.error, OSError, ValueError):
+        # Don't wait on a daemon that isn't there again for a while.
+        _retry_after = time.time() + RETRY_INTERVAL
+        return None
+
+    context = answer.get("context")
+    return str(context) if context else None
+
+
+def resolve_context(tk, path, previous_context=None, check_mtime=True):
+    """
+    Returns the context of the given path, as resolved by the daemon, if it
+    is enabled and can be reached.
+
+    :param tk:                  The Toolkit API instance to decode the context
+                                with, if it is of the right configuration.
+    :param path:                The path of the script or project.
+    :param previous_context:    The context to inherit from, as for
+                                `tk.context_from_path()`.
+    :param check_mtime:         Whether a context the daemon holds for the
+                                path is dropped if the file has been modified
+                                since.
+
+    :returns: A sgtk.context.Context, or None if it has to be resolved
+              in-process, which is also the case if the daemon resolved it
+              with another pipeline configuration than tk's.
+    """
+    if not enabled():
+        return None
+
+    previous = None
+    if previous_context is not None:
+        previous = sgtk_handoff.encode_context(previous_context, inline=True)
+
+    payload = query(path, previous, check_mtime)
+    if payload is None:
+        return None
+    try:
+        return sgtk_handoff.decode_context(payload, tk, same_config=True)
+    except Exception:
+        # Resolving it in-process reports the problem properly.
+        return None
+
+
+def ping(socket_path=None):
+    """
+    Returns the daemon's counters, or None if it can't be reached.
+
+    :param socket_path: The daemon's socket. Defaults to :func:`get_socket_path`.
+    """
+    try:
+        return request(dict(op="stats"), socket_path, timeout=1.0)
+    except (socket.error, OSError, ValueError):
+        return None
+
+
+def get_interpreter(config_path):
+    """
+    Returns the Python interpreter the given pipeline configuration runs its
+    own scripts with, as set in its config/core/interpreter_<os>.cfg file.
+
+    :param config_path: The root path of the pipeline configuration.
+
+    :returns: The path of the interpreter, or None if it isn't set or can't
+              be run.
+    """
+    os_name = {"darwin": "Darwin", "win32": "Windows"}.get(sys.platform, "Linux")
+    cfg_path = os.path.join(config_path, "config", "core", "interpreter_%s.cfg" % os_name)
+    try:
+        with open(cfg_path) as fh:
+            interpreter = fh.read().strip()
+    except IOError:
+        return None
+    interpreter = os.path.expanduser(os.path.expandvars(interpreter))
+    if not os.path.isfile(interpreter) or not os.access(interpreter, os.X_OK):
+        return None
+    return interpreter
+
+
+def ensure_running(config_path):
+    """
+    Starts the daemon in the background with the core and the interpreter of
+    the given pipeline configuration, if it has been requested and isn't
+    running yet. This is called by the launcher, whose own executable may not
+    be a Python interpreter, so no daemon is started if the configuration
+    doesn't name one.
+
+    :param config_path: The root path of the pipeline configuration.
+
+    :returns: Whether a daemon was started.
+    """
+    if not enabled() or sys.platform == "win32" or ping() is not None:
+        return False
+    interpreter = get_interpreter(config_path)
+    if interpreter is None:
+        return False
+    try:
+        socket_path = get_socket_path()
+    except OSError:
+        # The processes resolve their contexts themselves.
+        return False
+
+    with open(os.devnull, "r+") as devnull:
+        subprocess.Popen(
+            [interpreter, os.path.abspath(__file__), "serve", config_path, socket_path],
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+        )
+    return True
+
+
+##########################################################################
+# daemon
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Answers one request of a client.
+    """
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            answer = self.server.daemon.handle(message)
+        except Exception, e:
+            answer = dict(error=str(e))
+        self.wfile.write(json.dumps(answer) + "\n")
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+    # Every Nuke process of the host may connect at once, and clients that
+    # are turned away stop asking for a while.
+    request_queue_size = 64
+
+
+class ContextDaemon(object):
+    """
+    Resolves contexts for the clients of a Unix domain socket, keeping the
+    Toolkit instances and the contexts it resolves.
+    """
+    def __init__(self, socket_path=None, idle_timeout=IDLE_TIMEOUT):
+        """
+        :param socket_path:     The socket to listen on. Defaults to
+                                :func:`get_socket_path`.
+        :param idle_timeout:    How long to wait for requests before exiting,
+                                in seconds.
+        """
+        self._socket_path = socket_path or get_socket_path()
+        self._idle_timeout = idle_timeout
+        self._server = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._instances = dict()
+        self._contexts = collections.OrderedDict()
+        self._last_request = time.time()
+
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def socket_path(self):
+        """
+        The path of the socket the daemon listens on.
+        """
+        return self._socket_path
+
+    def bind(self):
+        """
+        Starts listening on the socket, taking over a stale one.
+
+        :returns: False if another daemon is already listening on it, or
+                  the socket belongs to another user.
+        """
+        if os.path.lexists(self._socket_path):
+            if not sgtk_userdir.is_owned(self._socket_path):
+                return False
+            if ping(self._socket_path) is not None:
+                return False
+            os.remove(self._socket_path)
+
+        old_umask = os.umask(0o077)
+        try:
+            self._server = _Server(self._socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon = self
+        self._server.timeout = 60.0
+        return True
+
+    def serve(self):
+        """
+        Answers requests until the daemon has been idle for too long, or
+        :meth:`stop` is called.
+        """
+        try:
+            while (
+                not self._stopped.is_set()
+                and time.time() - self._last_request < self._idle_timeout
+            ):
+                self._server.handle_request()
+        finally:
+            self._close()
+
+    def stop(self):
+        """
+        Makes :meth:`serve` return, from another thread, once it has answered
+        the requests it is busy with.
+        """
+        self._stopped.set()
+        # Wake it up from waiting for a request.
+        try:
+            request(dict(op="stats"), self._socket_path, timeout=1.0)
+        except (socket.error, OSError, ValueError):
+            pass
+
+    def _close(self):
+        """
+        Stops listening and removes the socket.
+        """
+        server = self._server
+        self._server = None
+        if server is None:
+            return
+        server.server_close()
+        try:
+            os.remove(self._socket_path)
+        except OSError:
+            pass
+
+    def handle(self, message):
+        """
+        Answers a request.
+
+        :param message: The request, as a dict.
+
+        :returns: The answer, as a dict.
+        """
+        self._last_request = time.time()
+        if message.get("version") != PROTOCOL_VERSION:
+            return dict(error="Unsupported protocol version: %s" % message.get("version"))
+
+        op = message.get("op")
+        if op == "stats":
+            return self.stats()
+        if op != "resolve":
+            return dict(error="Unknown request: %s" % op)
+
+        with self._lock:
+            self.requests += 1
+        try:
+            context = self.resolve(
+                message["path"],
+                message.get("previous"),
+                message.get("check_mtime", True),
+            )
+        except Exception, e:
+            with self._lock:
+                self.errors += 1
+            return dict(error=str(e))
+        return dict(context=context)
+
+    def resolve(self, path, previous, check_mtime):
+        """
+        Returns the encoded context of the given path, from the contexts the
+        daemon holds if possible.
+
+        :param path:        The path of the script or project.
+        :param previous:    The encoded context to inherit from, or None.
+        :param check_mtime: Whether a context held for the path is dropped if
+                            the file has been modified since.
+        """
+        tk = self._tank_from_path(path)
+        config_path = tk.pipeline_configuration.get_path()
+        key = (normalize_path(path), config_path, previous)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            entry = self._contexts.pop(key, None)
+            if entry is not None and (not check_mtime or entry[1] == mtime):
+                self._contexts[key] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        previous_context = None
+        if previous:
+            previous_context = sgtk_handoff.decode_context(previous, tk)
+        context = tk.context_from_path(path, previous_context)
+        payload = sgtk_handoff.encode_context(context, inline=True)
+
+        with self._lock:
+            self._contexts[key] = (payload, mtime)
+            while len(self._contexts) > MAX_CONTEXTS:
+                self._contexts.popitem(last=False)
+        return payload
+
+    def stats(self):
+        """
+        Returns a dict of the daemon's counters.
+        """
+        with self._lock:
+            return dict(
+                pid=os.getpid(),
+                instances=len(self._instances),
+                contexts=len(self._contexts),
+                requests=self.requests,
+                hits=self.hits,
+                misses=self.misses,
+                errors=self.errors,
+            )
+
+    def _tank_from_path(self, path):
+        """
+        Returns the Toolkit instance of the given path, creating it if none
+        of the daemon's instances has a storage root holding it. Instances
+        whose configuration has changed are replaced, and the contexts
+        resolved with them dropped.
+
+        :param path:    The path of the script or project.
+        """
+        import tank
+
+        norm_path = normalize_path(path)
+
+        with self._lock:
+            best = None
+            for (config_path, (tk, roots, config_hash)) in self._instances.iteritems():
+                for root in roots:
+                    if norm_path == root or norm_path.startswith(root.rstrip(os.path.sep) + os.path.sep):
+                        if best is None or len(root) > best[0]:
+                            best = (len(root), config_path)
+
+        if best is not None:
+            config_path = best[1]
+            (tk, roots, config_hash) = self._instances[config_path]
+            # The hash is only computed again every few seconds.
+            if get_config_hash(config_path) == config_hash:
+                return tk
+            self._forget(config_path)
+
+        tk = tank.tank_from_path(path)
+        config_path = tk.pipeline_configuration.get_path()
+        roots = [normalize_path(root) for root in tk.roots.values()]
+        with self._lock:
+            self._instances[config_path] = (tk, roots, get_config_hash(config_path))
+        return tk
+
+    def _forget(self, config_path):
+        """
+        Drops a configuration's instance and the contexts resolved with it.
+
+        :param config_path: The root path of the pipeline configuration.
+        """
+        with self._lock:
+            self._instances.pop(config_path, None)
+            for key in [k for k in self._contexts if k[1] == config_path]:
+                del self._contexts[key]
+
+
+##########################################################################
+# command line
+
+def _print_timings(label, timings):
+    """
+    Prints the minimum, median, 95th percentile and maximum of a list of
+    timings in seconds.
+    """
+    timings = sorted(timings)
+    print "%-28s min %8.3fms  median %8.3fms  p95 %8.3fms  max %8.3fms" % (
+        label,
+        timings[0] * 1000,
+        timings[len(timings) // 2] * 1000,
+        timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        timings[-1] * 1000,
+    )
+
+
+def _benchmark(config_path, path, iterations):
+    """
+    Compares resolving a path in-process with asking the daemon for it.
+
+    :param config_path: The root path of the pipeline configuration.
+    :param path:        The path of a script or project.
+    :param iterations:  The number of times each is done.
+    """
+    import tank
+
+    cold = []
+    for i in range(iterations):
+        start = time.time()
+        tk = tank.tank_from_path(path)
+        tk.context_from_path(path)
+        cold.append(time.time() - start)
+    _print_timings("in-process, new instance", cold)
+
+    warm = []
+    for i in range(iterations):
+        start = time.time()
+        tk.context_from_path(path)
+        warm.append(time.time() - start)
+    _print_timings("in-process, warm instance", warm)
+
+    if ping() is None:
+        print "No daemon is listening on %s." % get_socket_path()
+        return 1
+
+    remote = []
+    for i in range(iterations):
+        start = time.time()
+        # The first query may have the daemon resolve the path from scratch.
+        payload = query(path, timeout=60.0)
+        if payload is None:
+            print "The daemon couldn't resolve %s." % path
+            return 1
+        sgtk_handoff.decode_context(payload, tk)
+        remote.append(time.time() - start)
+    _print_timings("daemon, decoded", remote)
+    return 0
+
+
+class _SelfTestDaemon(ContextDaemon):
+    """
+    A daemon with a stand-in resolver, which needs no Toolkit.
+    """
+    def resolve(self, path, previous, check_mtime):
+        if path.startswith("/fail"):
+            raise ValueError("Not part of any project: %s" % path)
+        if path.startswith("/slow"):
+            time.sleep(CLIENT_TIMEOUT * 2)
+        time.sleep(0.01)
+        return "context of %s after %s" % (path, previous)
+
+
+def _selftest():
+    """
+    Checks the protocol, concurrent clients, errors and the fallback against
+    a daemon with a stand-in resolver.
+    """
+    global _retry_after
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "selftest.sock")
+    daemon = _SelfTestDaemon(socket_path)
+    assert daemon.bind(), "Couldn't bind %s" % socket_path
+    thread = threading.Thread(target=daemon.serve)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        assert query("/a.nk", socket_path=socket_path) == "context of /a.nk after None"
+        assert query("/a.nk", "ctx", socket_path=socket_path) == "context of /a.nk after ctx"
+        assert query("/fail/b.nk", socket_path=socket_path) is None
+        assert request(dict(op="nonsense"), socket_path).get("error")
+        assert query("/slow/d.nk", socket_path=socket_path) is None
+        assert _retry_after == 0.0, "A busy daemon was treated as missing"
+
+        results = []
+        def _client(index):
+            for i in range(20):
+                results.append(query("/c%d.nk" % index, socket_path=socket_path))
+        clients = [threading.Thread(target=_client, args=(i,)) for i in range(8)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        assert len(results) == 160 and None not in results, "Concurrent queries failed"
+
+        other = ContextDaemon(socket_path)
+        assert not other.bind(), "A second daemon took over a live socket"
+
+        stats = ping(socket_path)
+        assert stats["requests"] == 164 and stats["errors"] == 1, stats
+    finally:
+        daemon.stop()
+        thread.join(5.0)
+    assert not thread.is_alive(), "The daemon didn't stop"
+
+    start = time.time()
+    assert query("/a.nk", socket_path=socket_path) is None
+    assert time.time() - start < 1.0, "The fallback waited on a missing daemon"
+    assert _retry_after > time.time(), "A missing daemon wasn't remembered"
+    _retry_after = 0.0
+
+    print "All daemon checks passed."
+    return 0
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+    """
+    usage = (
+        "Usage: sgtk_context_daemon.py serve pipeline_config_path [socket_path]\n"
+        "       sgtk_context_daemon.py query path [path ...]\n"
+        "       sgtk_context_daemon.py stats\n"
+        "       sgtk_context_daemon.py benchmark pipeline_config_path path [iterations]\n"
+        "       sgtk_context_daemon.py selftest"
+    )
+    if not args:
+        print usage
+        return 1
+
+    command = args[0]
+    if command in ("serve", "benchmark") and len(args) >= 2:
+        # Use the pipeline configuration's own core.
+        sys.path.insert(0, os.path.join(args[1], "install", "core", "python"))
+
+    if command == "serve" and len(args) in (2, 3):
+        daemon = ContextDaemon(args[2] if len(args) == 3 else None)
+        if not daemon.bind():
+            print "A daemon is already listening on %s." % daemon.socket_path
+            return 0
+        daemon.serve()
+        return 0
+
+    if command == "query" and len(args) >= 2:
+        for path in args[1:]:
+            start = time.time()
+            payload = query(path, timeout=60.0)
+            print "%s (%.3fms): %s" % (path, (time.time() - start) * 1000, payload)
+        return 0
+
+    if command == "stats" and len(args) == 1:
+        print ping()
+        return 0
+
+    if command == "benchmark" and len(args) in (3, 4):
+        return _benchmark(args[1], args[2], int(args[3]) if len(args) == 4 else 20)
+
+    if command == "selftest" and len(args) == 1:
+        return _selftest()
+
+    print usage
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,408 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compact identity of a context.
+
+The callbacks compare the context they resolved with the current one to
+decide whether to switch, and the context caches are keyed by the context a
+path was resolved from. Comparing whole contexts compares every field of
+every entity dict they hold, and keeping them as keys keeps them alive. A
+:class:`ContextKey` only holds the type and id of the context's project,
+entity, step, task, user, additional entities and source entity, in a
+tuple, with their hash computed when the key is built, so it is cheap to
+keep, hash and compare. The key of each context is only built once, and
+contexts that are the same object are never compared further.
+
+Two contexts have equal keys when they are equal as `sgtk.context.Context`
+compares them, with additional entities compared regardless of their order,
+and when their source entities are the same as well.
+
+The cost of keys against whole contexts can be measured with:
+
+    python sgtk_context_key.py benchmark [count]
+
+This module only depends on the standard library.
+"""
+
+import gc
+import sys
+import time
+import weakref
+
+
+def _entity_fields(entity):
+    """
+    Returns the type and id of an entity dict, or Nones.
+    """
+    if not entity:
+        return (None, None)
+    return (entity.get("type"), entity.get("id"))
+
+
+def _entity_key(entity_type, entity_id):
+    """
+    Returns the tuple of an entity's type and id, or None if there is none.
+    """
+    if entity_type is None and entity_id is None:
+        return None
+    return (entity_type, entity_id)
+
+
+def _additional_fields(entities):
+    """
+    Returns the sorted tuple of the types and ids of a list of entity dicts,
+    without duplicates.
+    """
+    if not entities:
+        return ()
+    return tuple(sorted(set(_entity_fields(e) for e in entities)))
+
+
+class ContextKey(tuple):
+    """
+    The identity of a context: the type and id of its project, entity, step,
+    task, user, additional entities and source entity. Keys are immutable,
+    and equal if their contexts are the same.
+    """
+    # The types and ids are held flat in the key itself, a tuple, rather than
+    # in one tuple per entity, which halves the memory used by each key, and
+    # lets keys be compared as fast as plain tuples. The hash of the fields is
+    # computed once and held first, so that keys are hashed without going
+    # through their fields, and keys of different contexts almost always
+    # differ at their first item. The additional entities come last, as a
+    # tuple of tuples.
+    __slots__ = ()
+
+    def __new__(cls, project, entity, step, task, user=None, additional_entities=(),
+                source_entity=None):
+        """
+        :param project:             A tuple of the project's type and id, or
+                                    None.
+        :param entity:              A tuple of the entity's type and id, or
+                                    None.
+        :param step:                A tuple of the step's type and id, or None.
+        :param task:                A tuple of the task's type and id, or None.
+        :param user:                A tuple of the user's type and id, or None.
+        :param additional_entities: A list of tuples of the additional
+                                    entities' types and ids.
+        :param source_entity:       A tuple of the source entity's type and id,
+                                    or None.
+        """
+        return cls.from_fields(
+            (project or (None, None)) + (entity or (None, None))
+            + (step or (None, None)) + (task or (None, None))
+            + (user or (None, None)) + (source_entity or (None, None))
+            + (tuple(sorted(set(additional_entities))),)
+        )
+
+    @classmethod
+    def from_fields(cls, fields):
+        """
+        Returns a key from the flat tuple of the types and ids of a project,
+        entity, step, task, user and source entity, followed by the sorted
+        tuple of the additional entities' types and ids.
+
+        :param fields:  A tuple of twelve types and ids, None where missing,
+                        and a tuple of tuples.
+        """
+        return tuple.__new__(cls, (hash(fields),) + fields)
+
+    def __hash__(self):
+        return self[0]
+
+    @property
+    def project(self):
+        """
+        A tuple of the project's type and id, or None.
+        """
+        return _entity_key(*self[1:3])
+
+    @property
+    def entity(self):
+        """
+        A tuple of the entity's type and id, or None.
+        """
+        return _entity_key(*self[3:5])
+
+    @property
+    def step(self):
+        """
+        A tuple of the step's type and id, or None.
+        """
+        return _entity_key(*self[5:7])
+
+    @property
+    def task(self):
+        """
+        A tuple of the task's type and id, or None.
+        """
+        return _entity_key(*self[7:9])
+
+    @property
+    def user(self):
+        """
+        A tuple of the user's type and id, or None.
+        """
+        return _entity_key(*self[9:11])
+
+    @property
+    def source_entity(self):
+        """
+        A tuple of the source entity's type and id, or None.
+        """
+        return _entity_key(*self[11:13])
+
+    @property
+    def additional_entities(self):
+        """
+        A sorted tuple of tuples of the additional entities' types and ids.
+        """
+        return self[13]
+
+    def __repr__(self):
+        return "ContextKey(%r, %r, %r, %r, user=%r, additional_entities=%r, source_entity=%r)" % (
+            self.project,
+            self.entity,
+            self.step,
+            self.task,
+            self.user,
+            self.additional_entities,
+            self.source_entity,
+        )
+
+    def to_list(self):
+        """
+        Returns the key as JSON-friendly lists.
+        """
+        entities = (self.project, self.entity, self.step, self.task, self.user, self.source_entity)
+        return [list(e) if e else None for e in entities] + [
+            [list(e) for e in self.additional_entities]
+        ]
+
+
+# The key of each context a key was asked for, by the context's id, with a
+# weak reference to the context. Contexts are immutable, so their keys are
+# only built once, and dropped with them.
+_keys = {}
+
+
+def _forget(ref):
+    """
+    Drops the key of a context that was deleted.
+
+    :param ref: The weak reference to the context, keyed by its id.
+    """
+    entry = _keys.get(ref.key)
+    if entry is not None and entry[0] is ref:
+        del _keys[ref.key]
+
+
+def _build_context_key(context):
+    """
+    Returns a new key identifying the given context.
+
+    :param context: A sgtk.context.Context.
+    """
+    fields = []
+    for entity in (
+        context.project,
+        context.entity,
+        context.step,
+        context.task,
+        context.user,
+        getattr(context, "source_entity", None),
+    ):
+        if entity:
+            fields.append(entity.get("type"))
+            fields.append(entity.get("id"))
+        else:
+            fields.append(None)
+            fields.append(None)
+    fields.append(_additional_fields(context.additional_entities))
+    return ContextKey.from_fields(tuple(fields))
+
+
+def get_context_key(context):
+    """
+    Returns the key identifying the given context.
+
+    :param context: A sgtk.context.Context, or None.
+
+    :returns: A :class:`ContextKey`, or None.
+    """
+    if context is None:
+        return None
+    context_id = id(context)
+    entry = _keys.get(context_id)
+    if entry is not None and entry[0]() is context:
+        return entry[1]
+    key = _build_context_key(context)
+    try:
+        ref = weakref.KeyedRef(context, _forget, context_id)
+    except TypeError:
+        # Not weakly referenceable, so its key can't be kept.
+        return key
+    _keys[context_id] = (ref, key)
+    return key
+
+
+def same_context(a, b):
+    """
+    Whether two contexts, either of which may be None, are the same.
+
+    :param a:   A sgtk.context.Context, or None.
+    :param b:   A sgtk.context.Context, or None.
+    """
+    if a is b:
+        return True
+    if a is None or b is None:
+        return False
+    return get_context_key(a) == get_context_key(b)
+
+
+##########################################################################
+# command line
+
+class _FakeContext(object):
+    """
+    A context with the entity dicts of a typical shot task context.
+    """
+    def __init__(self, index):
+        shot_name = "seq%03d_%04d" % (index // 1000, index)
+        self.project = dict(type="Project", id=1, name="synthetic")
+        self.entity = dict(type="Shot", id=index, name=shot_name)
+        self.step = dict(type="Step", id=index % 10, name="step%02d" % (index % 10))
+        self.task = dict(type="Task", id=index * 10, name="%s_comp" % shot_name)
+        self.user = dict(type="HumanUser", id=42, name="Artist")
+        self.additional_entities = []
+
+    def __eq__(self, other):
+        # As sgtk.context.Context compares its fields.
+        return (
+            self.project == other.project
+            and self.entity == other.entity
+            and self.step == other.step
+            and self.task == other.task
+            and self.user == other.user
+            and self.additional_entities == other.additional_entities
+        )
+
+
+def _deep_size(obj, seen):
+    """
+    Returns the memory used by an object and everything it references.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for (k, v) in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_size(obj.__dict__, seen)
+    return size
+
+
+def _to_tuple(key):
+    """
+    Returns the fields of a key as a tuple of tuples, one per entity.
+    """
+    return (
+        key.project,
+        key.entity,
+        key.step,
+        key.task,
+        key.user,
+        key.additional_entities,
+        key.source_entity,
+    )
+
+
+def _benchmark(count):
+    """
+    Measures the memory used by, and the cost of hashing and comparing,
+    keys against whole contexts.
+
+    :param count:   The number of contexts.
+    """
+    # As timeit does, so that garbage collections don't skew the timings.
+    gc.disable()
+
+    contexts = [_FakeContext(i) for i in range(count)]
+    copies = [_FakeContext(i) for i in range(count)]
+
+    start = time.time()
+    keys = [get_context_key(c) for c in contexts]
+    print "Built %d keys in %.3fs" % (count, time.time() - start)
+
+    key_copies = [get_context_key(c) for c in copies]
+    tuples = [_to_tuple(k) for k in keys]
+    key_copies_tuples = [_to_tuple(k) for k in key_copies]
+
+    for (label, items) in (("contexts", contexts), ("tuple keys", tuples), ("ContextKeys", keys)):
+        size = _deep_size(items, set()) - sys.getsizeof(items)
+        print "%-12s %8.1f MB, %4d bytes each" % (label, size / 1048576.0, size / count)
+
+    for (label, a, b) in (
+        ("contexts", contexts, copies),
+        ("tuple keys", tuples, key_copies_tuples),
+        ("ContextKeys", keys, key_copies),
+    ):
+        start = time.time()
+        for (x, y) in zip(a, b):
+            x == y
+        elapsed = time.time() - start
+        print "%-12s %d equal comparisons in %.3fs, %.3fus each" % (
+            label, count, elapsed, elapsed / count * 1000000,
+        )
+
+    for (label, items) in (("tuple keys", tuples), ("ContextKeys", keys)):
+        start = time.time()
+        cache = dict((k, None) for k in items)
+        for k in items:
+            cache[k]
+        elapsed = time.time() - start
+        print "%-12s %d inserts and lookups in %.3fs" % (label, count, elapsed)
+
+    # The contexts are compared as the callbacks compare them, building their
+    # keys the first time, then again once their keys are kept.
+    contexts = [_FakeContext(i) for i in range(count)]
+    copies = [_FakeContext(i) for i in range(count)]
+    for label in ("same_context, new", "same_context, kept"):
+        start = time.time()
+        for (x, y) in zip(contexts, copies):
+            same_context(x, y)
+        elapsed = time.time() - start
+        print "%-20s %d comparisons in %.3fs, %.3fus each" % (
+            label, count, elapsed, elapsed / count * 1000000,
+        )
+
+    gc.enable()
+    return 0
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+    """
+    if args and args[0] == "benchmark" and len(args) <= 2:
+        return _benchmark(int(args[1]) if len(args) == 2 else 100000)
+
+    print "Usage: sgtk_context_key.py benchmark [count]"
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
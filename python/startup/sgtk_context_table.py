@@ -0,0 +1,483 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Lookup table of the contexts of a project's work areas, built ahead of time.
+
+On big shows, most of the scripts opened and saved are in one of tens of
+thousands of work area folders, whose contexts never change. This module
+builds, for a pipeline configuration, a table of the existing folders of its
+work area templates and the context fields each of them resolves to, and the
+tk_nuke context cache, which the open, save and Nuke Studio focus callbacks
+go through, looks scripts up in it before resolving them live:
+
+    python sgtk_context_table.py build pipeline_config_path [template_name ...]
+
+Without template names, the templates of folders, whose last component has
+no file extension, are used. The table is stored next to the configuration
+as a compressed JSON file, where each distinct set of context fields is
+stored once. It holds the hash of the configuration it was built for, and is
+ignored once the configuration has changed.
+
+A script is looked up by the folder it is in. Scripts in any other folder,
+even one below a folder of the table, are resolved live: such a folder may
+be a shot or task folder created since the table was built, whose context
+isn't the one of the folder above it. Scripts whose context would inherit
+the task of the current context are still resolved live too, as the table
+doesn't know about it.
+
+The lookup can be benchmarked against a synthetic project, without Toolkit:
+
+    python sgtk_context_table.py benchmark [folder_count]
+
+This module only depends on the standard library. Toolkit is imported when
+a table is built or a context is created from it.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import threading
+
+import sgtk_paths
+from sgtk_paths import normalize_path
+
+TABLE_VERSION = 1
+TABLE_FILE_NAME = "tk-nuke-context-table.z"
+
+# How often a loaded table is checked for a newer one on disk, in seconds.
+CHECK_INTERVAL = 10.0
+
+# The context fields stored in the table.
+_CONTEXT_FIELDS = ("project", "entity", "step", "task", "additional_entities")
+
+# Tables loaded in this process, keyed by pipeline configuration path.
+_tables = dict()
+_lock = threading.Lock()
+
+_counters = dict(hits=0, misses=0, inherited=0)
+
+
+def get_table_path(config_location):
+    """
+    Returns the path where the table of a pipeline configuration is stored.
+
+    :param config_location: The configuration's config folder, as returned
+                            by `get_config_location()`.
+    """
+    return os.path.join(config_location, TABLE_FILE_NAME)
+
+
+class ContextTable(object):
+    """
+    The context fields of a project's work area folders.
+    """
+    def __init__(self, data):
+        """
+        :param data:    The table's contents, as written by :func:`write_table`.
+        """
+        self.config_hash = data["config_hash"]
+        self._contexts = data["contexts"]
+        self._folders = data["folders"]
+
+    def __len__(self):
+        return len(self._folders)
+
+    @property
+    def contexts(self):
+        """
+        The distinct dicts of context fields of the table's folders.
+        """
+        return self._contexts
+
+    def lookup(self, path):
+        """
+        Returns the context fields of the given folder, or of the folder
+        holding the given script, if the table lists it. Folders further up
+        are never used, as the folders below them that the table doesn't
+        list may have contexts of their own.
+
+        :param path:    The path of a script or folder.
+
+        :returns: A dict of context fields, or None if the table doesn't list
+                  the folder.
+        """
+        norm_path = normalize_path(path)
+        index = self._folders.get(norm_path)
+        if index is None:
+            index = self._folders.get(os.path.dirname(norm_path))
+        if index is None:
+            return None
+        return self._contexts[index]
+
+
+def write_table(table_path, config_hash, folder_fields):
+    """
+    Writes a table.
+
+    :param table_path:      The path to write it to.
+    :param config_hash:     The hash of the configuration it is built for.
+    :param folder_fields:   An iterable of tuples of a folder's path and its
+                            dict of context fields.
+
+    :returns: A tuple of the number of folders and of distinct contexts.
+    """
+    contexts = []
+    indices = dict()
+    folders = dict()
+    for (folder, fields) in folder_fields:
+        key = json.dumps(fields, sort_keys=True)
+        if key not in indices:
+            indices[key] = len(contexts)
+            contexts.append(fields)
+        folders[normalize_path(folder)] = indices[key]
+
+    data = dict(
+        version=TABLE_VERSION,
+        config_hash=config_hash,
+        contexts=contexts,
+        folders=folders,
+    )
+
+    temp_path = "%s.%d.tmp" % (table_path, os.getpid())
+    with open(temp_path, "wb") as fh:
+        fh.write(zlib.compress(json.dumps(data, separators=(",", ":"))))
+    if os.path.exists(table_path):
+        os.remove(table_path)
+    os.rename(temp_path, table_path)
+    return (len(folders), len(contexts))
+
+
+def read_table(table_path):
+    """
+    Reads a table.
+
+    :param table_path:  The path of the table.
+
+    :returns: A :class:`ContextTable`, or None if there is none or it was
+              written by another version of this module.
+    """
+    try:
+        with open(table_path, "rb") as fh:
+            data = json.loads(zlib.decompress(fh.read()))
+    except Exception:
+        return None
+    if data.get("version") != TABLE_VERSION:
+        return None
+    return ContextTable(data)
+
+
+def get_table(tk, config_hash):
+    """
+    Returns the table of the given Toolkit instance's pipeline configuration,
+    loading it the first time, and again when it has been rebuilt.
+
+    :param tk:          A Toolkit API instance.
+    :param config_hash: The configuration's current hash, as computed by
+                        sgtk_paths.get_config_hash().
+
+    :returns: A :class:`ContextTable`, or None if there is none or it was
+              built for another state of the configuration.
+    """
+    config = tk.pipeline_configuration
+    config_path = config.get_path()
+    now = time.time()
+
+    with _lock:
+        cached = _tables.get(config_path)
+    if cached is None or now - cached[2] >= CHECK_INTERVAL:
+        table_path = get_table_path(config.get_config_location())
+        try:
+            mtime = os.path.getmtime(table_path)
+        except OSError:
+            mtime = None
+
+        if cached is not None and cached[0] == mtime:
+            table = cached[1]
+        else:
+            table = read_table(table_path) if mtime is not None else None
+        cached = (mtime, table, now)
+        with _lock:
+            _tables[config_path] = cached
+
+    table = cached[1]
+    if table is None or table.config_hash != config_hash:
+        return None
+    return table
+
+
+def lookup_context(tk, path, config_hash, previous_context=None):
+    """
+    Returns the context of the given path from its configuration's table.
+
+    :param tk:                  The Toolkit API instance of the path.
+    :param path:                The path of the script or project.
+    :param config_hash:         The configuration's current hash, as computed
+                                by sgtk_paths.get_config_hash().
+    :param previous_context:    The context the path is resolved from, as for
+                                `tk.context_from_path()`.
+
+    :returns: A sgtk.context.Context, or None if it has to be resolved live.
+    """
+    table = get_table(tk, config_hash)
+    if table is None:
+        return None
+
+    fields = table.lookup(path)
+    if fields is None:
+        _count("misses")
+        return None
+
+    if inherits_task(previous_context, fields.get("task"), fields.get("entity"), fields.get("step")):
+        # tk.context_from_path() would carry the current task over.
+        _count("inherited")
+        return None
+
+    import tank
+
+    _count("hits")
+    return tank.context.Context(tk, **_to_str(fields))
+
+
+def inherits_task(previous_context, task, entity, step):
+    """
+    Whether `tk.context_from_path()` carries the task of the previous context
+    over to the context of a path, as it does when the latter has no task and
+    the same entity and step.
+
+    :param previous_context:    The context the path is resolved from, or
+                                None.
+    :param task:                The task dict of the path's own context.
+    :param entity:              The entity dict of the path's own context.
+    :param step:                The step dict of the path's own context.
+    """
+    return bool(
+        previous_context is not None
+        and previous_context.task
+        and not task
+        and _same_entity(previous_context.entity, entity)
+        and _same_entity(previous_context.step, step)
+    )
+
+
+def stats():
+    """
+    Returns a dict of the lookups made in this process.
+    """
+    with _lock:
+        result = dict(_counters)
+        result["tables"] = len([t for t in _tables.values() if t[1] is not None])
+    return result
+
+
+def _count(counter):
+    """
+    Increments one of the lookup counters.
+
+    :param counter: The name of the counter.
+    """
+    with _lock:
+        _counters[counter] += 1
+
+
+def _same_entity(a, b):
+    """
+    Whether two entity dicts, either of which may be None, are the same.
+    """
+    if not a or not b:
+        return not a and not b
+    return a.get("type") == b.get("type") and a.get("id") == b.get("id")
+
+
+def _to_str(value):
+    """
+    Converts the unicode strings of a JSON value to str, recursively.
+    """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [_to_str(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_to_str(k), _to_str(v)) for (k, v) in value.iteritems())
+    return value
+
+
+##########################################################################
+# building
+
+def _entity_fields(entity):
+    """
+    Returns the fields of an entity that are stored in the table.
+    """
+    return dict((k, entity[k]) for k in ("type", "id", "name") if k in entity)
+
+
+def get_context_fields(context):
+    """
+    Returns the fields of a context that are stored in the table. The user
+    isn't, as it is whoever opens the script.
+
+    :param context: A sgtk.context.Context.
+    """
+    fields = dict()
+    for field in _CONTEXT_FIELDS:
+        value = getattr(context, field)
+        if not value:
+            continue
+        if isinstance(value, list):
+            fields[field] = [_entity_fields(e) for e in value]
+        else:
+            fields[field] = _entity_fields(value)
+    return fields
+
+
+def build_for_config(config_path, template_names=None):
+    """
+    Builds the table of a pipeline configuration from the existing folders
+    of its work area templates.
+
+    :param config_path:     The path to the pipeline configuration.
+    :param template_names:  The names of the templates to use. Defaults to
+                            all the templates of folders.
+
+    :returns: A tuple of the table's path, and the number of folders and of
+              distinct contexts in it.
+    """
+    import tank
+
+    tk = tank.tank_from_path(config_path)
+    if template_names:
+        templates = [tk.templates[name] for name in template_names]
+    else:
+        templates = [
+            t for t in tk.templates.values()
+            if isinstance(t, tank.TemplatePath)
+            and not os.path.splitext(t.definition)[1]
+        ]
+
+    def _folder_fields():
+        seen = set()
+        for template in templates:
+            for folder in tk.paths_from_template(template, {}):
+                if folder in seen:
+                    continue
+                seen.add(folder)
+                yield (folder, get_context_fields(tk.context_from_path(folder)))
+
+    config = tk.pipeline_configuration
+    table_path = get_table_path(config.get_config_location())
+    (folders, contexts) = write_table(
+        table_path,
+        sgtk_paths.get_config_hash(config.get_path()),
+        _folder_fields(),
+    )
+    return (table_path, folders, contexts)
+
+
+##########################################################################
+# command line
+
+def _benchmark(folder_count):
+    """
+    Builds, loads and looks scripts up in the table of a synthetic project,
+    with 10 steps per shot and 100 shots per sequence.
+
+    :param folder_count:    The number of work area folders.
+    """
+    import tempfile
+
+    root = os.path.join(os.path.sep, "projects", "synthetic")
+    project = dict(type="Project", id=1, name="synthetic")
+    steps = ["step%02d" % i for i in range(10)]
+
+    def _folder_fields():
+        for index in range(folder_count):
+            shot_index = index // len(steps)
+            seq = "seq%03d" % (shot_index // 100)
+            shot = "%s_%04d" % (seq, shot_index)
+            step = steps[index % len(steps)]
+            yield (
+                os.path.join(root, "sequences", seq, shot, step, "work", "nuke"),
+                dict(
+                    project=project,
+                    entity=dict(type="Shot", id=shot_index + 1, name=shot),
+                    step=dict(type="Step", id=index % len(steps) + 1, name=step),
+                ),
+            )
+
+    table_path = os.path.join(tempfile.mkdtemp(), TABLE_FILE_NAME)
+
+    start = time.time()
+    (folders, contexts) = write_table(table_path, "synthetic", _folder_fields())
+    print "Built %d folders, %d distinct contexts in %.3fs, %.1f KB on disk" % (
+        folders,
+        contexts,
+        time.time() - start,
+        os.path.getsize(table_path) / 1024.0,
+    )
+
+    start = time.time()
+    table = read_table(table_path)
+    print "Loaded in %.3fs" % (time.time() - start)
+
+    paths = [
+        os.path.join(folder, "%s_comp_v%03d.nk" % (os.path.basename(folder), i))
+        for (i, (folder, fields)) in enumerate(_folder_fields())
+    ]
+    random.shuffle(paths)
+    paths = paths[:10000]
+    misses = [os.path.join(os.path.sep, "tmp", "scratch", "script_%d.nk" % i) for i in range(10000)]
+
+    for (label, sample) in (("hits", paths), ("misses", misses)):
+        start = time.time()
+        for path in sample:
+            table.lookup(path)
+        elapsed = time.time() - start
+        print "%d lookups (%s) in %.3fs, %.2fus each" % (
+            len(sample),
+            label,
+            elapsed,
+            elapsed / len(sample) * 1000000,
+        )
+
+    os.remove(table_path)
+    return 0
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+    """
+    usage = (
+        "Usage: sgtk_context_table.py build pipeline_config_path [template_name ...]\n"
+        "       sgtk_context_table.py benchmark [folder_count]"
+    )
+
+    if len(args) >= 2 and args[0] == "build":
+        # Use the pipeline configuration's own core.
+        sys.path.insert(0, os.path.join(args[1], "install", "core", "python"))
+        (table_path, folders, contexts) = build_for_config(args[1], args[2:])
+        print "Wrote %d folders with %d distinct contexts to %s" % (folders, contexts, table_path)
+        return 0
+
+    if args and args[0] == "benchmark" and len(args) <= 2:
+        return _benchmark(int(args[1]) if len(args) == 2 else 100000)
+
+    print usage
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,571 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Indexed module finder for the engine's and the apps' Python code.
+
+A normal import looks for the module in every `sys.path` entry in turn,
+which means several filesystem metadata calls per entry. On network storage
+these add up quickly. The finder installed by this module is consulted
+before `sys.path` is searched, and answers from a precomputed index of the
+packages found in the engine's `python` folder and in the apps' `python`
+folders, so those imports go straight to the right file. The finder only
+answers for a module when its folder is one the normal search would have
+looked in, that is on `sys.path` for top-level packages, or in the parent
+package's `__path__` for everything else, and when none of the entries
+searched before it holds a module or package of that name, so it never
+changes which file gets imported. Each of those entries is listed once per
+process for this, and a module added to one of them afterwards isn't seen.
+The normal search is left to decide when an entry before the module's
+folder can't be listed, such as a zip archive.
+
+The index is cached in the user's private directory, see sgtk_userdir, and
+is rebuilt when the modification time of any of the indexed folders changes,
+which happens whenever a module is added, removed, or renamed. A cache file
+that doesn't belong to the user, or that lists a module or folder outside of
+the indexed folders, is never used. Modules that are not in the index are
+left to the normal import machinery.
+
+Setting TK_NUKE_DISABLE_MODULE_INDEX turns the finder off.
+
+The lookups the index saves can be measured against the normal search with:
+
+    python sgtk_finder.py benchmark [sys_path_entry ...]
+
+where the given entries are searched before the engine's python folder, as
+the other entries of `sys.path` are in Nuke. Where strace is installed, the
+filesystem calls each makes are counted too.
+"""
+
+import os
+import sys
+import imp
+import json
+import time
+import hashlib
+import subprocess
+
+import sgtk_manifest
+import sgtk_userdir
+
+INDEX_VERSION = 1
+DISABLE_ENV_VAR = "TK_NUKE_DISABLE_MODULE_INDEX"
+
+# Top-level packages of the indexed folders that are never served from the
+# index, as they are not imported as packages.
+_EXCLUDED_PACKAGES = ("startup",)
+
+
+class _IndexedLoader(object):
+    """
+    Loads a module from the file recorded in the index.
+    """
+    def __init__(self, path, is_package):
+        """
+        :param path:        The path of the module's file, or its folder if
+                            it is a package.
+        :param is_package:  Whether the module is a package.
+        """
+        self._path = path
+        self._is_package = is_package
+
+    def load_module(self, fullname):
+        """
+        Loads the module, as required by the PEP 302 loader protocol.
+
+        :param fullname:    The fully qualified name of the module.
+        """
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+
+        if self._is_package:
+            return imp.load_module(
+                fullname,
+                None,
+                self._path,
+                ("", "", imp.PKG_DIRECTORY),
+            )
+
+        try:
+            fh = open(self._path, "U")
+        except IOError, e:
+            raise ImportError("Unable to load %s from the module index: %s" % (fullname, e))
+        try:
+            return imp.load_module(fullname, fh, self._path, (".py", "U", imp.PY_SOURCE))
+        finally:
+            fh.close()
+
+
+class IndexedModuleFinder(object):
+    """
+    A PEP 302 meta path finder answering from a module index.
+    """
+    def __init__(self, roots):
+        """
+        :param roots:   The folders holding the packages to index.
+        """
+        self._roots = [os.path.normpath(root) for root in roots]
+        self._modules = dict()
+        self._folders = dict()
+        # The names in each search path entry listed so far, or None for
+        # entries that aren't folders, by normalized path.
+        self._listings = dict()
+        self.hits = 0
+        self.index_rebuilt = False
+        self._load_index()
+
+    @property
+    def roots(self):
+        """
+        The folders being indexed.
+        """
+        return self._roots
+
+    @property
+    def module_count(self):
+        """
+        The number of modules in the index.
+        """
+        return len(self._modules)
+
+    def find_module(self, fullname, path=None):
+        """
+        Returns a loader for the given module if it is in the index, as
+        required by the PEP 302 finder protocol.
+
+        :param fullname:    The fully qualified name of the module.
+        :param path:        The parent package's __path__, or None for a
+                            top-level module.
+        """
+        entry = self._modules.get(fullname)
+        if entry is None:
+            return None
+
+        folder = os.path.dirname(entry[0])
+        if not is_found_first(fullname, folder, sys.path if path is None else path, self._listings):
+            return None
+        self.hits += 1
+        return _IndexedLoader(*entry)
+
+    def _cache_path(self):
+        """
+        Returns the path of the index cache file for the indexed roots.
+
+        :raises OSError: If the user's directory can't be used.
+        """
+        key = hashlib.sha1("\n".join(self._roots)).hexdigest()
+        return os.path.join(
+            sgtk_userdir.get_user_dir("module-index"),
+            "index-%s.json" % key,
+        )
+
+    def _load_index(self):
+        """
+        Loads the index from its cache file, or rebuilds it if the cache is
+        missing, stale, or not to be trusted.
+        """
+        try:
+            cache_path = self._cache_path()
+            if sgtk_userdir.is_owned(cache_path):
+                with open(cache_path) as fh:
+                    data = json.load(fh)
+                if self._is_valid(data):
+                    self._modules = dict(
+                        (str(name), (str(path), is_package))
+                        for (name, (path, is_package)) in data["modules"].iteritems()
+                    )
+                    self._folders = data["folders"]
+                    return
+        except Exception:
+            pass
+
+        self._build_index()
+
+    def _is_valid(self, data):
+        """
+        Whether the given cached index is current, and only lists modules and
+        folders within the indexed roots.
+
+        :param data:    The cached index.
+        """
+        if data["version"] != INDEX_VERSION:
+            return False
+        for (path, _) in data["modules"].itervalues():
+            if not self._is_under_roots(path):
+                return False
+        for folder in data["folders"]:
+            if not self._is_under_roots(folder):
+                return False
+        return self._is_current(data["folders"])
+
+    def _is_under_roots(self, path):
+        """
+        Whether the given path is one of the indexed roots, or within one.
+
+        :param path:    The path to check.
+        """
+        path = os.path.normcase(os.path.normpath(path))
+        for root in self._roots:
+            root = os.path.normcase(root)
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return True
+        return False
+
+    def _is_current(self, folders):
+        """
+        Whether none of the given folders has changed since it was indexed.
+
+        :param folders: A dict of folder paths and their modification times.
+        """
+        for (folder, mtime) in folders.iteritems():
+            try:
+                if os.path.getmtime(folder) != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _build_index(self):
+        """
+        Walks the indexed roots and writes the resulting index to its
+        cache file.
+        """
+        modules = dict()
+        duplicates = set()
+        folders = dict()
+
+        for root in self._roots:
+            if not os.path.isdir(root):
+                continue
+            folders[root] = os.path.getmtime(root)
+            for name in os.listdir(root):
+                package_dir = os.path.join(root, name)
+                if name in _EXCLUDED_PACKAGES or not self._is_package(package_dir):
+                    continue
+                self._index_package(name, package_dir, modules, duplicates, folders)
+
+        # A name found in more than one place is left to the normal import
+        # machinery, which knows which one should win.
+        for name in duplicates:
+            modules.pop(name, None)
+
+        self._modules = modules
+        self._folders = folders
+        self.index_rebuilt = True
+
+        try:
+            cache_path = self._cache_path()
+            temp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+            with open(temp_path, "w") as fh:
+                json.dump(
+                    dict(version=INDEX_VERSION, modules=modules, folders=folders),
+                    fh,
+                )
+            if os.path.lexists(cache_path):
+                os.remove(cache_path)
+            os.rename(temp_path, cache_path)
+        except (IOError, OSError):
+            pass
+
+    def _is_package(self, path):
+        """
+        Whether the given path is a package folder.
+
+        :param path:    The path to check.
+        """
+        return os.path.isfile(os.path.join(path, "__init__.py"))
+
+    def _index_package(self, package_name, package_dir, modules, duplicates, folders):
+        """
+        Adds a package and everything below it to the index.
+
+        :param package_name:    The fully qualified name of the package.
+        :param package_dir:     The package's folder.
+        :param modules:         The index being built.
+        :param duplicates:      The set of names seen more than once.
+        :param folders:         The indexed folders and their modification times.
+        """
+        if package_name in modules:
+            duplicates.add(package_name)
+        modules[package_name] = (package_dir, True)
+        folders[package_dir] = os.path.getmtime(package_dir)
+
+        for name in os.listdir(package_dir):
+            path = os.path.join(package_dir, name)
+            if name.endswith(".py") and name != "__init__.py":
+                module_name = "%s.%s" % (package_name, name[:-3])
+                if module_name in modules:
+                    duplicates.add(module_name)
+                modules[module_name] = (path, False)
+            elif self._is_package(path):
+                self._index_package(
+                    "%s.%s" % (package_name, name),
+                    path,
+                    modules,
+                    duplicates,
+                    folders,
+                )
+
+
+def is_found_first(fullname, folder, search_path, listings):
+    """
+    Whether a normal import of the given module would look in the given
+    folder before any other folder that holds, or may hold, a module or
+    package of the same name.
+
+    :param fullname:    The fully qualified name of the module.
+    :param folder:      The folder holding the module's file, or its package
+                        folder.
+    :param search_path: The entries searched for it, `sys.path` for a
+                        top-level module, or its parent package's `__path__`.
+    :param listings:    A dict caching the names held by each entry listed
+                        so far, or None for entries that aren't folders, by
+                        normalized path.
+    """
+    folder = os.path.normcase(os.path.abspath(folder))
+    file_names = _get_module_file_names(fullname.rpartition(".")[2])
+    for search_folder in search_path:
+        # An empty entry stands for the current directory.
+        search_folder = os.path.normcase(os.path.abspath(search_folder or os.curdir))
+        if search_folder == folder:
+            return True
+        if _may_provide(search_folder, file_names, listings):
+            # An earlier entry wins, or may.
+            return False
+    return False
+
+
+def _may_provide(folder, file_names, listings):
+    """
+    Whether a search path entry holds any of the given files or folders, or
+    can't be listed to tell.
+
+    :param folder:      The normalized path of the entry.
+    :param file_names:  The names a module may be found under.
+    :param listings:    The cache of the entries listed, see
+                        :func:`is_found_first`.
+    """
+    try:
+        names = listings[folder]
+    except KeyError:
+        try:
+            names = frozenset(os.listdir(folder))
+        except OSError:
+            names = None if os.path.exists(folder) else frozenset()
+        listings[folder] = names
+    if names is None:
+        return True
+    return any(name in names for name in file_names)
+
+
+def _get_module_file_names(name):
+    """
+    Returns the names of the files and folders a module of the given name
+    may be imported from.
+
+    :param name:    The last component of the module's name.
+    """
+    return [name] + [name + suffix for (suffix, mode, kind) in imp.get_suffixes()]
+
+
+def install(engine_python_path):
+    """
+    Installs an indexed module finder for the engine's python folder and for
+    the python folders of the apps listed in the launcher's startup manifest,
+    unless the finder has been disabled or one is already installed.
+
+    :param engine_python_path:  The engine's python folder.
+
+    :returns: The installed finder, or None.
+    """
+    if os.environ.get(DISABLE_ENV_VAR):
+        return None
+
+    roots = [engine_python_path] + sgtk_manifest.get_app_python_folders()
+
+    for finder in sys.meta_path:
+        if finder.__class__.__name__ == IndexedModuleFinder.__name__:
+            return finder
+
+    try:
+        finder = IndexedModuleFinder(roots)
+    except Exception:
+        # Imports work as usual without the index.
+        return None
+
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def stats(finder):
+    """
+    Returns a dict describing the given finder, for reporting.
+
+    :param finder:  An installed finder, or None.
+    """
+    if finder is None:
+        return dict(enabled=False)
+    return dict(
+        enabled=True,
+        roots=len(finder.roots),
+        modules=finder.module_count,
+        hits=finder.hits,
+        rebuilt=finder.index_rebuilt,
+    )
+
+
+##########################################################################
+# command line
+
+# Looks every module of the engine's python folder up, as the pass given as
+# the first argument does, from the folders given as the others, so that the
+# file calls it makes can be counted.
+_PROBE_SCRIPT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import sgtk_finder
+sgtk_finder._probe(sys.argv[2], sys.argv[3:])
+"""
+
+
+def _probe(mode, search_path):
+    """
+    Looks up every module of the engine's python folder.
+
+    :param mode:        "normal" to search the given path and the module's
+                        own folder like a normal import, "indexed" to use the
+                        index, or anything else to only load the index.
+    :param search_path: The folders searched before the module's own.
+
+    :returns: The time the lookups took, in seconds, and the number of modules.
+    """
+    engine_python_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    finder = IndexedModuleFinder([engine_python_path])
+    names = sorted(finder._modules)
+
+    start = time.time()
+    for name in names:
+        (path, is_package) = finder._modules[name]
+        folder = os.path.dirname(path)
+        if mode == "normal":
+            (fh, _, _) = imp.find_module(name.rsplit(".", 1)[-1], list(search_path) + [folder])
+            if fh:
+                fh.close()
+        elif mode == "indexed":
+            finder.find_module(name, [folder])
+            # The normal search opens the file it finds, the index's loader
+            # does it when the module is loaded.
+            if not is_package:
+                open(path).close()
+    return (time.time() - start, len(names))
+
+
+def _count_file_calls(mode, search_path):
+    """
+    Returns the number of filesystem calls a lookup pass makes, counted with
+    strace in a new process, without those the process makes anyway.
+
+    :param mode:        The pass, as for :func:`_probe`.
+    :param search_path: The folders searched before the module's own.
+
+    :returns: The number of calls, or None if strace can't be run.
+    """
+    counts = []
+    for probe_mode in ("none", mode):
+        summary_path = os.path.join(
+            sgtk_userdir.get_user_dir(),
+            "finder-strace-%d.txt" % os.getpid(),
+        )
+        command = [
+            "strace", "-f", "-c", "-e", "trace=file", "-o", summary_path,
+            sys.executable, "-c", _PROBE_SCRIPT,
+            os.path.dirname(os.path.abspath(__file__)), probe_mode,
+        ] + list(search_path)
+        try:
+            with open(os.devnull, "w") as devnull:
+                if subprocess.call(command, stdout=devnull, stderr=devnull) != 0:
+                    return None
+            with open(summary_path) as fh:
+                counts.append(_parse_strace_summary(fh.read()))
+        except (IOError, OSError):
+            return None
+        finally:
+            if os.path.exists(summary_path):
+                os.remove(summary_path)
+    return counts[1] - counts[0]
+
+
+def _parse_strace_summary(summary):
+    """
+    Returns the total number of calls listed in a `strace -c` summary.
+
+    :param summary: The summary's text.
+    """
+    calls = 0
+    for line in summary.splitlines():
+        fields = line.split()
+        # % time, seconds, usecs/call, calls, [errors,] syscall
+        if len(fields) < 5 or fields[-1] == "total":
+            continue
+        try:
+            float(fields[0])
+            calls += int(fields[3])
+        except ValueError:
+            continue
+    return calls
+
+
+def _benchmark(search_path):
+    """
+    Measures how long locating every module of the engine's python folder
+    takes with the index, against searching the given path and the module's
+    own folder like a normal import, and counts the filesystem calls each
+    makes when strace is available.
+
+    :param search_path: The folders searched before the module's own.
+    """
+    engine_python_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.time()
+    finder = IndexedModuleFinder([engine_python_path])
+    print "Indexed %d modules in %.3fs (rebuilt: %s)" % (
+        finder.module_count,
+        time.time() - start,
+        finder.index_rebuilt,
+    )
+    if not finder.module_count:
+        return 1
+
+    for (label, mode) in (("Normal search", "normal"), ("Module index ", "indexed")):
+        (elapsed, count) = _probe(mode, search_path)
+        calls = _count_file_calls(mode, search_path)
+        if calls is None:
+            calls_label = "file calls not counted, strace is needed"
+        else:
+            calls_label = "%.1f file calls each" % (float(calls) / count)
+        print "%s: %.3fms per module, %s" % (label, elapsed / count * 1000, calls_label)
+    return 0
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+    """
+    if args and args[0] == "benchmark":
+        return _benchmark(args[1:])
+
+    print "Usage: sgtk_finder.py benchmark [sys_path_entry ...]"
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
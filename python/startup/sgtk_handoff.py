@@ -0,0 +1,399 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compact hand-off format for contexts passed to other processes.
+
+Contexts are passed from the launcher to the DCC, and from a Nuke session to
+the processes spawned by file->new and file->open, through environment
+variables. Rather than a full `tank.context.serialize()` payload, they are
+encoded as compressed JSON holding only the context's entities and the
+location of its pipeline configuration. Payloads that are still large are
+written to a file named after the sha1 of its contents, in the user's private
+directory of sgtk_userdir, and only a reference to it goes into the
+environment, so that big contexts don't bloat the environment of every
+process Nuke spawns. The file is only read if it belongs to the user and its
+contents still match its sha1. If it can't be written, the payload goes into
+the environment as is. Files that haven't been used for a week are removed.
+
+Decoding only rebuilds the context from the stored entities. No Shotgun
+lookups are made, and the caller's Toolkit instance is reused when it
+belongs to the same pipeline configuration.
+
+The launcher hands the DCC its context in the TK_NUKE_CONTEXT environment
+variable, and leaves the standard TANK_CONTEXT one, which other tools
+decode with `tank.context.deserialize()`, as it is. The DCC uses the
+launch context of :func:`get_launch_payload`.
+
+Values that are not in this format are decoded with
+`tank.context.deserialize()`, so older payloads keep working.
+
+The size and encoding and decoding times of both formats can be compared,
+without Toolkit, with:
+
+    python sgtk_handoff.py benchmark [count]
+"""
+
+import os
+import sys
+import gc
+import json
+import zlib
+import base64
+import time
+import hashlib
+
+import sgtk_userdir
+from sgtk_paths import normalize_path
+
+HANDOFF_VERSION = 1
+HANDOFF_PREFIX = "tkctx:%d:" % HANDOFF_VERSION
+
+# The launch context, in the hand-off format, as set by the launcher.
+CONTEXT_ENV_VAR = "TK_NUKE_CONTEXT"
+
+# Encoded contexts larger than this are written to a file instead of being
+# put in the environment directly.
+MAX_INLINE_SIZE = 2048
+
+# Payload files not written or used for this long, in seconds, are removed.
+MAX_PAYLOAD_AGE = 7 * 24 * 60 * 60
+
+# The context attributes that are handed off.
+_CONTEXT_FIELDS = (
+    "project",
+    "entity",
+    "step",
+    "task",
+    "user",
+    "additional_entities",
+    "source_entity",
+)
+
+
+def encode_context(context, inline=False):
+    """
+    Encodes a context in the compact hand-off format.
+
+    :param context: The sgtk.context.Context to encode.
+    :param inline:  If True, the encoded context is always returned as is,
+                    regardless of its size.
+
+    :returns: A string, suitable for an environment variable.
+    """
+    data = dict(pc=context.tank.pipeline_configuration.get_path())
+    for field in _CONTEXT_FIELDS:
+        value = getattr(context, field, None)
+        if value:
+            data[field] = value
+
+    encoded = base64.urlsafe_b64encode(
+        zlib.compress(json.dumps(data, separators=(",", ":")))
+    )
+
+    if inline or len(encoded) <= MAX_INLINE_SIZE:
+        return HANDOFF_PREFIX + encoded
+
+    try:
+        return HANDOFF_PREFIX + "@" + _write_payload_file(encoded)
+    except (IOError, OSError):
+        # Only the size of the environment suffers.
+        return HANDOFF_PREFIX + encoded
+
+
+def _get_payload_path(digest):
+    """
+    Returns the path of the payload file with the given sha1.
+
+    :param digest:  The hex sha1 of the encoded context.
+
+    :raises OSError: If the user's directory can't be used.
+    """
+    return os.path.join(sgtk_userdir.get_user_dir("handoff"), "%s.ctx" % digest)
+
+
+def _write_payload_file(encoded):
+    """
+    Writes an encoded context to a file named after its sha1, unless that
+    file has already been written and is intact.
+
+    :param encoded: The encoded context.
+
+    :returns: The sha1 of the encoded context, which identifies the file.
+    :raises OSError, IOError: If the file can't be written.
+    """
+    digest = hashlib.sha1(encoded).hexdigest()
+    payload_path = _get_payload_path(digest)
+    try:
+        _read_payload_file(digest)
+    except (IOError, OSError, ValueError):
+        # Missing, or not to be trusted, and replaced below.
+        pass
+    else:
+        # Keep it from being pruned for as long as it is in use.
+        os.utime(payload_path, None)
+        return digest
+
+    _prune_payload_files(os.path.dirname(payload_path))
+
+    temp_path = "%s.%d.tmp" % (payload_path, os.getpid())
+    with open(temp_path, "w") as fh:
+        fh.write(encoded)
+    os.rename(temp_path, payload_path)
+    return digest
+
+
+def _read_payload_file(digest):
+    """
+    Reads an encoded context from the file it was written to.
+
+    :param digest:  The sha1 of the encoded context.
+
+    :returns: The encoded context.
+    :raises ValueError: If the reference isn't a sha1, the file doesn't belong
+                        to the user, or its contents don't match their sha1.
+    """
+    if len(digest) != 40 or digest.strip("0123456789abcdef"):
+        raise ValueError("Invalid context payload reference: %s" % digest)
+    payload_path = _get_payload_path(digest)
+    if not sgtk_userdir.is_owned(payload_path):
+        raise ValueError("The context payload %s isn't owned by the current user" % payload_path)
+    with open(payload_path) as fh:
+        encoded = fh.read()
+    if hashlib.sha1(encoded).hexdigest() != digest:
+        raise ValueError("The context payload %s has been modified" % payload_path)
+    return encoded
+
+
+def _prune_payload_files(payload_dir):
+    """
+    Removes the payload files that haven't been written or used for a while.
+
+    :param payload_dir: The directory payloads are written to.
+    """
+    now = time.time()
+    try:
+        names = os.listdir(payload_dir)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(payload_dir, name)
+        try:
+            if now - os.path.getmtime(path) > MAX_PAYLOAD_AGE:
+                os.remove(path)
+        except OSError:
+            # Removed by another process in the meantime.
+            pass
+
+
+def get_launch_payload():
+    """
+    Returns the context the DCC was launched with, as the launcher handed it
+    over in the compact format, or as serialized in TANK_CONTEXT if it
+    didn't.
+
+    :returns: A string to pass to :func:`decode_context`, or None.
+    """
+    return os.environ.get(CONTEXT_ENV_VAR) or os.environ.get("TANK_CONTEXT")
+
+
+def decode_context(payload, tk=None, same_config=False):
+    """
+    Decodes a context handed off by another process.
+
+    :param payload:     A string as returned by :func:`encode_context`, or by
+                        `tank.context.serialize()`.
+    :param tk:          An optional Toolkit API instance, which is used for the
+                        context if it belongs to the right pipeline
+                        configuration.
+    :param same_config: Whether to reject a context of another pipeline
+                        configuration than tk's, rather than creating a
+                        Toolkit API instance for it.
+
+    :returns: The decoded sgtk.context.Context.
+    :raises ValueError: If same_config is set and the context belongs to
+                        another pipeline configuration.
+    """
+    import tank
+
+    if not payload.startswith(HANDOFF_PREFIX):
+        context = tank.context.deserialize(payload)
+        if same_config and not _is_config_of(tk, context.tank.pipeline_configuration.get_path()):
+            raise ValueError("The context belongs to another pipeline configuration")
+        return context
+
+    data = decode_fields(payload)
+    config_path = data.pop("pc")
+    if not _is_config_of(tk, config_path):
+        if same_config:
+            raise ValueError("The context belongs to %s, not to the expected configuration" % config_path)
+        tk = tank.tank_from_path(config_path)
+
+    return tank.context.Context(tk, **data)
+
+
+def decode_fields(payload):
+    """
+    Returns the fields of a context encoded in the compact hand-off format.
+
+    :param payload: A string as returned by :func:`encode_context`.
+
+    :returns: A dict of the context's fields, and of its pipeline
+              configuration's path as "pc".
+    """
+    encoded = payload[len(HANDOFF_PREFIX):]
+    if encoded.startswith("@"):
+        encoded = _read_payload_file(encoded[1:])
+    return _to_str(json.loads(zlib.decompress(base64.urlsafe_b64decode(encoded))))
+
+
+def _is_config_of(tk, config_path):
+    """
+    Whether the given pipeline configuration is the one of a Toolkit API
+    instance.
+
+    :param tk:          A Toolkit API instance, or None.
+    :param config_path: The root path of a pipeline configuration.
+    """
+    if tk is None:
+        return False
+    tk_config_path = tk.pipeline_configuration.get_path()
+    return tk_config_path == config_path or (
+        normalize_path(tk_config_path) == normalize_path(config_path)
+    )
+
+
+def _to_str(value):
+    """
+    Converts the unicode strings in decoded JSON data back to utf-8 encoded
+    strings, which is what contexts hold when they are built by Toolkit.
+
+    :param value:   The decoded JSON data.
+    """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [_to_str(item) for item in value]
+    if isinstance(value, dict):
+        return dict((_to_str(k), _to_str(v)) for (k, v) in value.iteritems())
+    return value
+
+
+class _FakeConfig(object):
+    """
+    A pipeline configuration, for the benchmark.
+    """
+    def get_path(self):
+        return "/mnt/projects/synthetic/pipeline/config"
+
+
+class _FakeTank(object):
+    """
+    A Toolkit API instance, for the benchmark.
+    """
+    pipeline_configuration = _FakeConfig()
+
+
+class _FakeContext(object):
+    """
+    A context with the entity dicts of a typical shot task context, and
+    possibly additional entities.
+    """
+    def __init__(self, additional_count):
+        self.tank = _FakeTank()
+        self.project = dict(type="Project", id=1, name="synthetic")
+        self.entity = dict(type="Shot", id=1234, name="seq001_1234")
+        self.step = dict(type="Step", id=8, name="Comp")
+        self.task = dict(type="Task", id=12340, name="seq001_1234_comp")
+        self.user = dict(type="HumanUser", id=42, name="Artist")
+        self.additional_entities = [
+            dict(type="Asset", id=i, name="asset_%04d" % i) for i in range(additional_count)
+        ]
+        self.source_entity = None
+
+
+def _serialize(context):
+    """
+    Returns the payload `tank.context.serialize()` hands off, which pickles
+    the context's fields and the path of its pipeline configuration.
+    """
+    # Only the benchmark needs it, and every Nuke process imports this module.
+    import pickle
+
+    data = dict(_pc_path=context.tank.pipeline_configuration.get_path())
+    for field in _CONTEXT_FIELDS:
+        data[field] = getattr(context, field, None)
+    return pickle.dumps(data)
+
+
+def _time(function, argument, count):
+    """
+    Returns the average time a call of a function took, in microseconds.
+    """
+    start = time.time()
+    for _ in xrange(count):
+        function(argument)
+    return (time.time() - start) / count * 1000000
+
+
+def _benchmark(count):
+    """
+    Measures the size of the payloads of both formats, and the time taken to
+    encode and decode them, for contexts of increasing size.
+
+    Only what differs between the formats is timed. Both end up building the
+    same Context, and the previous format also creates a Toolkit API instance
+    for it, which isn't included.
+
+    :param count:   The number of times each payload is encoded and decoded.
+    """
+    import pickle
+
+    # As timeit does, so that garbage collections don't skew the timings.
+    gc.disable()
+
+    print "%-22s %-10s %9s %11s %11s" % ("context", "format", "env bytes", "encode us", "decode us")
+    for additional_count in (0, 10, 100):
+        context = _FakeContext(additional_count)
+        label = "shot task, %d extra" % additional_count
+
+        payload = _serialize(context)
+        print "%-22s %-10s %9d %11.1f %11.1f" % (
+            label, "serialize", len(payload),
+            _time(_serialize, context, count),
+            _time(pickle.loads, payload, count),
+        )
+
+        payload = encode_context(context)
+        print "%-22s %-10s %9d %11.1f %11.1f" % (
+            label, "hand-off", len(payload),
+            _time(encode_context, context, count),
+            _time(decode_fields, payload, count),
+        )
+
+    gc.enable()
+    return 0
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+    """
+    if args and args[0] == "benchmark" and len(args) <= 2:
+        return _benchmark(int(args[1]) if len(args) == 2 else 10000)
+
+    print "Usage: sgtk_handoff.py benchmark [count]"
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
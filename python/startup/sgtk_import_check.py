@@ -0,0 +1,200 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Check of what importing the tk_nuke package costs.
+
+The tk_nuke package is imported by every Nuke process, including batch
+renders and the processes spawned by file->new and file->open, so it only
+imports what the script callbacks need. This script imports it in fresh
+Python processes, reports how long the import took and, as `-X importtime`
+does in Python 3.7 and later, how long each module it loaded took to import,
+on its own and along with the modules it imported in turn, and fails if any
+of the modules only needed by the UI or the context caches were loaded with
+it:
+
+    python sgtk_import_check.py [runs]
+
+Each module's times are the median of the runs, so a module that got slower
+stands out. Timing the imports adds a little to them, so the totals are
+slightly higher than those of a plain import.
+
+It can run outside of Nuke, such as on a CI machine. Where the nuke and tank
+modules can't be imported, empty placeholder modules are used instead, and
+the modules they import themselves are never counted against tk_nuke.
+
+This module only depends on the standard library.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+# The modules that must not be loaded by importing tk_nuke.
+DENIED_MODULES = (
+    "sqlite3",
+    "sgtk_context_daemon",
+    "sgtk_context_table",
+    "tk_nuke.context",
+    "tk_nuke.context_cache",
+    "tk_nuke.context_resolver",
+    "tk_nuke.context_store",
+    "tk_nuke.entity_cache",
+    "tk_nuke.menu_generation",
+    "tk_nuke.prewarm",
+    "tk_nuke.startup_report",
+    "tk_nuke.tank_pool",
+    "tk_nuke.version_up",
+)
+
+# Imports tk_nuke from the python directory given as its argument, and prints
+# the modules it loaded, how long it took, and how long each module took, as
+# JSON. An import that loads several modules at once, such as "import a.b",
+# is reported under all of their names.
+_CHILD_SCRIPT = """
+import sys
+import time
+import types
+import __builtin__
+
+for name in ("nuke", "tank"):
+    try:
+        __import__(name)
+    except ImportError:
+        sys.modules[name] = types.ModuleType(name)
+
+imports = []
+stack = []
+original_import = __builtin__.__import__
+
+def timed_import(name, *args, **kwargs):
+    before = set(sys.modules)
+    stack.append([])
+    start = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        cumulative = time.time() - start
+        children = stack.pop()
+        loaded = set(n for n in sys.modules if n not in before and sys.modules[n] is not None)
+        nested = set()
+        for child in children:
+            nested.update(child["loaded"])
+        own = sorted(loaded - nested)
+        if own:
+            record = dict(
+                name=", ".join(own),
+                loaded=loaded,
+                self=cumulative - sum(child["cumulative"] for child in children),
+                cumulative=cumulative,
+                depth=len(stack),
+            )
+            imports.append(record)
+            children = [record]
+        if stack:
+            stack[-1].extend(children)
+
+sys.path.insert(0, sys.argv[1])
+before = set(name for (name, module) in sys.modules.items() if module is not None)
+__builtin__.__import__ = timed_import
+start = time.time()
+import tk_nuke
+elapsed = time.time() - start
+__builtin__.__import__ = original_import
+loaded = set(name for (name, module) in sys.modules.items() if module is not None)
+
+for record in imports:
+    del record["loaded"]
+
+import json
+sys.stdout.write(json.dumps(dict(
+    elapsed=elapsed,
+    modules=sorted(loaded - before),
+    imports=imports,
+)))
+"""
+
+
+def import_tk_nuke(python_path):
+    """
+    Imports tk_nuke in a fresh Python process.
+
+    :param python_path: The engine's python directory, holding tk_nuke.
+
+    :returns: A tuple of the time the import took, in seconds, the list of
+              the modules it loaded, and a list of dicts of each import's
+              module "name", "self" and "cumulative" times in seconds, and
+              nesting "depth", in the order they completed.
+    :raises RuntimeError: If the import failed.
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-c", _CHILD_SCRIPT, python_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    (output, errors) = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError("Importing tk_nuke failed:\n%s" % errors)
+    result = json.loads(output)
+    return (result["elapsed"], result["modules"], result["imports"])
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+
+    :returns: 0 if tk_nuke imported none of the denied modules, 1 otherwise.
+    """
+    if len(args) > 1 or (args and not args[0].isdigit()):
+        print "Usage: sgtk_import_check.py [runs]"
+        return 1
+    runs = max(1, int(args[0]) if args else 5)
+
+    python_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    modules = []
+    imports = []
+    module_timings = dict()
+    for _ in range(runs):
+        (elapsed, modules, imports) = import_tk_nuke(python_path)
+        timings.append(elapsed)
+        for record in imports:
+            module_timings.setdefault(record["name"], []).append(
+                (record["self"], record["cumulative"])
+            )
+    timings.sort()
+
+    print "Imported tk_nuke %d times: best %.1fms, median %.1fms" % (
+        runs, timings[0] * 1000, timings[len(timings) // 2] * 1000,
+    )
+    print "Loaded %d modules, median import times:" % len(modules)
+    print "%10s | %10s | %s" % ("self [ms]", "cum. [ms]", "module")
+    for record in imports:
+        self_times = sorted(t[0] for t in module_timings[record["name"]])
+        cumulative_times = sorted(t[1] for t in module_timings[record["name"]])
+        print "%10.2f | %10.2f | %s%s" % (
+            self_times[len(self_times) // 2] * 1000,
+            cumulative_times[len(cumulative_times) // 2] * 1000,
+            "  " * record["depth"],
+            record["name"],
+        )
+
+    denied = [name for name in DENIED_MODULES if name in modules]
+    if denied:
+        print "Importing tk_nuke must not load: %s" % ", ".join(denied)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
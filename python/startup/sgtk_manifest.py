@@ -0,0 +1,337 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Startup manifest precomputed by the launcher.
+
+`bootstrap.py` runs in the launcher process and already knows the engine and
+context that Nuke, Hiero, or Nuke Studio is going to start in. While the DCC
+is busy loading its own plugins, the launcher resolves the app gizmo and
+python folders and the favourite directories and writes them to a manifest
+file, whose location is passed down in the environment. The engine uses the
+manifest instead of recomputing those values, as long as it starts in the
+context the manifest was built for.
+
+Manifests are written to the user's private directory, see sgtk_userdir, and
+are removed by the engine once it has started. Those left behind by sessions
+that never got that far are pruned when the next manifest is built.
+
+Only the reading side of this module is used inside the DCC, and it depends
+on nothing but the standard library.
+"""
+
+import os
+import json
+import time
+import threading
+
+import sgtk_context_key
+import sgtk_userdir
+
+MANIFEST_VERSION = 2
+MANIFEST_ENV_VAR = "TANK_NUKE_STARTUP_MANIFEST"
+
+# Manifests older than this, in seconds, were left behind and are removed.
+MAX_MANIFEST_AGE = 24 * 60 * 60
+
+
+def get_context_key(context):
+    """
+    Returns a JSON-friendly key identifying the given context.
+
+    :param context: A sgtk.context.Context.
+    """
+    return sgtk_context_key.get_context_key(context).to_list()
+
+
+def start_manifest_build(engine_name, context):
+    """
+    Starts building the startup manifest for the given engine and context on
+    a background thread, and points the environment at the file it will be
+    written to. This is called by the launcher right before the DCC starts.
+
+    :param engine_name: The instance name of the engine that will be started.
+    :param context:     The sgtk.context.Context the engine will start in.
+
+    :returns: The thread building the manifest, or None if there is nowhere
+              to write it.
+    """
+    try:
+        manifest_dir = sgtk_userdir.get_user_dir("manifests")
+    except OSError:
+        # The engine will work everything out for itself.
+        return None
+    _prune_manifests(manifest_dir)
+
+    manifest_path = os.path.join(
+        manifest_dir,
+        "manifest-%d-%d.json" % (os.getpid(), id(context)),
+    )
+
+    # The DCC inherits the environment when it is spawned, so the variable
+    # has to be set now. If the manifest isn't ready by the time the engine
+    # looks for it, everything is simply computed as usual.
+    os.environ[MANIFEST_ENV_VAR] = manifest_path
+
+    # A daemon thread, so that the launcher never waits for it to exit. If
+    # it is cut short, the engine starts without a manifest.
+    thread = threading.Thread(
+        target=_build_manifest,
+        args=(engine_name, context, manifest_path),
+        name="tk-nuke-manifest",
+    )
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def _prune_manifests(manifest_dir):
+    """
+    Removes the manifests left behind by sessions that never used them.
+
+    :param manifest_dir:    The directory manifests are written to.
+    """
+    now = time.time()
+    try:
+        names = os.listdir(manifest_dir)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(manifest_dir, name)
+        try:
+            if now - os.path.getmtime(path) > MAX_MANIFEST_AGE:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def remove_manifest():
+    """
+    Removes the startup manifest handed to this process, once the engine has
+    no more use for it. The processes it spawns work from its snapshot.
+    """
+    manifest_path = os.environ.pop(MANIFEST_ENV_VAR, None)
+    if manifest_path and sgtk_userdir.is_owned(manifest_path):
+        try:
+            os.remove(manifest_path)
+        except OSError:
+            pass
+
+
+def _build_manifest(engine_name, context, manifest_path):
+    """
+    Builds the startup manifest and writes it to disk.
+
+    :param engine_name:     The instance name of the engine that will be started.
+    :param context:         The sgtk.context.Context the engine will start in.
+    :param manifest_path:   The path the manifest is written to.
+    """
+    import sgtk_trace
+
+    with sgtk_trace.span("sgtk_manifest.build"):
+        try:
+            data = _resolve_manifest(engine_name, context)
+        except Exception:
+            # The manifest is only an optimization. If it can't be built,
+            # the engine will work everything out for itself.
+            return
+
+        temp_path = "%s.tmp" % manifest_path
+        try:
+            with open(temp_path, "w") as fh:
+                json.dump(data, fh)
+            os.rename(temp_path, manifest_path)
+        except (IOError, OSError):
+            pass
+
+
+def get_environment(context):
+    """
+    Returns the environment the given context maps to.
+
+    :param context: A sgtk.context.Context.
+    """
+    import tank
+
+    tk = context.tank
+    env_name = tk.execute_core_hook(
+        tank.constants.PICK_ENVIRONMENT_CORE_HOOK_NAME,
+        context=context,
+    )
+    return tk.pipeline_configuration.get_environment(env_name, context)
+
+
+def _resolve_manifest(engine_name, context):
+    """
+    Resolves the contents of the startup manifest.
+
+    :param engine_name: The instance name of the engine that will be started.
+    :param context:     The sgtk.context.Context the engine will start in.
+
+    :returns: A dict holding the manifest's contents.
+    """
+    tk = context.tank
+    config = tk.pipeline_configuration
+    env = get_environment(context)
+    settings = env.get_engine_settings(engine_name)
+
+    # App gizmo folders, keyed by the location of each app on disk, and the
+    # apps' python folders.
+    gizmo_folders = dict()
+    python_folders = []
+    for app_name in env.get_apps(engine_name):
+        app_location = env.get_app_descriptor(engine_name, app_name).get_path()
+        python_folder = os.path.join(app_location, "python")
+        if os.path.isdir(python_folder):
+            python_folders.append(python_folder)
+        gizmo_folder = os.path.join(app_location, "gizmos")
+        if os.path.exists(gizmo_folder):
+            gizmo_folders[app_location] = gizmo_folder.replace(os.path.sep, "/")
+        else:
+            gizmo_folders[app_location] = None
+
+    # Favourite directories for the file dialogs, with the same fallbacks as
+    # the engine applies when it resolves them itself. If any of them can't
+    # be resolved, the engine resolves them all again, and reports why.
+    engine_location = env.get_engine_descriptor(engine_name).get_path()
+    sg_logo = os.path.join(engine_location, "resources", "sg_logo_80px.png")
+    favourite_dirs = []
+    for favorite in settings.get("favourite_directories") or []:
+        template = tk.templates.get(favorite["template_directory"])
+        if template is None:
+            favourite_dirs = None
+            break
+        try:
+            fields = context.as_template_fields(template)
+            path = template.apply_fields(fields)
+        except Exception:
+            favourite_dirs = None
+            break
+
+        icon_path = favorite.get("icon")
+        if icon_path:
+            icon_path = os.path.join(config.get_config_location(), icon_path)
+        if not icon_path or not os.path.isfile(icon_path):
+            icon_path = sg_logo
+
+        favourite_dirs.append(
+            dict(
+                display_name=favorite["display_name"],
+                path=path,
+                icon=icon_path,
+            )
+        )
+
+    return dict(
+        version=MANIFEST_VERSION,
+        engine_name=engine_name,
+        pipeline_config_path=config.get_path(),
+        context_key=get_context_key(context),
+        gizmo_folders=gizmo_folders,
+        python_folders=python_folders,
+        favourite_dirs=favourite_dirs,
+    )
+
+
+class StartupManifest(object):
+    """
+    A startup manifest as written by the launcher.
+    """
+    def __init__(self, data):
+        """
+        Initializes a new manifest.
+
+        :param data:    The manifest's contents.
+        """
+        self._data = data
+
+    def applies_to(self, engine):
+        """
+        Whether the manifest was built for the given engine's current
+        configuration and context.
+
+        :param engine:  The running tk-nuke engine.
+        """
+        return (
+            self._data.get("version") == MANIFEST_VERSION
+            and self._data.get("engine_name") == engine.instance_name
+            and self._data.get("pipeline_config_path") == engine.tank.pipeline_configuration.get_path()
+            and self._data.get("context_key") == get_context_key(engine.context)
+        )
+
+    def get_gizmo_folder(self, app_location):
+        """
+        Returns the gizmo folder of an app as found by the launcher.
+
+        :param app_location:    The app's location on disk.
+
+        :returns: A tuple of whether the app was known to the launcher
+                  and its gizmo folder, which is None if it has none.
+        """
+        folders = self._data["gizmo_folders"]
+        if app_location not in folders:
+            return (False, None)
+        return (True, folders[app_location])
+
+    def get_favourite_dirs(self, context):
+        """
+        Returns the favourite directories resolved by the launcher, or None
+        if some of them couldn't be.
+
+        :param context: Unused, the context is checked by :meth:`applies_to`.
+                        Accepted so that manifests and engine snapshots can
+                        be used interchangeably.
+        """
+        return self._data["favourite_dirs"]
+
+
+def get_app_python_folders():
+    """
+    Returns the python folders of the apps listed in the startup manifest.
+
+    Unlike the rest of the manifest, these are used before the engine is
+    started, and regardless of its context, as they are only a hint for the
+    module index. An empty list is returned if there is no manifest.
+    """
+    manifest_path = os.environ.get(MANIFEST_ENV_VAR)
+    if not manifest_path or not sgtk_userdir.is_owned(manifest_path):
+        return []
+
+    try:
+        with open(manifest_path) as fh:
+            data = json.load(fh)
+    except Exception:
+        return []
+
+    if data.get("version") != MANIFEST_VERSION:
+        return []
+    return [str(folder) for folder in data.get("python_folders", [])]
+
+
+def load_manifest(engine):
+    """
+    Returns the startup manifest for the given engine, or None if there is
+    none, it isn't ready yet, or it was built for a different context.
+
+    :param engine:  The running tk-nuke engine.
+    """
+    manifest_path = os.environ.get(MANIFEST_ENV_VAR)
+    if not manifest_path or not sgtk_userdir.is_owned(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path) as fh:
+            manifest = StartupManifest(json.load(fh))
+        if manifest.applies_to(engine):
+            return manifest
+    except Exception:
+        pass
+
+    return None
@@ -0,0 +1,95 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Path normalization and pipeline configuration hashes.
+
+The context caches of the engine, the context store, the context daemon and
+the context tables all key contexts by normalized paths, and only trust them
+for as long as the hash of their pipeline configuration is unchanged. A
+context one of them resolved is only found by the others if they all compute
+these the same way, so they all use this module. Walking a configuration's
+files is slow on network storage, so each hash is computed at most once
+every CONFIG_CHECK_INTERVAL seconds, and shared by everything in the
+process that asks for it.
+
+This module only depends on the standard library.
+"""
+
+import os
+import time
+import hashlib
+
+# How long the hash of a configuration is reused for, in seconds, before its
+# files are walked again.
+CONFIG_CHECK_INTERVAL = 10.0
+
+# The hash of each configuration computed by this process, and when, by
+# normalized configuration path.
+_config_hashes = dict()
+
+
+def normalize_path(path):
+    """
+    Returns a normalized version of the given path, suitable for use as
+    a cache key.
+
+    :param path:    The path to normalize.
+    """
+    return os.path.normcase(os.path.normpath(path))
+
+
+def get_config_hash(config_path):
+    """
+    Returns a hash identifying the current state of a pipeline configuration.
+
+    The hash covers the configuration's location and the modification times
+    of its core and environment files, so that any edit to the configuration
+    results in a different value, once the hash computed before it is more
+    than CONFIG_CHECK_INTERVAL seconds old.
+
+    :param config_path: The root path of the pipeline configuration.
+    """
+    key = normalize_path(config_path)
+    now = time.time()
+    cached = _config_hashes.get(key)
+    if cached is not None and now - cached[1] < CONFIG_CHECK_INTERVAL:
+        return cached[0]
+
+    config_hash = _compute_config_hash(config_path)
+    _config_hashes[key] = (config_hash, now)
+    return config_hash
+
+
+def _compute_config_hash(config_path):
+    """
+    Walks a pipeline configuration's files and returns their hash, see
+    :func:`get_config_hash`.
+
+    :param config_path: The root path of the pipeline configuration.
+    """
+    digest = hashlib.sha1(normalize_path(config_path))
+    config_dir = os.path.join(config_path, "config")
+
+    for sub_dir in ("core", "env"):
+        for (root, dirs, files) in os.walk(os.path.join(config_dir, sub_dir)):
+            # Sort in place so that os.walk visits folders in a stable order.
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.endswith(".yml"):
+                    continue
+                file_path = os.path.join(root, file_name)
+                try:
+                    mtime = os.path.getmtime(file_path)
+                except OSError:
+                    continue
+                digest.update("%s:%r;" % (file_path, mtime))
+
+    return digest.hexdigest()
@@ -0,0 +1,359 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Readahead of the file a DCC is launched to open.
+
+The launcher knows which file the DCC is going to open long before the DCC
+gets around to reading it. When the TK_NUKE_PREFETCH environment variable is
+set, `bootstrap.py` reads that file on a background thread while the DCC
+starts up, so that it is in the operating system's page cache by the time it
+is opened. With TK_NUKE_PREFETCH_READS set as well, the first frame of each
+Read node found by a light text scan of a Nuke script is read too.
+
+Prefetching stops once TK_NUKE_PREFETCH_MAX_MB megabytes (256 by default)
+have been read, or after TK_NUKE_PREFETCH_TIMEOUT seconds (10 by default).
+The files it warmed are written to a report in the user's private directory,
+see sgtk_userdir, from which the DCC works out how many of the files it
+needed were prefetched, and which it removes once it has been read. Reports
+left behind are removed after a day.
+
+This module only depends on the standard library.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+import sgtk_userdir
+from sgtk_paths import normalize_path
+
+PREFETCH_ENV_VAR = "TK_NUKE_PREFETCH"
+PREFETCH_READS_ENV_VAR = "TK_NUKE_PREFETCH_READS"
+MAX_MB_ENV_VAR = "TK_NUKE_PREFETCH_MAX_MB"
+TIMEOUT_ENV_VAR = "TK_NUKE_PREFETCH_TIMEOUT"
+REPORT_ENV_VAR = "TANK_NUKE_PREFETCH_REPORT"
+
+DEFAULT_MAX_MB = 256
+DEFAULT_TIMEOUT = 10.0
+
+# Reports older than this, in seconds, were never read and are removed.
+MAX_REPORT_AGE = 24 * 60 * 60
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Matches the start of a Read node, and the knobs of interest inside it.
+_READ_NODE_RE = re.compile(r"^\s*Read\s*\{", re.MULTILINE)
+_NODE_END_RE = re.compile(r"^\s*\}", re.MULTILINE)
+_FILE_KNOB_RE = re.compile(r"^\s*file\s+(\"(?:[^\"\\]|\\.)*\"|\S+)", re.MULTILINE)
+_FIRST_KNOB_RE = re.compile(r"^\s*first\s+(-?\d+)", re.MULTILINE)
+
+# Frame number placeholders in file paths.
+_PRINTF_RE = re.compile(r"%(0?)(\d*)d")
+_HASH_RE = re.compile(r"#+")
+
+
+def enabled():
+    """
+    Whether prefetching has been requested.
+    """
+    return bool(os.environ.get(PREFETCH_ENV_VAR))
+
+
+def start_prefetch(path):
+    """
+    Starts prefetching the given file, and the media it reads if requested,
+    on a background thread. This is called by the launcher right before the
+    DCC starts.
+
+    :param path:    The path of the file the DCC will open.
+
+    :returns: The prefetching thread, or None if prefetching is disabled.
+    """
+    if not enabled() or not path:
+        return None
+
+    try:
+        max_bytes = int(float(os.environ.get(MAX_MB_ENV_VAR, DEFAULT_MAX_MB)) * 1024 * 1024)
+        timeout = float(os.environ.get(TIMEOUT_ENV_VAR, DEFAULT_TIMEOUT))
+    except ValueError:
+        max_bytes = DEFAULT_MAX_MB * 1024 * 1024
+        timeout = DEFAULT_TIMEOUT
+
+    try:
+        report_dir = sgtk_userdir.get_user_dir("prefetch")
+    except OSError:
+        # The file is still prefetched, it just isn't reported.
+        report_path = None
+    else:
+        _prune_reports(report_dir)
+        report_path = os.path.join(
+            report_dir,
+            "prefetch-%d-%d.json" % (os.getpid(), int(time.time() * 1000)),
+        )
+        os.environ[REPORT_ENV_VAR] = report_path
+
+    # Not a daemon thread, so that the prefetch can finish even if the
+    # launching process has nothing else left to do. The budgets bound it.
+    thread = threading.Thread(
+        target=_prefetch,
+        args=(
+            path,
+            bool(os.environ.get(PREFETCH_READS_ENV_VAR)),
+            max_bytes,
+            time.time() + timeout,
+            report_path,
+        ),
+    )
+    thread.start()
+    return thread
+
+
+def _prefetch(path, include_reads, max_bytes, deadline, report_path):
+    """
+    Reads the given file, and the first frames of its Read nodes if
+    requested, within the given budgets, and writes a report of what was
+    read.
+
+    :param path:            The path of the file the DCC will open.
+    :param include_reads:   Whether to prefetch the first frame of each
+                            Read node.
+    :param max_bytes:       The maximum number of bytes to read.
+    :param deadline:        The time after which prefetching stops.
+    :param report_path:     The path the report is written to, or None.
+    """
+    import sgtk_trace
+
+    report = dict(
+        script=path,
+        files=[],
+        bytes=0,
+        budget_exhausted=False,
+        elapsed=0.0,
+    )
+    start = time.time()
+
+    with sgtk_trace.span("sgtk_prefetch.prefetch", path=path):
+        try:
+            paths = [path]
+            if include_reads and path.endswith(".nk"):
+                paths.extend(scan_read_paths(path))
+
+            for file_path in paths:
+                if report["bytes"] >= max_bytes or time.time() >= deadline:
+                    report["budget_exhausted"] = True
+                    break
+                read = _read_file(file_path, max_bytes - report["bytes"], deadline)
+                if read is not None:
+                    report["bytes"] += read
+                    report["files"].append(normalize_path(file_path))
+        except Exception:
+            # Prefetching is only an optimization.
+            pass
+
+        report["elapsed"] = time.time() - start
+        if not report_path:
+            return
+
+        temp_path = "%s.tmp" % report_path
+        try:
+            with open(temp_path, "w") as fh:
+                json.dump(report, fh)
+            os.rename(temp_path, report_path)
+        except (IOError, OSError):
+            pass
+
+
+def _read_file(path, max_bytes, deadline):
+    """
+    Reads a file into the page cache, discarding its contents.
+
+    :param path:        The path of the file to read.
+    :param max_bytes:   The maximum number of bytes to read.
+    :param deadline:    The time after which reading stops.
+
+    :returns: The number of bytes read, or None if the file couldn't be read
+              whole within the budgets.
+    """
+    read = 0
+    try:
+        with open(path, "rb") as fh:
+            while True:
+                if read >= max_bytes or time.time() >= deadline:
+                    return None
+                chunk = fh.read(min(_CHUNK_SIZE, max_bytes - read))
+                if not chunk:
+                    return read
+                read += len(chunk)
+    except (IOError, OSError):
+        return None
+
+
+def scan_read_paths(script_path):
+    """
+    Returns the path of the first frame of each Read node in a Nuke script,
+    as found by scanning its text. Paths using expressions or TCL are
+    skipped, as are relative paths.
+
+    :param script_path: The path of the Nuke script.
+    """
+    with open(script_path, "rb") as fh:
+        data = fh.read()
+
+    paths = []
+    matches = list(_READ_NODE_RE.finditer(data))
+    for (index, match) in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(data)
+        # A node's knobs end at the first line closing its block.
+        end_match = _NODE_END_RE.search(data, match.end(), end)
+        block = data[match.end():end_match.start() if end_match else end]
+
+        file_match = _FILE_KNOB_RE.search(block)
+        if not file_match:
+            continue
+        file_path = file_match.group(1)
+        if file_path.startswith("\""):
+            file_path = file_path[1:-1].replace("\\\"", "\"")
+        if "[" in file_path or "$" in file_path or not os.path.isabs(file_path):
+            continue
+
+        first_match = _FIRST_KNOB_RE.search(block)
+        first = int(first_match.group(1)) if first_match else 1
+        paths.append(get_frame_path(file_path, first))
+
+    return paths
+
+
+def get_frame_path(path, frame):
+    """
+    Returns the path of the given frame of an image sequence.
+
+    :param path:    A path holding a printf (%04d) or hash (####) frame
+                    placeholder, or none for single files.
+    :param frame:   The frame number.
+    """
+    def _printf(match):
+        padding = int(match.group(2) or 0)
+        return "%0*d" % (padding, frame)
+
+    def _hashes(match):
+        return "%0*d" % (len(match.group(0)), frame)
+
+    path = _PRINTF_RE.sub(_printf, path)
+    return _HASH_RE.sub(_hashes, path)
+
+
+def _prune_reports(report_dir):
+    """
+    Removes the reports left behind by sessions that never read them.
+
+    :param report_dir:  The directory reports are written to.
+    """
+    now = time.time()
+    try:
+        names = os.listdir(report_dir)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(report_dir, name)
+        try:
+            if now - os.path.getmtime(path) > MAX_REPORT_AGE:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def get_report_path():
+    """
+    Returns the path of the report of the prefetcher the launcher started,
+    or None if it didn't start one.
+    """
+    return os.environ.get(REPORT_ENV_VAR)
+
+
+def load_report(report_path=None):
+    """
+    Returns the report written by the prefetcher the launcher started, or
+    None if there is none or it hasn't finished.
+
+    :param report_path: The path of the report, see :func:`get_report_path`.
+                        Defaults to the one in the environment.
+    """
+    report_path = report_path or get_report_path()
+    if not report_path or not sgtk_userdir.is_owned(report_path):
+        return None
+
+    try:
+        with open(report_path) as fh:
+            return json.load(fh)
+    except Exception:
+        return None
+
+
+def remove_report(report_path):
+    """
+    Removes a report once it has been read.
+
+    :param report_path: The path of the report.
+    """
+    if report_path and sgtk_userdir.is_owned(report_path):
+        try:
+            os.remove(report_path)
+        except OSError:
+            pass
+
+
+def get_hit_rate(report, needed_paths):
+    """
+    Returns how many of the files the DCC needed had been prefetched.
+
+    :param report:          A report as returned by :func:`load_report`.
+    :param needed_paths:    The paths of the files the DCC read.
+
+    :returns: A tuple of the number of prefetched files that were needed,
+              the number of files that were needed, and their ratio.
+    """
+    prefetched = set(report["files"])
+    needed = set(normalize_path(p) for p in needed_paths)
+    if not needed:
+        return (0, 0, 0.0)
+    hits = len(needed & prefetched)
+    return (hits, len(needed), float(hits) / len(needed))
+
+
+def get_summary(report, needed_paths):
+    """
+    Returns a summary of a prefetch report, for logging and tracing.
+
+    :param report:          A report as returned by :func:`load_report`.
+    :param needed_paths:    The paths of the files the DCC read.
+
+    :returns: A tuple of a one line summary and a dict of its figures.
+    """
+    (hits, total, hit_rate) = get_hit_rate(report, needed_paths)
+    figures = dict(
+        hits=hits,
+        needed=total,
+        hit_rate=hit_rate,
+        bytes=report["bytes"],
+        elapsed=report["elapsed"],
+        budget_exhausted=report["budget_exhausted"],
+    )
+    msg = "Prefetch: %d of %d files read on open were prefetched (%.0f%%), %.1f MB in %.3fs%s" % (
+        hits,
+        total,
+        hit_rate * 100,
+        report["bytes"] / (1024.0 * 1024.0),
+        report["elapsed"],
+        ", budget exhausted" if report["budget_exhausted"] else "",
+    )
+    return (msg, figures)
@@ -0,0 +1,537 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pre-warming of the apps' Python code while the engine starts.
+
+`start_engine` loads the configured apps one after another on the main
+thread, and each of them reads its Python files from the pipeline
+configuration's storage as it goes. When the TK_NUKE_PREWARM_APPS environment
+variable is set, the bootstrap starts pre-warming the apps of the target
+environment as soon as the context is known:
+
+- A small pool of threads reads every Python file of the apps into the
+  operating system's page cache, so the loads made by `start_engine` don't
+  wait on the network. The size of the pool is the value of the variable
+  when it is a number, at least 1, and DEFAULT_WORKERS when it is set to
+  anything else, such as "on".
+
+- The apps' modules are then imported on a background thread, parent
+  packages first, as long as nothing they run at import time could reach
+  Qt, Nuke, Hiero or the engine. The imports made at the top level of a
+  module, outside of its functions, are followed through the app's own
+  modules, including relative imports, and may otherwise only be of the
+  standard library or of modules already imported, such as Toolkit's.
+  Modules using import_framework(), current_bundle(), current_engine() or
+  Toolkit's qt module at import time, or importing anything else, are left
+  for `start_engine`, along with everything in their packages.
+
+Python 2 serializes imports on a global lock, so the imports themselves
+don't run in parallel, but they no longer run on the main thread. The time
+spent importing the apps' packages, and with them whatever their __init__
+files import, is time `start_engine` would otherwise have spent on the main
+thread, and is reported as saved. Modules only imported by the apps later on
+are reported as imported ahead of their first use.
+
+This module only depends on the standard library.
+"""
+
+import os
+import ast
+import imp
+import sys
+import time
+import Queue
+import threading
+
+PREWARM_ENV_VAR = "TK_NUKE_PREWARM_APPS"
+DEFAULT_WORKERS = 4
+
+# The modules, and their submodules, that are only ever imported on the main
+# thread.
+_MAIN_THREAD_MODULES = (
+    "PySide",
+    "PySide2",
+    "PyQt4",
+    "PyQt5",
+    "sip",
+    "shiboken",
+    "shiboken2",
+    "nuke",
+    "nukescripts",
+    "hiero",
+    "tank.platform.qt",
+    "tank.platform.qt5",
+)
+
+# The names whose use at import time needs the engine to be running, or Qt.
+_ENGINE_NAMES = frozenset(["import_framework", "current_bundle", "current_engine", "qt", "qt5"])
+
+# The folders the standard library is imported from.
+_STDLIB_PATHS = [
+    os.path.dirname(os.__file__),
+    os.path.join(os.path.dirname(os.__file__), "lib-dynload"),
+    os.path.join(sys.prefix, "DLLs"),
+]
+
+
+def enabled():
+    """
+    Whether pre-warming has been requested.
+    """
+    return bool(os.environ.get(PREWARM_ENV_VAR))
+
+
+class _ModuleScanner(ast.NodeVisitor):
+    """
+    Collects what a module runs at import time: its imports, and whether it
+    uses any of the names that need the engine.
+    """
+    def __init__(self):
+        self.imports = []
+        self.future = set()
+        self.uses_engine = False
+
+    def visit_FunctionDef(self, node):
+        # Only the decorators and default values of a function run when it
+        # is defined.
+        for child in node.decorator_list + node.args.defaults:
+            self.visit(child)
+
+    def visit_Lambda(self, node):
+        for child in node.args.defaults:
+            self.visit(child)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append((0, alias.name, ()))
+
+    def visit_ImportFrom(self, node):
+        names = tuple(alias.name for alias in node.names)
+        if node.module == "__future__":
+            self.future.update(names)
+        else:
+            self.imports.append((node.level or 0, node.module or "", names))
+
+    def visit_Name(self, node):
+        if node.id in _ENGINE_NAMES:
+            self.uses_engine = True
+
+    def visit_Attribute(self, node):
+        if node.attr in _ENGINE_NAMES:
+            self.uses_engine = True
+        self.generic_visit(node)
+
+
+class AppPrewarmer(object):
+    """
+    Pre-warms the apps of an engine on background threads.
+    """
+    def __init__(self, engine_name, context, workers=DEFAULT_WORKERS):
+        """
+        :param engine_name: The instance name of the engine being started.
+        :param context:     The sgtk.context.Context it is started in.
+        :param workers:     The number of threads reading files.
+        """
+        self._engine_name = engine_name
+        self._context = context
+        self._workers = max(1, workers)
+        self._thread = None
+        self._stdlib_names = dict()
+
+        self.files_read = 0
+        self.bytes_read = 0
+        self.modules_imported = []
+        self.import_times = dict()
+        self.read_time = 0.0
+        self.import_time = 0.0
+        self.elapsed = 0.0
+        self.error = None
+
+    def start(self):
+        """
+        Starts pre-warming.
+        """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def finished(self):
+        """
+        Whether pre-warming has finished.
+        """
+        return self._thread is not None and not self._thread.is_alive()
+
+    def summary(self, engine_start_time):
+        """
+        Returns a one line summary of what was pre-warmed, and of the import
+        time it saved `start_engine`.
+
+        :param engine_start_time:   The time `start_engine` took, in seconds.
+        """
+        if self.error:
+            return "Prewarm: failed after %.3fs: %s" % (self.elapsed, self.error)
+
+        # The apps import their packages as they are loaded, everything else
+        # is imported when they first use it.
+        import_times = dict(self.import_times)
+        saved = sum(t for (name, t) in import_times.iteritems() if "." not in name)
+        ahead = sum(t for (name, t) in import_times.iteritems() if "." in name)
+        return (
+            "Prewarm: read %d files (%.1f MB) in %.3fs and imported %d modules "
+            "off the main thread in %.3fs%s, which saved start_engine %.3fs of "
+            "imports and the apps %.3fs later on; start_engine took %.3fs" % (
+                self.files_read,
+                self.bytes_read / (1024.0 * 1024.0),
+                self.read_time,
+                len(self.modules_imported),
+                self.import_time,
+                "" if self.finished else " (still running)",
+                saved,
+                ahead,
+                engine_start_time,
+            )
+        )
+
+    def _run(self):
+        """
+        Resolves the apps' python folders, reads their files, and imports
+        the modules that are safe to import.
+        """
+        import sgtk_trace
+
+        start = time.time()
+        with sgtk_trace.span("sgtk_prewarm.prewarm"):
+            try:
+                folders = self._get_python_folders()
+                modules = self._find_modules(folders)
+
+                with sgtk_trace.span("sgtk_prewarm.read_files"):
+                    self._read_files(
+                        [path for (name, path, is_package) in modules]
+                    )
+                self.read_time = time.time() - start
+
+                import_start = time.time()
+                with sgtk_trace.span("sgtk_prewarm.import_modules"):
+                    self._import_modules(modules)
+                self.import_time = time.time() - import_start
+            except Exception, e:
+                # Pre-warming is only an optimization.
+                self.error = str(e)
+        self.elapsed = time.time() - start
+
+    def _get_python_folders(self):
+        """
+        Returns the python folders of the apps in the target environment,
+        from the launcher's startup manifest if it is ready.
+        """
+        import sgtk_manifest
+
+        folders = sgtk_manifest.get_app_python_folders()
+        if folders:
+            return folders
+
+        env = sgtk_manifest.get_environment(self._context)
+        folders = []
+        for app_name in env.get_apps(self._engine_name):
+            app_location = env.get_app_descriptor(self._engine_name, app_name).get_path()
+            folder = os.path.join(app_location, "python")
+            if os.path.isdir(folder):
+                folders.append(folder)
+        return folders
+
+    def _find_modules(self, folders):
+        """
+        Returns the modules found in the given python folders.
+
+        :param folders: The python folders to look in.
+
+        :returns: A list of tuples of each module's name, path, and whether
+                  it is a package's __init__ file.
+        """
+        modules = []
+        packages = dict()
+        for folder in folders:
+            for (dir_path, dir_names, file_names) in os.walk(folder):
+                if dir_path == folder:
+                    # Loose top-level modules often have generic names, which
+                    # other apps may use too, so only packages are looked at.
+                    continue
+                if "__init__.py" not in file_names:
+                    # Not a package, so nothing below it can be imported.
+                    del dir_names[:]
+                    continue
+
+                package = os.path.relpath(dir_path, folder).replace(os.path.sep, ".")
+                top_level = package.split(".")[0]
+                packages.setdefault(top_level, set()).add(folder)
+
+                for file_name in file_names:
+                    if not file_name.endswith(".py"):
+                        continue
+                    path = os.path.join(dir_path, file_name)
+                    if file_name == "__init__.py":
+                        modules.append((package, path, True))
+                    else:
+                        modules.append(("%s.%s" % (package, file_name[:-3]), path, False))
+
+        # Packages found in more than one app are left alone, as it depends
+        # on the app which one it should get.
+        return [
+            module for module in modules
+            if len(packages[module[0].split(".")[0]]) == 1
+        ]
+
+    def _read_files(self, paths):
+        """
+        Reads the given modules, and their compiled versions, into the page
+        cache on a pool of threads.
+
+        :param paths:   The paths of the modules' source files.
+        """
+        queue = Queue.Queue()
+        for path in paths:
+            queue.put(path)
+            queue.put(path + "c")
+
+        lock = threading.Lock()
+
+        def _worker():
+            while True:
+                try:
+                    path = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    with open(path, "rb") as fh:
+                        size = len(fh.read())
+                except (IOError, OSError):
+                    continue
+                with lock:
+                    self.files_read += 1
+                    self.bytes_read += size
+
+        threads = [threading.Thread(target=_worker) for i in range(self._workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _import_modules(self, modules):
+        """
+        Imports the modules that are safe to import off the main thread,
+        parent packages first.
+
+        :param modules: The modules, as returned by :meth:`_find_modules`.
+        """
+        paths = dict((name, (path, is_package)) for (name, path, is_package) in modules)
+
+        safe = dict()
+        dependencies = dict()
+        for (name, (path, is_package)) in paths.iteritems():
+            (safe[name], dependencies[name]) = self._scan_module(name, path, is_package, paths)
+            parent = name.rpartition(".")[0]
+            if parent:
+                dependencies[name].add(parent)
+
+        # A module is only safe if all the modules of the apps it imports are,
+        # which cycles of imports make an iteration.
+        changed = True
+        while changed:
+            changed = False
+            for name in paths:
+                if safe[name] and not all(safe.get(d, False) for d in dependencies[name]):
+                    safe[name] = False
+                    changed = True
+
+        # Parents sort before their children, so they are imported first.
+        for name in sorted(paths):
+            if name in sys.modules or not safe[name]:
+                continue
+            (path, is_package) = paths[name]
+            self.modules_imported.extend(self._load(name, path, is_package, paths))
+
+    def _load(self, name, path, is_package, paths):
+        """
+        Imports a module from the given file, along with the modules of the
+        apps it imports, and records the time it took.
+
+        :param name:        The fully qualified name of the module.
+        :param path:        The path of the module's source file.
+        :param is_package:  Whether the file is a package's __init__ file.
+        :param paths:       The modules of the apps, by name.
+
+        :returns: The names of the modules of the apps imported, empty if the
+                  module couldn't be imported.
+        """
+        (parent_name, _, child_name) = name.rpartition(".")
+        parent = sys.modules.get(parent_name) if parent_name else None
+        if parent_name and parent is None:
+            return []
+
+        imp.acquire_lock()
+        try:
+            if name in sys.modules:
+                return []
+            before = set(sys.modules)
+            start = time.time()
+            try:
+                if is_package:
+                    module = imp.load_module(
+                        name,
+                        None,
+                        os.path.dirname(path),
+                        ("", "", imp.PKG_DIRECTORY),
+                    )
+                else:
+                    with open(path, "U") as fh:
+                        module = imp.load_module(name, fh, path, (".py", "U", imp.PY_SOURCE))
+            except Exception:
+                # Python only drops the module itself, so that importing the
+                # package again would find its submodules without them being
+                # set on it.
+                for other in set(sys.modules) - before:
+                    if other.startswith(name + "."):
+                        del sys.modules[other]
+                return []
+            self.import_times[name] = time.time() - start
+            imported = [n for n in set(sys.modules) - before if n in paths]
+        finally:
+            imp.release_lock()
+
+        if parent is not None:
+            setattr(parent, child_name, module)
+        return imported
+
+    def _scan_module(self, name, path, is_package, paths):
+        """
+        Checks what the given module runs at import time.
+
+        :param name:        The fully qualified name of the module.
+        :param path:        The path of the module's source file.
+        :param is_package:  Whether the file is a package's __init__ file.
+        :param paths:       The modules of the apps, by name.
+
+        :returns: A tuple of whether the module could be safe to import, as
+                  long as the modules of the apps it imports are, and of the
+                  set of the names of those.
+        """
+        try:
+            with open(path, "rb") as fh:
+                tree = ast.parse(fh.read(), path)
+        except (IOError, OSError, SyntaxError, TypeError, ValueError):
+            return (False, set())
+
+        scanner = _ModuleScanner()
+        scanner.visit(tree)
+        if scanner.uses_engine:
+            return (False, set())
+
+        package = name if is_package else name.rpartition(".")[0]
+        dependencies = set()
+        for (level, module, names) in scanner.imports:
+            if level:
+                parts = package.split(".")
+                if level > len(parts):
+                    return (False, set())
+                module = ".".join(parts[:len(parts) - level + 1] + ([module] if module else []))
+            elif (
+                package
+                and "absolute_import" not in scanner.future
+                and "%s.%s" % (package, module.split(".")[0]) in paths
+            ):
+                # An implicit relative import.
+                module = "%s.%s" % (package, module)
+
+            if module in paths:
+                submodules = ["%s.%s" % (module, n) for n in names]
+                dependencies.update(s for s in submodules if s in paths)
+                parts = module.split(".")
+                dependencies.update(
+                    ".".join(parts[:i]) for i in range(1, len(parts) + 1)
+                )
+            elif not self._may_import(module, names):
+                return (False, set())
+        return (True, dependencies)
+
+    def _may_import(self, module, names):
+        """
+        Whether a module outside of the apps may be imported off the main
+        thread, along with the given names from it.
+
+        :param module:  The fully qualified name of the module.
+        :param names:   The names imported from it, if any.
+        """
+        # sgtk is Toolkit's alias of tank.
+        if module == "sgtk" or module.startswith("sgtk."):
+            module = "tank" + module[4:]
+
+        for full_name in [module] + ["%s.%s" % (module, n) for n in names]:
+            for main_thread_module in _MAIN_THREAD_MODULES:
+                if full_name == main_thread_module or full_name.startswith(main_thread_module + "."):
+                    return False
+
+        if self._is_stdlib(module.split(".")[0]):
+            return True
+
+        # Anything else must already be imported, with the names it is
+        # imported with.
+        loaded = sys.modules.get(module)
+        if loaded is None:
+            return False
+        for name in names:
+            if name != "*" and not hasattr(loaded, name) and "%s.%s" % (module, name) not in sys.modules:
+                return False
+        return True
+
+    def _is_stdlib(self, name):
+        """
+        Whether the given top-level module is part of the standard library.
+
+        :param name:    The name of the module.
+        """
+        if name not in self._stdlib_names:
+            if name in sys.builtin_module_names or name == "__future__":
+                self._stdlib_names[name] = True
+            else:
+                try:
+                    (fh, path, description) = imp.find_module(name, _STDLIB_PATHS)
+                    if fh:
+                        fh.close()
+                    self._stdlib_names[name] = True
+                except ImportError:
+                    self._stdlib_names[name] = False
+        return self._stdlib_names[name]
+
+
+def start_prewarm(engine_name, context):
+    """
+    Starts pre-warming the apps the given engine will load, if requested.
+
+    :param engine_name: The instance name of the engine being started.
+    :param context:     The sgtk.context.Context it is started in.
+
+    :returns: The running :class:`AppPrewarmer`, or None.
+    """
+    if not enabled():
+        return None
+
+    try:
+        workers = max(1, int(os.environ.get(PREWARM_ENV_VAR)))
+    except ValueError:
+        # Set without a pool size.
+        workers = DEFAULT_WORKERS
+
+    prewarmer = AppPrewarmer(engine_name, context, workers)
+    prewarmer.start()
+    return prewarmer
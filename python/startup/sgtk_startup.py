@@ -10,6 +10,24 @@
 
 import os
 import sys
+import time
+
+import sgtk_trace
+import sgtk_handoff
+import sgtk_finder
+import sgtk_bundle
+import sgtk_prefetch
+import sgtk_prewarm
+
+sgtk_trace.trace_imports()
+
+# Serve the engine's and the apps' modules from the Python bundle if there
+# is one, and from the module index otherwise. The engine's python folder is
+# the parent of this startup folder.
+_module_finder = sgtk_finder.install(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+_bundle_finder = sgtk_bundle.install()
 
 def bootstrap_sgtk():
     """
@@ -17,26 +35,104 @@ def bootstrap_sgtk():
     """
     import nuke
 
-    _setup_sgtk(nuke.warning)
+    if nuke.env.get("gui"):
+        sgtk_trace.set_process_name("Nuke")
+    else:
+        sgtk_trace.set_process_name("Nuke (batch)")
+
+    with sgtk_trace.span("sgtk_startup.bootstrap_sgtk"):
+        _setup_sgtk(nuke.warning)
+
+    sgtk_trace.instant("module_index", **sgtk_finder.stats(_module_finder))
+    sgtk_trace.instant("python_bundle", **sgtk_bundle.stats(_bundle_finder))
+    _report_prefetch_on_load()
 
     # Clean up temp env vars.
     _clean_env()
 
+def _report_prefetch_on_load():
+    """
+    Reports how many of the files read when the script was opened had been
+    prefetched by the launcher, once the script has been loaded. The
+    bootstrap runs before Nuke loads the script, so its Read nodes are only
+    known then.
+    """
+    report_path = sgtk_prefetch.get_report_path()
+    if not report_path:
+        return
+
+    import nuke
+
+    def _on_script_load():
+        nuke.removeOnScriptLoad(_on_script_load)
+        _report_prefetch(report_path)
+
+    nuke.addOnScriptLoad(_on_script_load)
+
+def _report_prefetch(report_path):
+    """
+    Reports how many of the files read when the script was opened had been
+    prefetched by the launcher. Nothing is reported if the prefetch was still
+    running when the script was loaded, as Nuke didn't wait for it.
+
+    :param report_path: The path of the launcher's prefetch report.
+    """
+    report = sgtk_prefetch.load_report(report_path)
+    engine = _get_current_engine()
+    if report is None:
+        if engine:
+            engine.log_debug("Prefetch: still running when the script was loaded, not reported.")
+        return
+    sgtk_prefetch.remove_report(report_path)
+
+    import nuke
+
+    needed = [report["script"]]
+    for node in nuke.allNodes("Read", recurseGroups=True):
+        try:
+            needed.append(node["file"].evaluate(node["first"].value()))
+        except Exception:
+            pass
+
+    (msg, figures) = sgtk_prefetch.get_summary(report, needed)
+    sgtk_trace.instant("prefetch_report", **figures)
+
+    if engine:
+        engine.log_debug(msg)
+
+def _get_current_engine():
+    """
+    Returns the running engine, or None if Toolkit couldn't be started.
+    """
+    try:
+        import tank
+        return tank.platform.current_engine()
+    except Exception:
+        return None
+
 def _clean_env():
     """
     Cleans up SGTK related environment variables.
     """
-    for var in ["TANK_ENGINE", "TANK_CONTEXT", "TANK_FILE_TO_OPEN"]:
+    for var in [
+        "TANK_ENGINE",
+        "TANK_CONTEXT",
+        sgtk_handoff.CONTEXT_ENV_VAR,
+        "TANK_FILE_TO_OPEN",
+        sgtk_prefetch.REPORT_ENV_VAR,
+    ]:
         if var in os.environ:
             del os.environ[var]
 
+@sgtk_trace.traced("sgtk_startup._setup_sgtk")
 def _setup_sgtk(output_handle):
     """
     Extracts the necessary information from the environment and starts
     the tk-nuke engine.
     """
     try:
-        import tank
+        with sgtk_trace.span("import tank"):
+            import tank
     except Exception, e:
         output_handle("Shotgun: Could not import sgtk! Disabling: %s" % str(e))
         return
@@ -47,7 +143,8 @@ def _setup_sgtk(output_handle):
 
     engine_name = os.environ.get("TANK_ENGINE")
     try:
-        context = tank.context.deserialize(os.environ.get("TANK_CONTEXT"))
+        with sgtk_trace.span("sgtk_handoff.decode_context"):
+            context = sgtk_handoff.decode_context(sgtk_handoff.get_launch_payload())
     except Exception, e:
         output_handle(
             "Shotgun: Could not create context! "
@@ -55,12 +152,20 @@ def _setup_sgtk(output_handle):
         )
         return
 
+    # Warm the apps up in the background while the engine starts.
+    prewarmer = sgtk_prewarm.start_prewarm(engine_name, context)
+
+    start_time = time.time()
     try:
-        engine = tank.platform.start_engine(engine_name, context.tank, context)
+        with sgtk_trace.span("tank.platform.start_engine", engine=engine_name):
+            engine = tank.platform.start_engine(engine_name, context.tank, context)
     except Exception, e:
         output_handle("Shotgun: Could not start engine: %s" % str(e))
         return
 
+    if prewarmer:
+        engine.log_debug(prewarmer.summary(time.time() - start_time))
+
     path = os.environ.get("TANK_NUKE_ENGINE_MOD_PATH")
     if path:
         sys.path.append(path)
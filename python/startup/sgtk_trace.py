@@ -0,0 +1,225 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Opt-in startup tracing for Nuke, Hiero, and Nuke Studio.
+
+When the TK_NUKE_TRACE_DIR environment variable points to a directory, timed
+spans are written to a Chrome trace file in that directory, one file per
+process. The files can be opened in chrome://tracing or ui.perfetto.dev.
+The spans cover the whole bootstrap chain, from `bootstrap.py` in the
+launcher through to the engine building its menu, when the variable is set
+before launching.
+
+This module only depends on the standard library, as it is used by the
+bootstrap scripts before Toolkit can be imported.
+
+The files use the JSON array flavour of the trace event format, for which the
+closing bracket is optional. Events are appended as they complete, so a trace
+is still readable if the process crashes or is killed mid-startup, and
+several copies of this module loaded in the same process can safely share a
+file.
+
+Setting TK_NUKE_TRACE_IMPORTS as well records a span for every module
+imported from the point :func:`trace_imports` is called, so that import
+time regressions show up per module.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import functools
+import contextlib
+
+TRACE_DIR_ENV_VAR = "TK_NUKE_TRACE_DIR"
+TRACE_IMPORTS_ENV_VAR = "TK_NUKE_TRACE_IMPORTS"
+
+_lock = threading.Lock()
+_import_hook_installed = False
+
+
+def enabled():
+    """
+    Whether tracing has been requested for this process.
+    """
+    return bool(os.environ.get(TRACE_DIR_ENV_VAR))
+
+
+def trace_file_path():
+    """
+    Returns the path of the trace file for the current process, or None
+    if tracing is disabled.
+    """
+    trace_dir = os.environ.get(TRACE_DIR_ENV_VAR)
+    if not trace_dir:
+        return None
+    return os.path.join(
+        trace_dir,
+        "tk-nuke-%s-%d.json" % (socket.gethostname(), os.getpid()),
+    )
+
+
+def _timestamp():
+    """
+    Returns the current wall clock time in microseconds. Wall clock time is
+    used so that traces from the launcher and the DCC line up.
+    """
+    return int(time.time() * 1000000)
+
+
+def _write_event(event):
+    """
+    Appends a single event to this process' trace file.
+
+    :param event:   A dict in the Chrome trace event format.
+    """
+    path = trace_file_path()
+    if not path:
+        return
+
+    event.setdefault("pid", os.getpid())
+    event.setdefault("tid", threading.current_thread().ident or 0)
+
+    with _lock:
+        try:
+            trace_dir = os.path.dirname(path)
+            if not os.path.isdir(trace_dir):
+                os.makedirs(trace_dir)
+            new_file = not os.path.exists(path)
+            with open(path, "a") as fh:
+                if new_file:
+                    fh.write("[\n")
+                fh.write(json.dumps(event))
+                fh.write(",\n")
+        except (IOError, OSError):
+            # Tracing must never break the startup it is measuring.
+            pass
+
+
+def set_process_name(name):
+    """
+    Labels the current process in the trace viewer.
+
+    :param name:    A short description of the process, such as "Nuke" or
+                    "Launcher".
+    """
+    if not enabled():
+        return
+    _write_event(
+        dict(
+            name="process_name",
+            ph="M",
+            args=dict(name="%s (%s)" % (name, socket.gethostname())),
+        )
+    )
+
+
+def instant(name, category="startup", **args):
+    """
+    Records a point in time.
+
+    :param name:        The name of the event.
+    :param category:    The category the event is filed under.
+    """
+    if not enabled():
+        return
+    _write_event(
+        dict(name=name, cat=category, ph="i", s="p", ts=_timestamp(), args=args)
+    )
+
+
+@contextlib.contextmanager
+def span(name, category="startup", **args):
+    """
+    Context manager that records the time taken by the enclosed block.
+
+    :param name:        The name of the span.
+    :param category:    The category the span is filed under.
+    """
+    if not enabled():
+        yield
+        return
+
+    start = _timestamp()
+    try:
+        yield
+    except Exception, e:
+        args["error"] = str(e)
+        raise
+    finally:
+        _write_event(
+            dict(
+                name=name,
+                cat=category,
+                ph="X",
+                ts=start,
+                dur=_timestamp() - start,
+                args=args,
+            )
+        )
+
+
+def traced(name, category="startup"):
+    """
+    Decorator that records a span for every call of the decorated function.
+
+    :param name:        The name of the span.
+    :param category:    The category the span is filed under.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_imports():
+    """
+    Records a span for each module imported from now on, if import tracing
+    has been requested. Only imports that actually load new modules are
+    recorded, and nested imports show up as nested spans, so a module's own
+    import time is its span minus its children.
+    """
+    global _import_hook_installed
+
+    if _import_hook_installed or not enabled():
+        return
+    if not os.environ.get(TRACE_IMPORTS_ENV_VAR):
+        return
+
+    import __builtin__
+    original_import = __builtin__.__import__
+
+    def traced_import(name, *args, **kwargs):
+        loaded = len(sys.modules)
+        start = _timestamp()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            new_modules = len(sys.modules) - loaded
+            if new_modules > 0:
+                _write_event(
+                    dict(
+                        name=name,
+                        cat="import",
+                        ph="X",
+                        ts=start,
+                        dur=_timestamp() - start,
+                        args=dict(modules_loaded=new_modules),
+                    )
+                )
+
+    __builtin__.__import__ = traced_import
+    _import_hook_installed = True
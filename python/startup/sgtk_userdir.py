@@ -0,0 +1,107 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Private per-user directory for the files Nuke processes hand each other.
+
+Snapshots, hand-off payloads, caches and sockets hold what a Nuke process
+will trust and act on, such as which pipeline configuration to load, so they
+must never be somewhere another user can write. They all live in a directory
+of the temp folder that is created for the current user only, and whose owner
+and permissions are checked before it is used. Files read from it are checked
+to belong to the current user as well.
+
+On Windows, the temp folder is already private to the user, and ownership
+isn't checked.
+
+This module only depends on the standard library.
+"""
+
+import os
+import stat
+import getpass
+import tempfile
+
+# Whether ownership can and should be checked.
+_POSIX = hasattr(os, "getuid")
+
+
+def get_user_dir(name=None):
+    """
+    Returns the current user's private directory, creating it if needed.
+
+    :param name:    The name of a subdirectory to return instead, which is
+                    also created private.
+
+    :returns: The path of the directory.
+    :raises OSError: If the directory can't be created, or exists but belongs
+                     to someone else or isn't a directory.
+    """
+    if _POSIX:
+        user_dir = os.path.join(tempfile.gettempdir(), "tk-nuke-%d" % os.getuid())
+    else:
+        try:
+            user = getpass.getuser()
+        except Exception:
+            user = "unknown"
+        user_dir = os.path.join(tempfile.gettempdir(), "tk-nuke-%s" % user)
+
+    _ensure_private_dir(user_dir)
+    if name:
+        user_dir = os.path.join(user_dir, name)
+        _ensure_private_dir(user_dir)
+    return user_dir
+
+
+def is_owned(path):
+    """
+    Whether the given path is a regular file, or a socket, belonging to the
+    current user, and not a symlink.
+
+    :param path:    The path to check.
+    """
+    if not _POSIX:
+        return os.path.exists(path)
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not (stat.S_ISREG(st.st_mode) or stat.S_ISSOCK(st.st_mode)):
+        return False
+    return st.st_uid == os.getuid()
+
+
+def _ensure_private_dir(path):
+    """
+    Creates a directory only the current user can access, or checks that an
+    existing one is.
+
+    :param path:    The path of the directory.
+
+    :raises OSError: If the directory can't be used.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        # It already exists, possibly created by someone else.
+        pass
+
+    if not _POSIX:
+        if not os.path.isdir(path):
+            raise OSError("%s is not a directory" % path)
+        return
+
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError("%s is not a directory" % path)
+    if st.st_uid != os.getuid():
+        raise OSError("%s belongs to another user" % path)
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(path, 0o700)
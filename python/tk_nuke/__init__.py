@@ -16,24 +16,198 @@ phase to handle automatic context switching. At this point, QT is
 not necessarily fully initialized. Therefore, any modules that require
 QT to be imported should be placed in the tk_nuke_qt module instead
 in order to avoid import errors at startup and context switch.
+
+This module is also imported by every batch render and every process
+spawned by file->new and file->open, so it only imports what the
+callbacks need. The menu generators (tk_nuke.menu_generation) and the
+Nuke Studio context switcher (tk_nuke.context) are imported by the
+engine when it actually builds a UI, and the context caches, resolver
+and their helpers by the accessors below, the first time they are used.
+`python/startup/sgtk_import_check.py` checks that it stays that way.
+
+When a script saved or opened in Nuke is in another context of the running
+engine's pipeline configuration, the engine changes context in place, as in
+Nuke Studio, and is only restarted for a script of another configuration.
+The time every switch took is logged, and the number of switches of each
+kind and their total time are logged with the session's other counters when
+the engine is destroyed, so the in-place switches can be compared with the
+restarts they replace.
 """
 import os
-import textwrap
+import sys
+
+# The startup directory holds the modules shared with the bootstrap scripts,
+# which run before Toolkit can be imported.
+STARTUP_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "startup",
+)
+
+def import_startup_module(name):
+    """
+    Imports a module from the startup directory, which isn't on sys.path.
+
+    :param name:    The name of the module.
+
+    :returns: The module.
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        sys.path.append(STARTUP_PATH)
+        try:
+            module = __import__(name)
+        finally:
+            sys.path.pop()
+    return module
+
+# The startup tracer, context hand-off, keys, user directory and paths are
+# needed by the callbacks of every process.
+sgtk_trace = import_startup_module("sgtk_trace")
+sgtk_handoff = import_startup_module("sgtk_handoff")
+sgtk_context_key = import_startup_module("sgtk_context_key")
+sgtk_userdir = import_startup_module("sgtk_userdir")
+sgtk_paths = import_startup_module("sgtk_paths")
+
+sgtk_trace.trace_imports()
+
+import time
 import nuke
 import tank
-import sys
 import traceback
 
-from .menu_generation import (
-    NukeMenuGenerator,
-    HieroMenuGenerator,
-    NukeStudioMenuGenerator,
+from .snapshot import (
+    normalize_path,
+    load_engine_snapshot,
+    write_engine_snapshot,
+    remove_engine_snapshot,
+    record_context,
 )
+from .cache_settings import configure_caches
+from .errors import ContextResolveTimeout
+
 
-from .context import StudioContextSwitcher
+##########################################################################
+# lazily imported parts of the package
 
+def get_context_cache():
+    """
+    Returns the session's context cache, see tk_nuke.context_cache.
+    """
+    from .context_cache import get_context_cache
+    return get_context_cache()
+
+def get_context_store():
+    """
+    Returns the session's on-disk context store, see tk_nuke.context_store.
+    """
+    from .context_store import get_context_store
+    return get_context_store()
+
+def get_entity_cache():
+    """
+    Returns the session's Shotgun entity cache, see tk_nuke.entity_cache.
+    """
+    from .entity_cache import get_entity_cache
+    return get_entity_cache()
 
-def __show_tank_disabled_message(details):
+def get_context_prewarmer():
+    """
+    Returns the session's recent files prewarmer, see tk_nuke.prewarm.
+    """
+    from .prewarm import get_context_prewarmer
+    return get_context_prewarmer()
+
+def get_tank_pool():
+    """
+    Returns the session's Toolkit instance pool, see tk_nuke.tank_pool.
+    """
+    from .tank_pool import get_tank_pool
+    return get_tank_pool()
+
+def get_version_up_tracker():
+    """
+    Returns the session's version-up tracker, see tk_nuke.version_up.
+    """
+    from .version_up import get_version_up_tracker
+    return get_version_up_tracker()
+
+def get_context_resolver():
+    """
+    Returns the session's context resolver, see tk_nuke.context_resolver.
+    """
+    from .context_resolver import get_context_resolver
+    return get_context_resolver()
+
+def use_background_resolution(engine):
+    """
+    See tk_nuke.context_resolver.use_background_resolution().
+    """
+    from .context_resolver import use_background_resolution
+    return use_background_resolution(engine)
+
+def resolve_context(*args, **kwargs):
+    """
+    See tk_nuke.context_resolver.resolve_context().
+    """
+    from .context_resolver import resolve_context
+    return resolve_context(*args, **kwargs)
+
+def cancel_prewarm():
+    """
+    Cancels the prewarming of the recent files' contexts, if it was ever
+    started.
+    """
+    prewarm = sys.modules.get(__name__ + ".prewarm")
+    if prewarm:
+        prewarm.get_context_prewarmer().cancel()
+
+def cancel_background_work():
+    """
+    Cancels the context resolution and prewarming going on in the
+    background, if any was ever started.
+    """
+    resolver = sys.modules.get(__name__ + ".context_resolver")
+    if resolver:
+        resolver.get_context_resolver().cancel()
+    cancel_prewarm()
+
+def get_session_stats():
+    """
+    Returns the counters of the session's caches and helpers that have been
+    used, without importing the others.
+
+    :returns: A list of tuples of a label and a dict of counters.
+    """
+    sources = (
+        ("Context cache", __name__ + ".context_cache", "get_context_cache"),
+        ("Toolkit instance pool", __name__ + ".tank_pool", "get_tank_pool"),
+        ("Context resolver", __name__ + ".context_resolver", "get_context_resolver"),
+        ("Version-up saves", __name__ + ".version_up", "get_version_up_tracker"),
+        ("Context store", __name__ + ".context_store", "get_context_store"),
+        ("Context table", "sgtk_context_table", None),
+        ("Entity cache", __name__ + ".entity_cache", "get_entity_cache"),
+        ("Recent files prewarm", __name__ + ".prewarm", "get_context_prewarmer"),
+    )
+    stats = []
+    if g_context_switch_times:
+        stats.append(("Context switches", __get_context_switch_stats()))
+    for (label, module_name, accessor) in sources:
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        source = getattr(module, accessor)() if accessor else module
+        stats.append((label, source.stats()))
+    return stats
+
+
+# The details shown by the "disabled" menu, while it is up.
+g_tank_disabled_details = None
+
+# The time every context switch of the session took, in seconds, by how the
+# switch was made.
+g_context_switch_times = dict()
+
+def __show_tank_disabled_message():
     """
     Message when user clicks the tank is disabled menu
     """
@@ -41,19 +215,29 @@ def __show_tank_disabled_message(details):
            "have opened is not recognized. Shotgun cannot "
            "determine which Context the currently open file belongs to. "
            "In order to enable the Shotgun functionality, try opening another "
-           "file. <br><br><i>Details:</i> %s" % details)
+           "file. <br><br><i>Details:</i> %s" % g_tank_disabled_details)
     nuke.message(msg)
     
 def __create_tank_disabled_menu(details):    
     """
-    Creates a std "disabled" shotgun menu
+    Creates a std "disabled" shotgun menu, or only updates the details it
+    shows if it is already up, so that repeated failures don't rebuild it.
     """
+    global g_tank_disabled_details
     if nuke.env.get("gui"):
         nuke_menu = nuke.menu("Nuke")
         sg_menu = nuke_menu.addMenu("Shotgun")
+        items = sg_menu.items()
+        already_disabled = (
+            g_tank_disabled_details is not None
+            and len(items) == 1
+            and items[0].name() == "Toolkit is disabled."
+        )
+        g_tank_disabled_details = details
+        if already_disabled:
+            return
         sg_menu.clearMenu()
-        cmd = lambda d=details: __show_tank_disabled_message(d)    
-        sg_menu.addCommand("Toolkit is disabled.", cmd)
+        sg_menu.addCommand("Toolkit is disabled.", __show_tank_disabled_message)
     else:
         nuke.error("The Shotgun Pipeline Toolkit is disabled: %s" % details)
         
@@ -84,27 +268,132 @@ def __engine_refresh(tk, new_context):
     """
     Checks the the tank engine should be 
     """
-    
+    # Whatever is still being resolved in the background is out of date now.
+    cancel_background_work()
+
     engine_name = os.environ.get("TANK_NUKE_ENGINE_INIT_NAME")
     
     curr_engine = tank.platform.current_engine()
     if curr_engine:
         # an old engine is running. 
-        if new_context == curr_engine.context:
-            # no need to restart the engine!
+        if sgtk_context_key.same_context(new_context, curr_engine.context):
+            # no need to restart the engine! Just make sure any newly
+            # resolved script contexts are handed down to new processes.
+            curr_engine.write_state_snapshot()
             return         
+        elif __can_change_context_in_place(curr_engine, tk):
+            # Within the same pipeline configuration, the running engine
+            # switches its apps over, which is much cheaper than a restart.
+            start_time = time.time()
+            try:
+                with sgtk_trace.span("tk_nuke.change_context", category="callbacks"):
+                    tank.platform.change_context(new_context)
+            except tank.TankEngineInitError, e:
+                # context was not sufficient! - disable tank!
+                __create_tank_disabled_menu(e)
+                return
+            __log_context_switch("changed in place", start_time)
+            # The processes spawned from now on start in the new context.
+            curr_engine.write_state_snapshot()
+            return
         else:
             # shut down the engine
             curr_engine.destroy()
         
     # try to create new engine
+    start_time = time.time()
     try:
-        tank.platform.start_engine(engine_name, tk, new_context)
+        with sgtk_trace.span("tk_nuke.start_engine", category="callbacks"):
+            tank.platform.start_engine(engine_name, tk, new_context)
     except tank.TankEngineInitError, e:
         # context was not sufficient! - disable tank!
         __create_tank_disabled_menu(e)
+        return
+    if curr_engine:
+        __log_context_switch("restarted the engine", start_time)
+
+def __can_change_context_in_place(curr_engine, tk):
+    """
+    Whether the running engine can switch to a context of the given Toolkit
+    instance without being restarted, which is the case when it allows it
+    and the instance is of the engine's own pipeline configuration.
+    """
+    if not curr_engine.context_change_allowed:
+        return False
+    return normalize_path(curr_engine.sgtk.pipeline_configuration.get_path()) == normalize_path(
+        tk.pipeline_configuration.get_path()
+    )
+
+def __log_context_switch(how, start_time):
+    """
+    Logs how long switching the running engine's context took, and adds it
+    to the session's context switch timings.
+    """
+    elapsed = time.time() - start_time
+    g_context_switch_times.setdefault(how, []).append(elapsed)
+    engine = tank.platform.current_engine()
+    if engine:
+        engine.log_debug(
+            "Switched to %s: %s in %.3fs" % (engine.context, how, elapsed)
+        )
+
+def __get_context_switch_stats():
+    """
+    Returns a dict of the number of context switches of each kind, and of
+    their total and average times, in seconds.
+    """
+    stats = dict()
+    for (how, times) in g_context_switch_times.iteritems():
+        label = how.replace(" ", "_")
+        stats[label] = len(times)
+        stats[label + "_time"] = round(sum(times), 3)
+        stats[label + "_average"] = round(sum(times) / len(times), 3)
+    return stats
          
     
+def __on_context_resolved(file_name, tk, new_ctx):
+    """
+    Switches to a context resolved in the background, on the main thread.
+    """
+    try:
+        record_context(file_name, new_ctx)
+        get_version_up_tracker().record(file_name, tk, new_ctx)
+        __engine_refresh(tk, new_ctx)
+    except Exception:
+        __create_tank_error_menu()
+
+def __on_context_resolve_failed(error):
+    """
+    Reports a context that couldn't be resolved in the background, from
+    inside the except clause that caught it.
+    """
+    if isinstance(error, tank.TankError):
+        __create_tank_disabled_menu(error)
+    else:
+        __create_tank_error_menu()
+
+def __resolve_in_background(file_name, check_mtime=True):
+    """
+    Resolves the context of a file on the context resolver's worker thread
+    and switches to it once it is known, if the running engine allows it.
+    The current context stays in use in the meantime.
+
+    :returns: Whether the file was handed to the resolver.
+    """
+    curr_engine = tank.platform.current_engine()
+    if not use_background_resolution(curr_engine):
+        return False
+
+    get_context_resolver().resolve(
+        file_name,
+        curr_engine.context,
+        lambda tk, ctx, f=file_name: __on_context_resolved(f, tk, ctx),
+        __on_context_resolve_failed,
+        check_mtime=check_mtime,
+    )
+    return True
+
+@sgtk_trace.traced("tk_nuke.on_save_callback", category="callbacks")
 def __tank_on_save_callback():
     """
     Callback that fires every time a file is saved.
@@ -116,21 +405,45 @@ def __tank_on_save_callback():
     file_name = nuke.root().name()
     
     try:
-        # this file could be in another project altogether, so create a new Tank
-        # API instance.
-        try:
-            tk = tank.tank_from_path(file_name)
-        except tank.TankError, e:
-            __create_tank_disabled_menu(e)
-            return
-        
+        cancel_prewarm()
+
         # try to get current ctx and inherit its values if possible
         curr_ctx = None
         if tank.platform.current_engine():
             curr_ctx = tank.platform.current_engine().context
+
+        # A new version of the script the current context was resolved
+        # from is in that same context.
+        derived = get_version_up_tracker().derive_context(file_name, curr_ctx)
+        if derived:
+            sgtk_trace.instant("tk_nuke.version_up_save", category="callbacks", path=file_name)
+            (tk, new_ctx) = derived
+            record_context(file_name, new_ctx)
+            __engine_refresh(tk, new_ctx)
+            return
+
+        # The file is about to be written, so its modification time can't
+        # invalidate the cached context.
+        if __resolve_in_background(file_name, check_mtime=False):
+            return
         
-        # and now extract a new context based on the file
-        new_ctx = tk.context_from_path(file_name, curr_ctx)
+        # this file could be in another project altogether, so get the Tank
+        # API instance for it, and extract a new context based on the file.
+        try:
+            (tk, new_ctx) = resolve_context(
+                file_name,
+                curr_ctx,
+                check_mtime=False,
+                on_late_result=lambda tk, ctx, f=file_name: __on_context_resolved(f, tk, ctx),
+            )
+        except tank.TankError, e:
+            __create_tank_disabled_menu(e)
+            return
+        except ContextResolveTimeout:
+            # Keep the current context until the real one is known.
+            return
+        record_context(file_name, new_ctx)
+        get_version_up_tracker().record(file_name, tk, new_ctx)
         
         # now restart the engine with the new context
         __engine_refresh(tk, new_ctx)
@@ -138,6 +451,10 @@ def __tank_on_save_callback():
         __create_tank_error_menu()
 
 
+# Whether the startup callback has run for this process's first script.
+g_startup_loaded = False
+
+@sgtk_trace.traced("tk_nuke.tank_startup_node_callback", category="callbacks")
 def tank_startup_node_callback():    
     """
     Callback that fires every time a node gets created.
@@ -145,39 +462,73 @@ def tank_startup_node_callback():
     Carefully manage exceptions here so that a bug in Tank never
     interrupts the normal workflows in Nuke.    
     """    
+    global g_startup_loaded
     try:    
+        # The session that spawned this process may have handed down what
+        # it already resolved, which saves doing it all again from scratch.
+        # It only describes the session as it was when this process was
+        # spawned, so it is only used for the process's first script.
+        snapshot = None
+        if not g_startup_loaded:
+            g_startup_loaded = True
+            snapshot = load_engine_snapshot()
+
         if nuke.root().name() == "Root":
             # file->new
             # base it on the context we 'inherited' from the prev session
             # get the context from the previous session - this is helpful if user does file->new
-            project_root = os.environ.get("TANK_NUKE_ENGINE_INIT_PROJECT_ROOT")
-            tk = tank.Tank(project_root)
-            
-            ctx_str = os.environ.get("TANK_NUKE_ENGINE_INIT_CONTEXT")
-            if ctx_str:
-                try:
-                    new_ctx = tank.context.deserialize(ctx_str)
-                except:
-                    new_ctx = tk.context_empty()
+            if snapshot:
+                new_ctx = snapshot.context
+                tk = new_ctx.tank
             else:
-                new_ctx = tk.context_empty()
+                project_root = os.environ.get("TANK_NUKE_ENGINE_INIT_PROJECT_ROOT")
+                tk = get_tank_pool().tank_from_path(project_root)
+                
+                ctx_str = os.environ.get("TANK_NUKE_ENGINE_INIT_CONTEXT")
+                if ctx_str:
+                    try:
+                        new_ctx = sgtk_handoff.decode_context(ctx_str, tk)
+                    except:
+                        new_ctx = tk.context_empty()
+                else:
+                    new_ctx = tk.context_empty()
     
         else:
             # file->open
             file_name = nuke.root().name()
-            
-            try:
-                tk = tank.tank_from_path(file_name)
-            except tank.TankError, e:
-                __create_tank_disabled_menu(e)
+
+            # The contexts prewarmed so far are cached, the script's own
+            # context matters more than the others now.
+            cancel_prewarm()
+
+            new_ctx = None
+            if snapshot:
+                new_ctx = snapshot.get_context(file_name)
+
+            if new_ctx:
+                tk = new_ctx.tank
+            elif __resolve_in_background(file_name):
                 return
-                
-            # try to get current ctx and inherit its values if possible
-            curr_ctx = None
-            if tank.platform.current_engine():
-                curr_ctx = tank.platform.current_engine().context                
-                
-            new_ctx = tk.context_from_path(file_name, curr_ctx)
+            else:
+                # try to get current ctx and inherit its values if possible
+                curr_ctx = None
+                if tank.platform.current_engine():
+                    curr_ctx = tank.platform.current_engine().context                
+                    
+                try:
+                    (tk, new_ctx) = resolve_context(
+                        file_name,
+                        curr_ctx,
+                        on_late_result=lambda tk, ctx, f=file_name: __on_context_resolved(f, tk, ctx),
+                    )
+                except tank.TankError, e:
+                    __create_tank_disabled_menu(e)
+                    return
+                except ContextResolveTimeout:
+                    # Keep the current context until the real one is known.
+                    return
+                record_context(file_name, new_ctx)
+                get_version_up_tracker().record(file_name, tk, new_ctx)
     
         # now restart the engine with the new context
         __engine_refresh(tk, new_ctx)
@@ -191,8 +542,26 @@ def tank_ensure_callbacks_registered():
     Make sure that we have callbacks tracking context state changes.
     """
     global g_tank_callbacks_registered
+
+    # Batch sessions using the farm profile may not want the context to be
+    # switched on every script load.
+    engine = tank.platform.current_engine()
+    if engine and not engine.subsystem_enabled("callbacks"):
+        return
+
     if not g_tank_callbacks_registered:
         nuke.addOnScriptLoad(tank_startup_node_callback)
         nuke.addOnScriptSave(__tank_on_save_callback)
         g_tank_callbacks_registered = True
 
+def tank_remove_callbacks():
+    """
+    Removes the callbacks tracking context state changes, for code that
+    manages the context itself while it opens and saves scripts.
+    """
+    global g_tank_callbacks_registered
+    if g_tank_callbacks_registered:
+        nuke.removeOnScriptLoad(tank_startup_node_callback)
+        nuke.removeOnScriptSave(__tank_on_save_callback)
+        g_tank_callbacks_registered = False
+
@@ -0,0 +1,300 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Processing of many Nuke scripts in a single, already bootstrapped session.
+
+Opening scripts one after another would normally either mean a new process
+per script, or an engine restart every time the script load callback sees a
+new context. The executor in this module keeps the running engine, resolves
+the context of each script itself, and only changes the engine's context in
+place when it actually differs.
+
+It can be used from a batch script running in a bootstrapped session::
+
+    import tk_nuke.batch
+    report = tk_nuke.batch.process_scripts(paths, my_function)
+
+or run directly, reading script paths from the command line, from a file
+with one path per line, or from stdin::
+
+    nuke -t tk_nuke/batch.py [--function module.function] (paths | --list file | -)
+"""
+
+import sys
+import time
+
+import nuke
+import tank
+
+
+class ScriptResult(object):
+    """
+    The outcome of processing a single script.
+    """
+    def __init__(self, path):
+        """
+        Initializes a new result.
+
+        :param path:    The path of the script that was processed.
+        """
+        self.path = path
+        self.context_switched = False
+        self.error = None
+        self.open_time = 0.0
+        self.context_time = 0.0
+        self.process_time = 0.0
+
+    @property
+    def total_time(self):
+        """
+        The total time spent on the script, in seconds.
+        """
+        return self.open_time + self.context_time + self.process_time
+
+    def __str__(self):
+        status = "failed: %s" % self.error if self.error else "ok"
+        return "%s: %.3fs (open %.3fs, context %.3fs%s, process %.3fs) %s" % (
+            self.path,
+            self.total_time,
+            self.open_time,
+            self.context_time,
+            ", switched" if self.context_switched else "",
+            self.process_time,
+            status,
+        )
+
+
+class BatchReport(object):
+    """
+    Per-script timings and overall throughput of a batch run.
+    """
+    def __init__(self):
+        """
+        Initializes an empty report.
+        """
+        self.results = []
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """
+        The number of scripts processed per second.
+        """
+        if not self.elapsed:
+            return 0.0
+        return len(self.results) / self.elapsed
+
+    @property
+    def context_switches(self):
+        """
+        The number of times the engine's context had to be changed.
+        """
+        return len([r for r in self.results if r.context_switched])
+
+    @property
+    def failures(self):
+        """
+        The results of the scripts that could not be processed.
+        """
+        return [r for r in self.results if r.error]
+
+    def summary(self):
+        """
+        Returns a one line summary of the batch run.
+        """
+        return (
+            "%d scripts in %.3fs (%.2f scripts/s), %d context switches, "
+            "%d failures" % (
+                len(self.results),
+                self.elapsed,
+                self.throughput,
+                self.context_switches,
+                len(self.failures),
+            )
+        )
+
+
+def _resolve_context(engine, path):
+    """
+    Returns the Toolkit API instance and context for the given script.
+
+    :param engine:  The running tk-nuke engine.
+    :param path:    The path of the script.
+    """
+    # Note! not using the import as this confuses Nuke's callback system
+    # (several of the key scene callbacks are in the main init file).
+    import tk_nuke
+
+    # Scripts inside a project whose configuration is already loaded, such
+    # as the running engine's, reuse its Toolkit instance.
+    tk = tk_nuke.get_tank_pool().tank_from_path(path)
+    context = tk_nuke.get_context_cache().context_from_path(
+        tk,
+        path,
+        previous_context=engine.context,
+    )
+    return (tk, context)
+
+
+def _switch_context(engine, tk, context):
+    """
+    Makes the given context the current one, in place if possible.
+
+    If a new engine is needed and fails to start, the previous engine is
+    started again in its own context, so that the rest of the batch can run,
+    and the error is raised.
+
+    :param engine:  The running tk-nuke engine.
+    :param tk:      The Toolkit API instance the context was resolved with.
+    :param context: The sgtk.context.Context to switch to.
+
+    :returns: The engine running in the new context.
+    """
+    # Note! not using the import as this confuses Nuke's callback system
+    # (several of the key scene callbacks are in the main init file).
+    import tk_nuke
+
+    config_path = tk_nuke.normalize_path(tk.pipeline_configuration.get_path())
+    engine_config_path = tk_nuke.normalize_path(engine.tank.pipeline_configuration.get_path())
+    if config_path == engine_config_path:
+        tank.platform.change_context(context)
+        return tank.platform.current_engine()
+
+    # Contexts from another pipeline configuration need a new engine.
+    engine_name = engine.instance_name
+    (previous_tk, previous_context) = (engine.tank, engine.context)
+    engine.destroy()
+    try:
+        return tank.platform.start_engine(engine_name, tk, context)
+    except Exception:
+        error = sys.exc_info()
+        try:
+            tank.platform.start_engine(engine_name, previous_tk, previous_context)
+        except Exception:
+            # The batch stops, as there is no engine left to run it.
+            pass
+        raise error[0], error[1], error[2]
+
+
+def process_scripts(script_paths, function=None):
+    """
+    Opens each of the given scripts in turn in the current session and calls
+    the given function on it, switching the engine's context as needed.
+
+    The script load and save callbacks are disabled for the duration of the
+    run, as the executor takes care of the context itself.
+
+    :param script_paths:    An iterable of script paths. This can be a stream,
+                            such as a file object, in which case each line
+                            holds a path.
+    :param function:        A callable taking the script path and the engine.
+                            If None, the scripts are only opened.
+
+    :returns: A :class:`BatchReport` for the run.
+    """
+    # Note! not using the import as this confuses Nuke's callback system
+    # (several of the key scene callbacks are in the main init file).
+    import tk_nuke
+    # Imported from the startup directory by the tk_nuke package.
+    import sgtk_context_key
+
+    engine = tank.platform.current_engine()
+    if engine is None:
+        raise tank.TankError("The batch executor needs a running engine!")
+
+    report = BatchReport()
+    callbacks_registered = tk_nuke.g_tank_callbacks_registered
+    tk_nuke.tank_remove_callbacks()
+    start = time.time()
+    try:
+        for path in script_paths:
+            path = path.strip()
+            if not path:
+                continue
+
+            result = ScriptResult(path)
+            report.results.append(result)
+            try:
+                step_start = time.time()
+                (tk, context) = _resolve_context(engine, path)
+                if not sgtk_context_key.same_context(context, engine.context):
+                    engine = _switch_context(engine, tk, context)
+                    result.context_switched = True
+                result.context_time = time.time() - step_start
+
+                step_start = time.time()
+                nuke.scriptClear()
+                nuke.scriptOpen(path)
+                result.open_time = time.time() - step_start
+
+                if function:
+                    step_start = time.time()
+                    function(path, engine)
+                    result.process_time = time.time() - step_start
+            except Exception, e:
+                result.error = str(e)
+                # A failed context switch leaves a restarted engine, or none.
+                engine = tank.platform.current_engine()
+                if engine is None:
+                    raise tank.TankError(
+                        "The engine could not be restarted after failing to "
+                        "switch to the context of %s!" % path
+                    )
+
+            engine.log_debug("Batch: %s" % result)
+    finally:
+        report.elapsed = time.time() - start
+        if callbacks_registered:
+            tk_nuke.tank_ensure_callbacks_registered()
+
+    engine.log_info("Batch: %s" % report.summary())
+    return report
+
+
+def _import_function(name):
+    """
+    Returns the callable with the given dotted name.
+
+    :param name:    A name such as "package.module.function".
+    """
+    (module_name, function_name) = name.rsplit(".", 1)
+    module = __import__(module_name, fromlist=[function_name])
+    return getattr(module, function_name)
+
+
+def main(args):
+    """
+    Command line entry point.
+
+    :param args:    The command line arguments, without the script name.
+    """
+    function = None
+    if args[:1] == ["--function"]:
+        function = _import_function(args[1])
+        args = args[2:]
+
+    if args == ["-"]:
+        script_paths = sys.stdin
+    elif args[:1] == ["--list"]:
+        with open(args[1]) as fh:
+            script_paths = fh.readlines()
+    else:
+        script_paths = args
+
+    report = process_scripts(script_paths, function)
+    for result in report.results:
+        print result
+    print report.summary()
+    return 1 if report.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,47 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Engine settings of the session's caches.
+
+The caches are only imported once a callback needs them, which may be long
+after the engine has read its settings, or never. The engine hands the
+settings to this module, and each cache picks them up when it is imported,
+and again whenever they change.
+"""
+
+# The settings handed over by the engine, by name.
+_settings = dict()
+
+# The functions applying the settings to the caches imported so far.
+_listeners = []
+
+
+def configure_caches(**settings):
+    """
+    Sets the given cache settings, and applies them to the caches imported
+    so far.
+
+    :param settings:    The settings, by name, such as context_cache_size.
+    """
+    _settings.update(settings)
+    for listener in _listeners:
+        listener(_settings)
+
+
+def on_configure(listener):
+    """
+    Registers a function applying the settings to a cache. It is called
+    right away with the settings handed over so far, and on every change.
+
+    :param listener:    A function taking the dict of settings.
+    """
+    _listeners.append(listener)
+    listener(_settings)
@@ -17,6 +17,18 @@ import tank
 
 from tank import TankError
 
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_context_key
+
+from .tank_pool import get_tank_pool
+from .version_up import get_version_up_tracker
+from .context_resolver import (
+    get_context_resolver,
+    use_background_resolution,
+    resolve_context,
+    ContextResolveTimeout,
+)
+
 class StudioContextSwitcher(object):
     """
     A Toolkit context-switching manager.
@@ -53,7 +65,6 @@ class StudioContextSwitcher(object):
             ),
         ]
 
-        self._context_cache = dict()
         self._init_project_root = engine.tank.project_path
         self._init_context = engine.context
         self._is_in_nuke = False
@@ -139,9 +150,18 @@ class StudioContextSwitcher(object):
             if script_path:
                 # Switched to nuke with a script open. We have a path and could try
                 # to figure out the sgtk context from that.
-                new_context = self.get_new_context(script_path)
+                if self._resolve_in_background(script_path, self._on_script_context_resolved):
+                    return
 
-                if new_context is not None and new_context != self.engine.context:
+                new_context = self.get_new_context(
+                    script_path,
+                    on_late_result=self._on_script_context_resolved,
+                )
+
+                if new_context is not None and not sgtk_context_key.same_context(
+                    new_context,
+                    self.engine.context,
+                ):
                     self.change_context(new_context)
             else:
                 # There is no script open in the node graph. Because of that, we
@@ -154,8 +174,18 @@ class StudioContextSwitcher(object):
             # so change to that context based on that project file's
             # path.
             project_path = self._get_current_project()
+            if project_path and self._resolve_in_background(
+                project_path,
+                self._on_project_context_resolved,
+                self._on_project_context_failed,
+            ):
+                return
+
             if project_path:
-                new_context = self.get_new_context(project_path)
+                new_context = self.get_new_context(
+                    project_path,
+                    on_late_result=self._on_project_context_resolved,
+                )
                 if new_context:
                     self.change_context(new_context)
                     return
@@ -166,17 +196,23 @@ class StudioContextSwitcher(object):
             # with what we had at launch.
             self.change_context(self._init_context)
 
-    def _get_context_from_script(self, script):
+    def _get_context_from_script(self, script, on_late_result=None):
         """
         Returns an sgtk.context.Context object from the given script path.
 
-        :param script:  The path to a script file on disk.
-        """
-        tk = tank.tank_from_path(script)
+        :param script:          The path to a script file on disk.
+        :param on_late_result:  Called with the Toolkit instance and the
+                                context if resolving it ran out of time and
+                                finished later, see
+                                :func:`tk_nuke.context_resolver.resolve_context`.
 
-        context = tk.context_from_path(
+        :raises: :class:`ContextResolveTimeout` if resolving it ran out of time
+                 and no context is known for the script.
+        """
+        (tk, context) = resolve_context(
             script,
-            previous_context=self.engine.context,
+            self.engine.context,
+            on_late_result=on_late_result,
         )
 
         if context.project is None:
@@ -187,6 +223,100 @@ class StudioContextSwitcher(object):
         else:
             return context
 
+    def _resolve_in_background(self, path, on_resolved, on_failed=None, check_mtime=True):
+        """
+        Resolves the context of the given path on the context resolver's
+        worker thread, if the engine allows it. The current context stays in
+        use until the new one is handed back.
+
+        :param path:        The path of the script or project.
+        :param on_resolved: Called on the main thread with the Toolkit
+                            instance and the context.
+        :param on_failed:   Called on the main thread with the exception
+                            raised. Defaults to showing the "disabled" or
+                            "error" menu.
+        :param check_mtime: As for
+                            :meth:`ContextCache.context_from_path`.
+
+        :returns: Whether the path was handed to the resolver.
+        """
+        if not use_background_resolution(self.engine):
+            return False
+
+        get_context_resolver().resolve(
+            path,
+            self.engine.context,
+            on_resolved,
+            on_failed or self._on_resolve_failed,
+            check_mtime=check_mtime,
+        )
+        return True
+
+    def _on_resolve_failed(self, error):
+        """
+        Shows the "disabled" or "error" menu for a context that couldn't be
+        resolved in the background.
+
+        :param error:   The exception raised.
+        """
+        if isinstance(error, tank.TankError):
+            self.engine.menu_generator.create_sgtk_disabled_menu(error)
+        else:
+            self.engine.menu_generator.create_sgtk_error_menu()
+
+    def _on_file_context_resolved(self, file_name, tk, context):
+        """
+        Changes to the context resolved for a saved or opened script, and
+        remembers the script for version-up saves.
+
+        :param file_name:   The path of the script.
+        :param tk:          The Toolkit instance of the script.
+        :param context:     The script's sgtk.context.Context.
+        """
+        get_version_up_tracker().record(file_name, tk, context)
+        self.change_context(context)
+
+    def _on_script_context_resolved(self, tk, context):
+        """
+        Changes to the context of the script shown in the node graph, once
+        it has been resolved in the background.
+
+        :param tk:      The Toolkit instance of the script.
+        :param context: The script's sgtk.context.Context.
+        """
+        if context.project is None:
+            self.engine.menu_generator.create_sgtk_disabled_menu(
+                "The Nuke engine needs at least a project "
+                "context in order to start! Your context: %s" % context
+            )
+        elif not sgtk_context_key.same_context(context, self.engine.context):
+            self.change_context(context)
+
+    def _on_project_context_resolved(self, tk, context):
+        """
+        Changes to the context of the current project, once it has been
+        resolved in the background, or to the init context if the project
+        isn't part of one.
+
+        :param tk:      The Toolkit instance of the project.
+        :param context: The project's sgtk.context.Context.
+        """
+        if context.project is None:
+            self.change_context(self._init_context)
+        else:
+            self.change_context(context)
+
+    def _on_project_context_failed(self, error):
+        """
+        Goes back to the init context when the context of the current project
+        couldn't be resolved in the background.
+
+        :param error:   The exception raised.
+        """
+        self.engine.menu_generator.create_sgtk_disabled_menu(error)
+        self.engine.log_debug(error)
+        self.change_context(self._init_context)
+
     def _get_current_project(self):
         """
         Returns the current project based on where in the UI the user clicked.
@@ -210,22 +340,41 @@ class StudioContextSwitcher(object):
         try:
             # Get the new file name.
             file_name = nuke.root().name()
+
+            # A new version of the script the current context was resolved
+            # from is in that same context, so there is nothing to do.
+            if get_version_up_tracker().derive_context(file_name, self.engine.context):
+                return
+
+            # The file is about to be written, so its modification time
+            # can't invalidate the cached context.
+            if self._resolve_in_background(
+                file_name,
+                lambda tk, context, f=file_name: self._on_file_context_resolved(f, tk, context),
+                check_mtime=False,
+            ):
+                return
+
             try:
-                # This file could be in another project altogether, so 
-                # create a new Tank instance.
-                tk = tank.tank_from_path(file_name)
+                # This file could be in another project altogether, so
+                # get the Tank instance for it, and extract a new context
+                # based on the file. The file is about to be written, so
+                # its modification time can't invalidate the cached context.
+                (tk, new_context) = resolve_context(
+                    file_name,
+                    self.context,
+                    check_mtime=False,
+                    on_late_result=lambda tk, context, f=file_name: self._on_file_context_resolved(f, tk, context),
+                )
             except tank.TankError, e:
                 self.engine.menu_generator.create_sgtk_disabled_menu(e)
                 return
+            except ContextResolveTimeout:
+                # Keep the current context until the real one is known.
+                return
 
-            # Extract a new context based on the file and change to that
-            # context.
-            new_context = tk.context_from_path(
-                file_name,
-                previous_context=self.context,
-            )
-
-            self.change_context(new_context)
+            # Change to the new context.
+            self._on_file_context_resolved(file_name, tk, new_context)
         except Exception:
             self.engine.menu_generator.create_sgtk_error_menu()
 
@@ -242,7 +391,7 @@ class StudioContextSwitcher(object):
             if nuke.root().name() == "Root":
                 # This is a file->new call, so base it on the context we
                 # stored from the previous session.
-                tk = tank.Tank(self.init_project_root)
+                tk = get_tank_pool().tank_from_path(self.init_project_root)
 
                 if self.init_context:
                     new_ctx = self.init_context
@@ -252,16 +401,25 @@ class StudioContextSwitcher(object):
                 # This is a file->open call, so we can get the new context
                 # from the file path that was opened.
                 file_name = nuke.root().name()
+                if self._resolve_in_background(
+                    file_name,
+                    lambda tk, context, f=file_name: self._on_file_context_resolved(f, tk, context),
+                ):
+                    return
+
                 try:
-                    tk = tank.tank_from_path(file_name)
+                    (tk, new_ctx) = resolve_context(
+                        file_name,
+                        self.context,
+                        on_late_result=lambda tk, context, f=file_name: self._on_file_context_resolved(f, tk, context),
+                    )
                 except tank.TankError, e:
                     self.engine.menu_generator.create_sgtk_disabled_menu(e)
                     return
-
-                new_ctx = tk.context_from_path(
-                    file_name,
-                    previous_context=self.context,
-                )
+                except ContextResolveTimeout:
+                    # Keep the current context until the real one is known.
+                    return
+                get_version_up_tracker().record(file_name, tk, new_ctx)
 
             # Now change the context for the engine and apps.
             self.change_context(new_ctx)
@@ -278,7 +436,10 @@ class StudioContextSwitcher(object):
 
         :param new_context: The sgtk.context.Context to change to.
         """
-        if new_context == self.engine.context:
+        # Whatever is still being resolved in the background is out of date now.
+        get_context_resolver().cancel()
+
+        if sgtk_context_key.same_context(new_context, self.engine.context):
             return
 
         try:
@@ -293,29 +454,30 @@ class StudioContextSwitcher(object):
         """
         self.unregister_events()
 
-    def get_new_context(self, script_path):
+    def get_new_context(self, script_path, on_late_result=None):
         """
         Returns a new sgtk.context.Context for the given script path.
 
-        If the context exists in the in-memory cache, then that is returned,
-        otherwise a new Context object is constructed, cached, and returned.
+        Contexts are looked up in the session's context cache first, see
+        tk_nuke.context_cache. If resolving the context runs out of time and
+        none is known for the script, the current context is returned.
 
-        :param script_path: The path to a script file on disk.
+        :param script_path:     The path to a script file on disk.
+        :param on_late_result:  Called with the Toolkit instance and the
+                                context if resolving it ran out of time and
+                                finished later.
         """
-        context = self._context_cache.get(script_path)
-
-        if context:
-            return context
-
         try:
-            context = self._get_context_from_script(script_path)
+            context = self._get_context_from_script(script_path, on_late_result)
             if context:
-                self._context_cache[script_path] = context
                 return context
             else:
                 raise tank.TankError(
                     "Toolkit could not determine the context associated with this script."
                 )
+        except ContextResolveTimeout:
+            # Keep the current context until the real one is known.
+            return self.engine.context
         except Exception, e:
             self.engine.menu_generator.create_sgtk_disabled_menu(e)
             self.engine.log_debug(e)
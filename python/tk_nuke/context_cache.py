@@ -0,0 +1,331 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache of the contexts resolved from script and project paths.
+
+The script load and save callbacks, the Nuke Studio context switcher and the
+Hiero project load callback all turn paths into contexts, which takes
+several Shotgun and filesystem lookups each time. They all go through the
+single cache in this module, which lives for as long as the Nuke session,
+across engine restarts.
+
+Entries are keyed by the normalized path and the pipeline configuration,
+and hold the path's own context, whatever context it was resolved from. The
+cache is only bypassed when `context_from_path()` would carry the previous
+context's task over, which it does when the path's context has no task and
+the same entity and step. The least recently used entries are evicted once
+the cache is full. An entry is dropped when the file's modification time has
+changed since it was resolved, and all of a configuration's entries are
+dropped when the configuration changes.
+
+Contexts the cache doesn't hold are looked up in the on-disk store of
+tk_nuke.context_store before they are resolved, and the contexts resolved
+are written to it, so that other Nuke processes, including those spawned by
+file->open, find them too. When the host's context daemon is enabled, see
+sgtk_context_daemon in the startup directory, it is asked for the contexts
+neither of them holds before they are resolved in-process.
+
+Before any of these, the contexts of scripts in a project's work areas are
+looked up in the table built ahead of time for its pipeline configuration,
+see sgtk_context_table in the startup directory.
+"""
+
+import os
+import threading
+import collections
+
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_context_key
+
+from . import import_startup_module
+from .snapshot import normalize_path, get_config_hash
+from .context_store import get_context_store
+from .cache_settings import on_configure
+
+sgtk_context_daemon = import_startup_module("sgtk_context_daemon")
+sgtk_context_table = import_startup_module("sgtk_context_table")
+
+DEFAULT_MAX_SIZE = 256
+
+
+class _CacheEntry(object):
+    """
+    A context held by the cache, with what is needed to validate it.
+    """
+    def __init__(self, context, mtime, config_hash):
+        """
+        :param context:     The resolved sgtk.context.Context.
+        :param mtime:       The file's modification time when it was resolved,
+                            or None if it didn't exist.
+        :param config_hash: The configuration's hash when it was resolved.
+        """
+        self.context = context
+        self.mtime = mtime
+        self.config_hash = config_hash
+
+
+class ContextCache(object):
+    """
+    A bounded, least recently used cache of resolved contexts.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param max_size:    The maximum number of contexts to hold.
+        """
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._config_hashes = dict()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.inherited = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def max_size(self):
+        """
+        The maximum number of contexts the cache holds.
+        """
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size):
+        with self._lock:
+            self._max_size = max(1, max_size)
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def context_from_path(self, tk, path, previous_context=None, check_mtime=True):
+        """
+        Returns the context for the given path, resolving it with
+        `tk.context_from_path()` only if it isn't cached.
+
+        :param tk:                  The Toolkit API instance to resolve with.
+        :param path:                The path of the script or project.
+        :param previous_context:    The context to inherit from, as for
+                                    `tk.context_from_path()`.
+        :param check_mtime:         Whether to drop the cached context if the
+                                    file has been modified since it was
+                                    resolved. Callers that are about to write
+                                    the file themselves, such as the save
+                                    callbacks, pass False.
+
+        :returns: A sgtk.context.Context.
+        """
+        config_path = tk.pipeline_configuration.get_path()
+        key = (normalize_path(path), config_path)
+        config_hash = self._get_config_hash(config_path)
+        mtime = self._get_mtime(path)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and check_mtime and entry.mtime != mtime:
+                self.invalidations += 1
+                entry = None
+            if entry is not None:
+                self._entries[key] = entry
+
+        if entry is not None:
+            context = entry.context
+        else:
+            context = sgtk_context_table.lookup_context(tk, path, config_hash)
+            if context is None:
+                context = self._resolve(tk, path, key, config_hash, mtime, check_mtime)
+            with self._lock:
+                self._entries[key] = _CacheEntry(context, mtime, config_hash)
+                self._evict()
+
+        inherits = sgtk_context_table.inherits_task(
+            previous_context,
+            context.task,
+            context.entity,
+            context.step,
+        )
+        with self._lock:
+            if inherits:
+                self.inherited += 1
+            elif entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if inherits:
+            # The previous context's task is carried over, which the path's
+            # own context doesn't have, so it can't be cached.
+            return tk.context_from_path(path, previous_context)
+        return context
+
+    def _resolve(self, tk, path, key, config_hash, mtime, check_mtime):
+        """
+        Returns the context for the given path from the context store, or
+        resolves it, with the context daemon if it is enabled, and stores it.
+
+        :param tk:                  The Toolkit API instance to resolve with.
+        :param path:                The path of the script or project.
+        :param key:                 The path's cache key.
+        :param config_hash:         The configuration's current hash.
+        :param mtime:               The file's current modification time.
+        :param check_mtime:         Whether the context is tied to the file's
+                                    modification time.
+
+        :returns: A sgtk.context.Context.
+        """
+        # Contexts resolved while saving aren't tied to the file's
+        # modification time on disk, as the file is about to change.
+        store_mtime = mtime if check_mtime else None
+        store = get_context_store()
+        context = store.get(tk, key, config_hash, store_mtime)
+        if context is None:
+            context = sgtk_context_daemon.resolve_context(
+                tk,
+                path,
+                check_mtime=check_mtime,
+            )
+            if context is None:
+                context = tk.context_from_path(path)
+            store.put(key, context, config_hash, store_mtime)
+        return context
+
+    def get_last_known(self, path):
+        """
+        Returns the context most recently resolved for the given path,
+        whatever it was resolved from and whether or not the file has been
+        modified since, without resolving anything.
+
+        :param path:    The path of the script or project.
+
+        :returns: A sgtk.context.Context, or None if none is cached.
+        """
+        norm_path = normalize_path(path)
+        with self._lock:
+            for (key, entry) in reversed(self._entries.items()):
+                if key[0] == norm_path:
+                    return entry.context
+        return None
+
+    def contexts(self):
+        """
+        Returns a list of the distinct contexts cached, most recently used
+        first.
+        """
+        with self._lock:
+            entries = self._entries.values()
+        contexts = []
+        seen = set()
+        for entry in reversed(entries):
+            key = sgtk_context_key.get_context_key(entry.context)
+            if key not in seen:
+                seen.add(key)
+                contexts.append(entry.context)
+        return contexts
+
+    def invalidate(self, path=None):
+        """
+        Drops the cached contexts of the given path, or all of them.
+
+        :param path:    The path to drop the contexts of. If None, the whole
+                        cache is cleared.
+        """
+        with self._lock:
+            if path is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._config_hashes.clear()
+                return
+
+            norm_path = normalize_path(path)
+            for key in [k for k in self._entries if k[0] == norm_path]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        """
+        Returns a dict of the cache's counters.
+        """
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self._entries),
+            max_size=self._max_size,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=float(self.hits) / lookups if lookups else 0.0,
+            inherited=self.inherited,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+        )
+
+    def _evict(self):
+        """
+        Evicts the least recently used entries until the cache fits.
+        """
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get_mtime(self, path):
+        """
+        Returns the modification time of the given file, or None if it
+        doesn't exist.
+
+        :param path:    The path of the file.
+        """
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def _get_config_hash(self, config_path):
+        """
+        Returns the hash of the given configuration, see
+        sgtk_paths.get_config_hash(). All of the configuration's entries are
+        dropped when it has changed.
+
+        :param config_path: The root path of the pipeline configuration.
+        """
+        config_hash = get_config_hash(config_path)
+
+        with self._lock:
+            if self._config_hashes.get(config_path) == config_hash:
+                return config_hash
+            self._config_hashes[config_path] = config_hash
+            stale = [
+                key for (key, entry) in self._entries.iteritems()
+                if key[1] == config_path and entry.config_hash != config_hash
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        return config_hash
+
+
+# The cache shared by everything in the session.
+_context_cache = ContextCache()
+
+
+def _configure(settings):
+    """
+    Applies the engine's settings to the session's cache.
+    """
+    if "context_cache_size" in settings:
+        _context_cache.max_size = settings["context_cache_size"]
+
+on_configure(_configure)
+
+
+def get_context_cache():
+    """
+    Returns the context cache shared by the whole session.
+    """
+    return _context_cache
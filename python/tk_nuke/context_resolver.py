@@ -0,0 +1,526 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Resolution of contexts off the main thread.
+
+The save, script load, focus change and project load callbacks run on
+Nuke's main thread, and resolving a context there freezes the UI for as long
+as Shotgun and the storage take to answer. When the engine's
+resolve_context_in_background setting is on, the callbacks hand the path to
+the resolver in this module instead. It finds the Toolkit instance and the
+context on a worker thread, and hands them back to the main thread with
+`nuke.executeInMainThread()`, where the callback switches context. The
+current context stays in use until then.
+
+Each request supersedes the ones made before it: a request that is still
+waiting when a newer one is made is dropped, and the result of one that was
+already running is discarded once it comes back.
+
+Callbacks that resolve on the main thread go through :func:`resolve_context`,
+which bounds the wait by the engine's context_resolve_timeout setting. When
+the budget runs out, the last-known-good context of the path is used instead,
+from the session's context cache or from the contexts recorded for handing
+down to new processes, and the real resolution finishes in the background.
+Every timeout is logged with its timings, as is the time the resolution
+eventually took. Each of these resolutions runs on its own thread, which
+keeps running for as long as Shotgun takes to answer. Once
+MAX_LATE_RESOLUTIONS of them are still running, no more are started, and
+the last-known-good context is used straight away until one of them
+finishes.
+"""
+
+import sys
+import time
+import Queue
+import threading
+
+import nuke
+import tank
+import sgtk_trace
+
+from .context_cache import get_context_cache
+from .context_store import get_context_store
+from .tank_pool import get_tank_pool
+from .snapshot import get_recorded_context
+from .errors import ContextResolveTimeout
+
+# The number of resolutions that ran out of time that can be running at
+# once. When Shotgun can't be reached, each of them may hang for as long as
+# the connection timeout.
+MAX_LATE_RESOLUTIONS = 2
+
+
+def use_background_resolution(engine):
+    """
+    Whether the given engine resolves contexts in the background. This needs
+    a UI, whose event loop runs the results on the main thread.
+
+    :param engine:  The running engine, or None.
+    """
+    return bool(
+        engine
+        and engine.has_ui
+        and engine.get_setting("resolve_context_in_background", False)
+    )
+
+
+def get_resolve_timeout(engine):
+    """
+    Returns the latency budget of context resolution on the main thread, in
+    seconds, or 0 if it is unbounded.
+
+    :param engine:  The running engine, or None.
+    """
+    if not engine:
+        return 0.0
+    return float(engine.get_setting("context_resolve_timeout", 0.0) or 0.0)
+
+
+def get_last_known_good(path):
+    """
+    Returns the context last resolved for the given path, from the session's
+    context cache or from the contexts recorded for new processes, without
+    asking Shotgun anything.
+
+    :param path:    The path of the script or project.
+
+    :returns: A sgtk.context.Context, or None if none is known.
+    """
+    context = get_context_cache().get_last_known(path)
+    if context is not None:
+        return context
+    try:
+        return get_recorded_context(path, get_tank_pool().peek(path))
+    except Exception:
+        return None
+
+
+def resolve_context(path, previous_context=None, check_mtime=True, on_late_result=None):
+    """
+    Returns the Toolkit instance and the context of the given path, within
+    the running engine's context_resolve_timeout budget if it has one. Once
+    the budget has run out, the last-known-good context of the path is
+    returned instead and the real resolution finishes in the background.
+
+    :param path:                The path of the script or project.
+    :param previous_context:    The context to inherit from, as for
+                                `tk.context_from_path()`.
+    :param check_mtime:         As for
+                                :meth:`ContextCache.context_from_path`.
+    :param on_late_result:      Called on the main thread with the Toolkit
+                                instance and the context when a resolution
+                                that ran out of time finishes, unless another
+                                context has been asked for since.
+
+    :returns: A tuple of the Toolkit instance and the context.
+    :raises: :class:`ContextResolveTimeout` if the budget ran out and no
+             context is known for the path.
+    """
+    engine = tank.platform.current_engine()
+    timeout = get_resolve_timeout(engine)
+    if timeout <= 0:
+        tk = get_tank_pool().tank_from_path(path)
+        context = get_context_cache().context_from_path(
+            tk,
+            path,
+            previous_context,
+            check_mtime=check_mtime,
+        )
+        return (tk, context)
+
+    if not engine.has_ui:
+        # There is no event loop to hand late results to.
+        on_late_result = None
+
+    return get_context_resolver().resolve_within(
+        path,
+        previous_context,
+        timeout,
+        on_late_result,
+        check_mtime=check_mtime,
+    )
+
+
+def _log(msg, warning=False):
+    """
+    Logs a message through the running engine, if there is one.
+
+    :param msg:     The message to log.
+    :param warning: Whether to log it as a warning rather than as info.
+    """
+    engine = tank.platform.current_engine()
+    if engine is None:
+        return
+    if warning:
+        engine.log_warning(msg)
+    else:
+        engine.log_info(msg)
+
+
+class _Request(object):
+    """
+    A context to resolve, and what to do with it.
+    """
+    def __init__(self, request_id, path, previous_context, check_mtime, on_resolved, on_failed):
+        self.request_id = request_id
+        self.path = path
+        self.previous_context = previous_context
+        self.check_mtime = check_mtime
+        self.on_resolved = on_resolved
+        self.on_failed = on_failed
+
+        # Used by requests made with a deadline.
+        self.start_time = time.time()
+        self.done = threading.Event()
+        self.outcome = None
+        self.timed_out = False
+
+
+class ContextResolver(object):
+    """
+    Resolves contexts on a worker thread, delivering them on the main thread.
+    """
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._latest_id = 0
+        self._pending_id = None
+        self._late_resolutions = 0
+
+        self.requests = 0
+        self.resolved = 0
+        self.failed = 0
+        self.superseded = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.throttled = 0
+
+    @property
+    def pending(self):
+        """
+        Whether a request is still waiting for its result to be delivered.
+        """
+        with self._lock:
+            return self._pending_id is not None
+
+    def resolve(self, path, previous_context, on_resolved, on_failed, check_mtime=True):
+        """
+        Queues the resolution of the given path's context, superseding any
+        request made before.
+
+        :param path:                The path of the script or project.
+        :param previous_context:    The context to inherit from, as for
+                                    `tk.context_from_path()`.
+        :param on_resolved:         Called on the main thread with the
+                                    Toolkit instance and the context.
+        :param on_failed:           Called on the main thread with the
+                                    exception raised, from inside an except
+                                    clause so that `sys.exc_info()` is that
+                                    of the failure.
+        :param check_mtime:         As for
+                                    :meth:`ContextCache.context_from_path`.
+        """
+        with self._lock:
+            self._latest_id += 1
+            self._pending_id = self._latest_id
+            self.requests += 1
+            request = _Request(
+                self._latest_id,
+                path,
+                previous_context,
+                check_mtime,
+                on_resolved,
+                on_failed,
+            )
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        self._queue.put(request)
+
+    def cancel(self):
+        """
+        Discards the result of any request made so far. This is called when
+        the context is switched by other means.
+        """
+        with self._lock:
+            if self._pending_id is not None:
+                self._latest_id += 1
+                self._pending_id = None
+
+    def resolve_within(self, path, previous_context, timeout, on_late_result=None, check_mtime=True):
+        """
+        Resolves the context of the given path, waiting for it for at most
+        the given time, and superseding any request made before. If it takes
+        longer, the last-known-good context of the path is returned, and the
+        resolution carries on in the background.
+
+        :param path:                The path of the script or project.
+        :param previous_context:    The context to inherit from, as for
+                                    `tk.context_from_path()`.
+        :param timeout:             The time to wait for, in seconds.
+        :param on_late_result:      Called on the main thread with the
+                                    Toolkit instance and the context if the
+                                    resolution finishes after the timeout,
+                                    unless it has been superseded. If None,
+                                    late results only fill the caches.
+        :param check_mtime:         As for
+                                    :meth:`ContextCache.context_from_path`.
+
+        :returns: A tuple of the Toolkit instance and the context.
+        :raises: :class:`ContextResolveTimeout` if the time ran out, or too
+                 many resolutions that ran out of time are still running,
+                 and no context is known for the path.
+        """
+        with self._lock:
+            self._latest_id += 1
+            # Requests that ran out of time are finished by the background,
+            # and can only be superseded by newer requests, not cancelled.
+            self._pending_id = None
+            self.requests += 1
+            request = _Request(
+                self._latest_id,
+                path,
+                previous_context,
+                check_mtime,
+                on_late_result,
+                self._on_late_failure,
+            )
+            throttled = self._late_resolutions >= MAX_LATE_RESOLUTIONS
+            if throttled:
+                self.throttled += 1
+
+        if not throttled:
+            thread = threading.Thread(target=self._run_within, args=(request,))
+            thread.daemon = True
+            thread.start()
+
+            request.done.wait(timeout)
+            with self._lock:
+                finished = request.done.is_set()
+                if not finished:
+                    request.timed_out = True
+                    self.timeouts += 1
+                    self._late_resolutions += 1
+
+            if finished:
+                (result, exc_info) = request.outcome
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                self.resolved += 1
+                return result
+
+        elapsed = time.time() - request.start_time
+        context = get_last_known_good(path)
+        sgtk_trace.instant(
+            "tk_nuke.context_resolve_timeout",
+            category="callbacks",
+            path=path,
+            budget=timeout,
+            elapsed=elapsed,
+            fallback=context is not None,
+            throttled=throttled,
+        )
+        fallback = (
+            "using its last-known-good context %s" % context if context
+            else "keeping the current context"
+        )
+        if throttled:
+            _log(
+                "Not resolving the context of %s, as %d earlier resolutions that ran out "
+                "of time are still running, %s." % (path, MAX_LATE_RESOLUTIONS, fallback),
+                warning=True,
+            )
+        else:
+            _log(
+                "Resolving the context of %s took longer than %.3fs (waited %.3fs), %s. "
+                "It carries on in the background." % (path, timeout, elapsed, fallback),
+                warning=True,
+            )
+
+        if context is None:
+            raise ContextResolveTimeout(
+                "The context of %s couldn't be resolved within %.3fs." % (path, timeout)
+            )
+        self.fallbacks += 1
+        return (context.tank, context)
+
+    def stats(self):
+        """
+        Returns a dict of the resolver's counters.
+        """
+        return dict(
+            requests=self.requests,
+            resolved=self.resolved,
+            failed=self.failed,
+            superseded=self.superseded,
+            timeouts=self.timeouts,
+            fallbacks=self.fallbacks,
+            throttled=self.throttled,
+        )
+
+    def _is_latest(self, request):
+        """
+        Whether no request has been made since the given one.
+
+        :param request: The request to check.
+        """
+        with self._lock:
+            if request.request_id == self._latest_id:
+                return True
+            self.superseded += 1
+            return False
+
+    def _run(self):
+        """
+        Resolves the requests as they come, on the worker thread.
+        """
+        while True:
+            request = self._queue.get()
+            if not self._is_latest(request):
+                continue
+
+            (result, exc_info) = self._resolve_request(request)
+            nuke.executeInMainThread(self._deliver, args=(request, result, exc_info))
+            # Don't hold on to the traceback's frames.
+            exc_info = None
+
+    def _run_within(self, request):
+        """
+        Resolves a request made with a deadline, on its own thread, and
+        hands it over to the background if the deadline has passed.
+
+        :param request: The request to resolve.
+        """
+        try:
+            outcome = self._resolve_request(request)
+        finally:
+            get_context_store().close()
+        with self._lock:
+            request.outcome = outcome
+            request.done.set()
+            if not request.timed_out:
+                return
+            self._late_resolutions -= 1
+
+        elapsed = time.time() - request.start_time
+        if request.on_resolved is None:
+            self._log_late_result(request, outcome, elapsed)
+        else:
+            nuke.executeInMainThread(self._deliver_late, args=(request, elapsed))
+
+    def _resolve_request(self, request):
+        """
+        Resolves the context of a request.
+
+        :param request: The request to resolve.
+
+        :returns: A tuple of the result, which is a tuple of the Toolkit
+                  instance and the context or None, and the exception info
+                  of the failure or None.
+        """
+        try:
+            with sgtk_trace.span("tk_nuke.resolve_context", category="callbacks", path=request.path):
+                tk = get_tank_pool().tank_from_path(request.path)
+                context = get_context_cache().context_from_path(
+                    tk,
+                    request.path,
+                    request.previous_context,
+                    check_mtime=request.check_mtime,
+                )
+            return ((tk, context), None)
+        except Exception:
+            return (None, sys.exc_info())
+
+    def _deliver_late(self, request, elapsed):
+        """
+        Logs and delivers the result of a request that ran out of time, on
+        the main thread.
+
+        :param request: The request resolved.
+        :param elapsed: The time the resolution took, in seconds.
+        """
+        (result, exc_info) = request.outcome
+        request.outcome = None
+        self._log_late_result(request, (result, exc_info), elapsed)
+        self._deliver(request, result, exc_info)
+
+    def _log_late_result(self, request, outcome, elapsed):
+        """
+        Logs how long a request that ran out of time actually took.
+
+        :param request: The request resolved.
+        :param outcome: The result and exception info of the resolution.
+        :param elapsed: The time the resolution took, in seconds.
+        """
+        sgtk_trace.instant(
+            "tk_nuke.context_resolve_late",
+            category="callbacks",
+            path=request.path,
+            elapsed=elapsed,
+            failed=outcome[1] is not None,
+        )
+        _log(
+            "Resolving the context of %s %s after %.3fs." % (
+                request.path,
+                "failed" if outcome[1] is not None else "finished",
+                elapsed,
+            )
+        )
+
+    def _on_late_failure(self, error):
+        """
+        Handles the failure of a request that ran out of time, which leaves
+        the context it fell back to in use.
+
+        :param error:   The exception raised.
+        """
+        _log("The context resolved late couldn't be used: %s" % error, warning=True)
+
+    def _deliver(self, request, result, exc_info):
+        """
+        Hands a result to its request's callbacks, on the main thread, unless
+        it has been superseded.
+
+        :param request:     The request resolved.
+        :param result:      A tuple of the Toolkit instance and the context,
+                            or None if resolving failed.
+        :param exc_info:    The exception info of the failure, or None.
+        """
+        if not self._is_latest(request):
+            return
+
+        with self._lock:
+            self._pending_id = None
+
+        if exc_info is None:
+            self.resolved += 1
+            request.on_resolved(*result)
+            return
+
+        self.failed += 1
+        try:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        except Exception, e:
+            request.on_failed(e)
+
+
+# The resolver shared by everything in the session.
+_context_resolver = ContextResolver()
+
+
+def get_context_resolver():
+    """
+    Returns the context resolver shared by the whole session.
+    """
+    return _context_resolver
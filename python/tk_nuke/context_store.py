@@ -0,0 +1,365 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+On-disk store of the contexts resolved from script and project paths.
+
+The session's context cache starts out empty in every Nuke process, and
+every file->open is a new process, so the same scripts get resolved over and
+over. The context cache reads through to this store when it misses, and
+writes the contexts it resolves to it, so that they outlive the process.
+
+The store is a SQLite database in the user's private directory, see
+sgtk_userdir in the startup directory, one per host, which the user's Nuke
+processes on the host share. A database that doesn't belong to the user is
+never opened. Each context is stored encoded,
+as handed down to new processes, along with the hash of its pipeline
+configuration and the modification time of its file, and is only used while
+both are unchanged. Contexts resolved while saving aren't tied to the file's
+modification time, since the file is about to be written. Every process
+writes in its own short transactions, waiting for the others, and the least
+recently used contexts are pruned once there are more than the engine's
+persistent_context_cache_size setting allows.
+
+Each thread uses its own connection, which the short-lived worker threads
+close with :meth:`ContextStore.close` before they finish. A store that can't
+be opened, for instance while another process holds a lock on it, isn't
+used for RETRY_INTERVAL seconds, after which opening it is tried again.
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_handoff
+import sgtk_userdir
+
+from .snapshot import normalize_path
+from .cache_settings import on_configure
+
+STORE_VERSION = 4
+DEFAULT_MAX_SIZE = 10000
+
+# How long to wait for the other processes' writes, in seconds.
+BUSY_TIMEOUT = 5.0
+
+# The store is pruned after this many writes by a process.
+PRUNE_INTERVAL = 50
+
+# How long the store isn't used for after it couldn't be opened, in seconds.
+RETRY_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contexts (
+    path TEXT NOT NULL,
+    config_path TEXT NOT NULL,
+    context TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    mtime REAL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (path, config_path)
+);
+CREATE INDEX IF NOT EXISTS contexts_last_used ON contexts (last_used);
+"""
+
+
+def get_store_path():
+    """
+    Returns the path of the store of the current user on this host.
+
+    :raises OSError: If the user's directory can't be used.
+    """
+    return os.path.join(
+        sgtk_userdir.get_user_dir(),
+        "contexts-%s.db" % socket.gethostname(),
+    )
+
+
+class ContextStore(object):
+    """
+    Contexts stored in a SQLite database shared by the processes on a host.
+    """
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param path:        The path of the database. Defaults to the one of
+                            the current user on this host.
+        :param max_size:    The maximum number of contexts to keep. 0
+                            disables the store.
+        """
+        self._path = path
+        self._max_size = max_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._retry_after = 0.0
+        self._writes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    @property
+    def path(self):
+        """
+        The path of the database, or None if it hasn't been opened yet.
+        """
+        return self._path
+
+    @property
+    def max_size(self):
+        """
+        The maximum number of contexts the store keeps. 0 disables it.
+        """
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size):
+        self._max_size = max(0, max_size)
+
+    @property
+    def enabled(self):
+        """
+        Whether the store is used.
+        """
+        return self._max_size > 0 and time.time() >= self._retry_after
+
+    def get(self, tk, key, config_hash, mtime):
+        """
+        Returns the stored context for the given key, or None if there is
+        none or it is no longer valid.
+
+        :param tk:          The Toolkit API instance to decode the context
+                            with.
+        :param key:         The context cache's key, made of the path and the
+                            configuration path.
+        :param config_hash: The configuration's current hash.
+        :param mtime:       The file's current modification time, or None if
+                            it shouldn't be checked.
+
+        :returns: A sgtk.context.Context, or None.
+        """
+        if not self.enabled:
+            return None
+
+        row_key = self._get_row_key(key)
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT context, config_hash, mtime FROM contexts "
+                "WHERE path = ? AND config_path = ?",
+                row_key,
+            ).fetchone()
+            if row is None or row[1] != config_hash or (
+                mtime is not None and row[2] is not None and row[2] != mtime
+            ):
+                self._count("misses")
+                return None
+
+            context = sgtk_handoff.decode_context(str(row[0]), tk)
+            with conn:
+                conn.execute(
+                    "UPDATE contexts SET last_used = ? "
+                    "WHERE path = ? AND config_path = ?",
+                    (time.time(),) + row_key,
+                )
+        except Exception:
+            self._on_error()
+            return None
+
+        self._count("hits")
+        return context
+
+    def put(self, key, context, config_hash, mtime):
+        """
+        Stores a context.
+
+        :param key:         The context cache's key, made of the path and the
+                            configuration path.
+        :param context:     The resolved sgtk.context.Context.
+        :param config_hash: The configuration's hash when it was resolved.
+        :param mtime:       The file's modification time when it was
+                            resolved, or None if it shouldn't be checked.
+        """
+        if not self.enabled:
+            return
+
+        try:
+            payload = sgtk_handoff.encode_context(context, inline=True)
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO contexts "
+                    "(path, config_path, context, config_hash, mtime, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    self._get_row_key(key) + (payload, config_hash, mtime, time.time()),
+                )
+        except Exception:
+            self._on_error()
+            return
+
+        with self._lock:
+            self.writes += 1
+            self._writes += 1
+            prune = self._writes % PRUNE_INTERVAL == 1
+        if prune:
+            self.prune()
+
+    def recent(self, config_path, limit):
+        """
+        Returns the most recently used stored contexts of a pipeline
+        configuration, still encoded, whether or not they are still valid.
+
+        :param config_path: The root path of the pipeline configuration.
+        :param limit:       The maximum number of contexts.
+
+        :returns: A list of encoded contexts, most recently used first.
+        """
+        if not self.enabled:
+            return []
+
+        try:
+            rows = self._connect().execute(
+                "SELECT context FROM contexts WHERE config_path = ? "
+                "ORDER BY last_used DESC LIMIT ?",
+                (normalize_path(config_path), limit),
+            ).fetchall()
+        except Exception:
+            self._on_error()
+            return []
+        return [str(row[0]) for row in rows]
+
+    def prune(self):
+        """
+        Removes the least recently used contexts beyond the maximum size.
+        """
+        if not self.enabled:
+            return
+
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "DELETE FROM contexts WHERE rowid IN ("
+                    "SELECT rowid FROM contexts ORDER BY last_used DESC "
+                    "LIMIT -1 OFFSET ?)",
+                    (self._max_size,),
+                )
+        except Exception:
+            self._on_error()
+
+    def stats(self):
+        """
+        Returns a dict of the store's counters.
+        """
+        return dict(
+            enabled=self.enabled,
+            hits=self.hits,
+            misses=self.misses,
+            writes=self.writes,
+            errors=self.errors,
+        )
+
+    def close(self):
+        """
+        Closes the calling thread's connection to the database, if it has
+        one. A new one is opened if the thread uses the store again.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _get_row_key(self, key):
+        """
+        Returns the columns of the primary key of a context cache key.
+
+        :param key: The context cache's key.
+        """
+        (path, config_path) = key
+        return (path, normalize_path(config_path))
+
+    def _connect(self):
+        """
+        Returns this thread's connection to the database, creating the
+        database if needed.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        if self._path is None:
+            self._path = get_store_path()
+        if os.path.lexists(self._path) and not sgtk_userdir.is_owned(self._path):
+            raise OSError("%s belongs to another user" % self._path)
+
+        conn = sqlite3.connect(self._path, timeout=BUSY_TIMEOUT)
+        try:
+            # Lets readers go on while another process writes.
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error:
+            pass
+
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != STORE_VERSION:
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS contexts")
+        conn.executescript(_SCHEMA)
+        conn.execute("PRAGMA user_version = %d" % STORE_VERSION)
+        conn.commit()
+
+        self._local.conn = conn
+        return conn
+
+    def _count(self, counter):
+        """
+        Increments one of the counters.
+
+        :param counter: The name of the counter.
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _on_error(self):
+        """
+        Counts an error, and stops using the store for RETRY_INTERVAL seconds
+        if it couldn't be opened. It is only an optimization.
+        """
+        with self._lock:
+            self.errors += 1
+            if getattr(self._local, "conn", None) is None:
+                self._retry_after = time.time() + RETRY_INTERVAL
+
+
+# The store shared by everything in the session.
+_context_store = ContextStore()
+
+
+def get_context_store():
+    """
+    Returns the context store shared by the whole session.
+    """
+    return _context_store
+
+
+def _configure(settings):
+    """
+    Applies the engine's settings to the session's store.
+    """
+    if "persistent_context_cache_size" in settings:
+        _context_store.max_size = settings["persistent_context_cache_size"]
+
+on_configure(_configure)
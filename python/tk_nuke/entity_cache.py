@@ -0,0 +1,388 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache of the Shotgun entities referenced by the session's contexts.
+
+Switching between the same few shots over and over asks Shotgun for the same
+projects, entities, steps and tasks each time the engine needs one of their
+fields that the context doesn't hold, such as to label the context menus.
+This module keeps the entities read from Shotgun for the engine's
+entity_cache_ttl setting, in seconds, so that they are only read once. The
+contexts themselves are built by Toolkit, which reads Shotgun on its own.
+
+After the engine starts and after every context switch, the entities
+referenced by the current context, by the contexts in the session's context
+cache, by the most recently used contexts of the on-disk context store, and
+by the contexts of the configuration's context table are read on a worker
+thread, with one query per entity type, so that the next switches to any of
+them find everything cached. At most the engine's entity_prefetch_size
+entities are read at a time, in that order of preference.
+
+The cache only needs an object with the `find()` method of a Shotgun
+connection, so it is tested against shotgun_api3.lib.mockgun, see
+tests/test_entity_cache.py.
+"""
+
+import time
+import threading
+
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_handoff
+
+from . import import_startup_module
+from .snapshot import get_config_hash
+from .context_cache import get_context_cache
+from .context_store import get_context_store
+from .cache_settings import on_configure
+
+sgtk_context_table = import_startup_module("sgtk_context_table")
+
+DEFAULT_TTL = 300.0
+DEFAULT_PREFETCH_SIZE = 1000
+
+# The context fields referencing entities.
+_ENTITY_FIELDS = ("project", "entity", "step", "task", "user", "source_entity")
+
+# The fields read for each entity type, and for the other types.
+_FIELDS = {
+    "Project": ["name"],
+    "Step": ["code", "short_name", "entity_type"],
+    "Task": ["content", "step", "entity", "project"],
+    "HumanUser": ["name", "login"],
+}
+_DEFAULT_FIELDS = ["code", "project"]
+
+# The field holding the display name of each entity type, and of the others.
+_NAME_FIELDS = {
+    "Project": "name",
+    "Task": "content",
+    "HumanUser": "name",
+}
+_DEFAULT_NAME_FIELD = "code"
+
+
+def get_fields(entity_type):
+    """
+    Returns the fields read for the given entity type.
+
+    :param entity_type: The Shotgun entity type.
+    """
+    return _FIELDS.get(entity_type, _DEFAULT_FIELDS)
+
+
+def get_context_entities(context):
+    """
+    Returns the entities referenced by a context.
+
+    :param context: A sgtk.context.Context, or a dict of context fields as
+                    stored in the context table or decoded from the hand-off
+                    format.
+
+    :returns: A list of entity dicts, with a type and an id.
+    """
+    if isinstance(context, dict):
+        get_field = context.get
+    else:
+        get_field = lambda name: getattr(context, name, None)
+
+    entities = [get_field(name) for name in _ENTITY_FIELDS]
+    entities.extend(get_field("additional_entities") or [])
+    return [e for e in entities if e and e.get("type") and e.get("id")]
+
+
+class EntityCache(object):
+    """
+    Shotgun entities, kept for a limited time.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, prefetch_size=DEFAULT_PREFETCH_SIZE):
+        """
+        :param ttl:             How long entities are kept, in seconds. 0
+                                disables the cache.
+        :param prefetch_size:   The maximum number of entities a prefetch
+                                reads. 0 disables prefetching.
+        """
+        self._ttl = ttl
+        self.prefetch_size = prefetch_size
+        self._entities = dict()
+        self._lock = threading.Lock()
+        self._prefetching = False
+
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.prefetched = 0
+
+    @property
+    def ttl(self):
+        """
+        How long entities are kept, in seconds. 0 disables the cache.
+        """
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, ttl):
+        self._ttl = max(0.0, ttl)
+
+    def find_one(self, shotgun, entity_type, entity_id):
+        """
+        Returns an entity, reading it from Shotgun only if it isn't cached.
+
+        :param shotgun:     The Shotgun connection to read with.
+        :param entity_type: The entity type.
+        :param entity_id:   The entity id.
+
+        :returns: A dict of the entity's fields, as returned by
+                  :func:`get_fields`, or None if it doesn't exist.
+        """
+        key = (entity_type, entity_id)
+        entity = self._get(key)
+        if entity is not None:
+            return entity
+
+        result = self._find(shotgun, entity_type, [entity_id])
+        return result.get(key)
+
+    def prefetch(self, shotgun, entities):
+        """
+        Reads the given entities that aren't cached from Shotgun, with one
+        query per entity type, up to the prefetch size.
+
+        :param shotgun:     The Shotgun connection to read with.
+        :param entities:    A list of entity dicts, with a type and an id, the
+                            ones to read first first.
+
+        :returns: The number of entities read.
+        """
+        ids_by_type = dict()
+        seen = set()
+        now = time.time()
+        with self._lock:
+            for entity in entities:
+                if len(seen) >= self.prefetch_size:
+                    break
+                key = (entity["type"], entity["id"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                cached = self._entities.get(key)
+                if cached is None or cached[1] <= now:
+                    ids_by_type.setdefault(key[0], []).append(key[1])
+
+        count = 0
+        for (entity_type, ids) in sorted(ids_by_type.iteritems()):
+            count += len(self._find(shotgun, entity_type, ids))
+        with self._lock:
+            self.prefetched += count
+        return count
+
+    def prefetch_in_background(self, tk, context=None):
+        """
+        Reads the entities referenced by the given context, the session's
+        cached contexts, the most recently used contexts of the context store
+        and the contexts of the context table, in that order, on a worker
+        thread. Does nothing while a previous prefetch is still running.
+
+        :param tk:      The Toolkit API instance, whose configuration's
+                        stored contexts are read and whose Shotgun connection
+                        is used.
+        :param context: The sgtk.context.Context to read the entities of
+                        first, usually the current one.
+        """
+        if not self._ttl or self.prefetch_size <= 0:
+            return
+
+        with self._lock:
+            if self._prefetching:
+                return
+            self._prefetching = True
+
+        # Taken on the calling thread, the cache changes with every switch.
+        contexts = ([context] if context else []) + get_context_cache().contexts()
+
+        def _prefetch():
+            try:
+                entities = _get_prefetch_entities(tk, contexts, self.prefetch_size)
+                # tk.shotgun is a connection of the worker thread's own.
+                self.prefetch(tk.shotgun, entities)
+            except Exception:
+                # Only an optimization, the entities are read when needed.
+                pass
+            finally:
+                get_context_store().close()
+                with self._lock:
+                    self._prefetching = False
+
+        thread = threading.Thread(target=_prefetch, name="tk-nuke-entity-prefetch")
+        thread.daemon = True
+        thread.start()
+
+    def get_name(self, shotgun, entity):
+        """
+        Returns the display name of an entity, reading it through the cache
+        if the entity dict doesn't hold it.
+
+        :param shotgun: The Shotgun connection to read with.
+        :param entity:  An entity dict, with a type and an id.
+        """
+        name = entity.get("name")
+        if name is not None:
+            return name
+        found = self.find_one(shotgun, entity["type"], entity["id"])
+        if found is None:
+            return None
+        return found.get(_NAME_FIELDS.get(entity["type"], _DEFAULT_NAME_FIELD))
+
+    def invalidate(self):
+        """
+        Drops all the cached entities.
+        """
+        with self._lock:
+            self._entities.clear()
+
+    def stats(self):
+        """
+        Returns a dict of the cache's counters.
+        """
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self._entities),
+            ttl=self._ttl,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=float(self.hits) / lookups if lookups else 0.0,
+            queries=self.queries,
+            prefetched=self.prefetched,
+        )
+
+    def _get(self, key):
+        """
+        Returns a cached entity, or None if it isn't cached or has expired.
+
+        :param key: A tuple of the entity type and id.
+        """
+        with self._lock:
+            cached = self._entities.get(key)
+            if cached is not None and cached[1] > time.time():
+                self.hits += 1
+                return cached[0]
+            self._entities.pop(key, None)
+            self.misses += 1
+        return None
+
+    def _find(self, shotgun, entity_type, ids):
+        """
+        Reads entities of a type from Shotgun, and caches them.
+
+        :param shotgun:     The Shotgun connection to read with.
+        :param entity_type: The entity type.
+        :param ids:         The list of ids to read.
+
+        :returns: A dict of the entities read, keyed by type and id.
+        """
+        results = shotgun.find(entity_type, [["id", "in", ids]], get_fields(entity_type))
+
+        found = dict(((entity_type, r["id"]), r) for r in results)
+        with self._lock:
+            self.queries += 1
+            if self._ttl:
+                expiry = time.time() + self._ttl
+                for (key, entity) in found.iteritems():
+                    self._entities[key] = (entity, expiry)
+        return found
+
+
+def _get_prefetch_entities(tk, contexts, size):
+    """
+    Returns the distinct entities referenced by the given contexts, then by
+    the stored contexts and by the context table's, up to the given number.
+    The sources are only read for as long as more entities are needed.
+
+    :param tk:          The Toolkit API instance of the configuration.
+    :param contexts:    A list of sgtk.context.Context to read first.
+    :param size:        The maximum number of entities.
+
+    :returns: A list of entity dicts.
+    """
+    entities = []
+    seen = set()
+    sources = (
+        lambda: contexts,
+        lambda: _get_stored_contexts(tk, size),
+        lambda: _get_table_contexts(tk),
+    )
+    for get_contexts in sources:
+        for context in get_contexts():
+            for entity in get_context_entities(context):
+                key = (entity["type"], entity["id"])
+                if key not in seen:
+                    seen.add(key)
+                    entities.append(entity)
+            if len(entities) >= size:
+                return entities[:size]
+    return entities
+
+
+def _get_stored_contexts(tk, limit):
+    """
+    Returns the fields of the most recently used contexts of the context
+    store for the given Toolkit instance's configuration, without building
+    contexts from them.
+
+    :param tk:      A Toolkit API instance.
+    :param limit:   The maximum number of contexts.
+
+    :returns: A list of dicts of context fields.
+    """
+    contexts = []
+    for payload in get_context_store().recent(tk.pipeline_configuration.get_path(), limit):
+        try:
+            contexts.append(sgtk_handoff.decode_fields(payload))
+        except Exception:
+            continue
+    return contexts
+
+
+def _get_table_contexts(tk):
+    """
+    Returns the fields of the contexts of the context table of the given
+    Toolkit instance's configuration, if it has a current one.
+
+    :param tk:  A Toolkit API instance.
+
+    :returns: A list of dicts of context fields.
+    """
+    table = sgtk_context_table.get_table(tk, get_config_hash(tk.pipeline_configuration.get_path()))
+    if table is None:
+        return []
+    return table.contexts
+
+
+# The cache shared by everything in the session.
+_entity_cache = EntityCache()
+
+
+def get_entity_cache():
+    """
+    Returns the entity cache shared by the whole session.
+    """
+    return _entity_cache
+
+
+def _configure(settings):
+    """
+    Applies the engine's settings to the session's cache.
+    """
+    if "entity_cache_ttl" in settings:
+        _entity_cache.ttl = settings["entity_cache_ttl"]
+    if "entity_prefetch_size" in settings:
+        _entity_cache.prefetch_size = settings["entity_prefetch_size"]
+
+on_configure(_configure)
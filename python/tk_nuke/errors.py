@@ -0,0 +1,22 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Exceptions raised by the tk_nuke package, which callers catch without having
+to import the modules that raise them.
+"""
+
+
+class ContextResolveTimeout(Exception):
+    """
+    Raised when a context couldn't be resolved within the latency budget and
+    there is no last-known-good context to fall back to. The current context
+    should be kept.
+    """
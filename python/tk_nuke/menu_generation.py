@@ -14,11 +14,16 @@ import tank
 import sys
 import nuke
 import os
+import traceback
 import unicodedata
-import nukescripts.openurl
-import nukescripts
 
-from PySide import QtGui
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_context_key
+
+from .entity_cache import get_entity_cache
+
+# Note that Qt is only imported where the Hiero menus need it, so that
+# the Nuke menus can be built without paying for the Qt bindings.
 
 # -----------------------------------------------------------------------------
 
@@ -38,6 +43,11 @@ class BaseMenuGenerator(object):
         self._engine = engine
         self._menu_name = menu_name
 
+        # The command of the "disabled" menu while it is up, and the message
+        # it shows.
+        self._disabled_cmd_name = None
+        self._disabled_msg = None
+
         engine_root_dir = self.engine.disk_location
         self._shotgun_logo = os.path.abspath(
             os.path.join(
@@ -118,9 +128,57 @@ class BaseMenuGenerator(object):
                             menu command.
         :param msg:         A message explaining why Toolkit is disabled.
         """
+        # A menu disabled for the same reason is kept, and only the message
+        # it shows is updated, so that failing over and over, as when saving
+        # outside of any project, doesn't rebuild it every time.
+        if self._disabled_cmd_name == cmd_name:
+            self._disabled_msg = msg
+            return
+
         if self._menu_handle:
             self.destroy_menu()
         self.create_disabled_menu(cmd_name, msg)
+        self._disabled_cmd_name = cmd_name
+        self._disabled_msg = msg
+
+    def _show_disabled_message(self):
+        """
+        Shows the message of the "disabled" menu.
+        """
+        import nuke
+        nuke.message(self._disabled_msg)
+
+    def _get_context_name(self):
+        """
+        Returns the label of the context menu, such as "Lighting, Shot ABC_123".
+        """
+        ctx = self.engine.context
+
+        # Names missing from the context are read through the session's
+        # entity cache, which is usually warm by now.
+        entity_cache = get_entity_cache()
+
+        def _get_name(entity):
+            return entity_cache.get_name(self.engine.shotgun, entity)
+
+        if ctx.project is None:
+            return str(ctx)
+        if ctx.entity is None:
+            return "%s" % _get_name(ctx.project)
+        if ctx.step is None and ctx.task is None:
+            # entity only
+            # e.g. Shot ABC_123
+            return "%s %s" % (ctx.entity["type"], _get_name(ctx.entity))
+
+        # we have either step or task
+        task_step = None
+        if ctx.step:
+            task_step = _get_name(ctx.step)
+        if ctx.task:
+            task_step = _get_name(ctx.task)
+
+        # e.g. [Lighting, Shot ABC_123]
+        return "%s, %s %s" % (task_step, ctx.entity["type"], _get_name(ctx.entity))
 
     def _jump_to_sg(self):
         """
@@ -178,6 +236,9 @@ class HieroMenuGenerator(BaseMenuGenerator):
                                 added. Defaults to True.
         """
         import hiero
+        from tank.platform.qt import QtGui
+
+        self._disabled_cmd_name = None
         if self._menu_handle is not None:
             self.destroy_menu()
 
@@ -283,6 +344,7 @@ class HieroMenuGenerator(BaseMenuGenerator):
         Destroys the "Shotgun" menu.
         """
         import hiero
+        self._disabled_cmd_name = None
         menuBar = hiero.ui.menuBar()
         menuBar.removeAction(self._menu_handle.menuAction())
         self._menu_handle.clear()
@@ -342,24 +404,7 @@ class HieroMenuGenerator(BaseMenuGenerator):
         """
         Adds a context menu which displays the current context.
         """
-        ctx = self.engine.context
-
-        if ctx.entity is None:
-            ctx_name = "%s" % ctx.project["name"]
-        elif ctx.step is None and ctx.task is None:
-            # entity only
-            # e.g. Shot ABC_123
-            ctx_name = "%s %s" % (ctx.entity["type"], ctx.entity["name"])
-        else:
-            # we have either step or task
-            task_step = None
-            if ctx.step:
-                task_step = ctx.step.get("name")
-            if ctx.task:
-                task_step = ctx.task.get("name")
-
-            # e.g. [Lighting, Shot ABC_123]
-            ctx_name = "%s, %s %s" % (task_step, ctx.entity["type"], ctx.entity["name"])
+        ctx_name = self._get_context_name()
 
         # create the menu object
         ctx_menu = self._menu_handle.addMenu(ctx_name)
@@ -411,8 +456,7 @@ class NukeStudioMenuGenerator(HieroMenuGenerator):
         """
         self.create_menu(add_commands=False)
 
-        import nuke
-        callback = lambda m = msg: nuke.message(m)
+        callback = self._show_disabled_message
         cmd = HieroAppCommand(
             self.engine,
             cmd_name,
@@ -446,6 +490,8 @@ class NukeMenuGenerator(BaseMenuGenerator):
                                 will be created, but no contents will be
                                 added. Defaults to True.
         """
+        self._disabled_cmd_name = None
+
         # Create main Shotgun menu.
         menu_handle = nuke.menu("Nuke").addMenu(self._menu_name)
         node_menu_handle = nuke.menu("Nodes").addMenu(self._menu_name, icon=self._shotgun_logo)
@@ -500,7 +546,10 @@ class NukeMenuGenerator(BaseMenuGenerator):
                 # If the app recorded a context that it wants the command to be associated
                 # with, we need to check it against the current engine context. If they
                 # don't match then we don't add it.
-                if command_context is None or command_context is self.engine.context:
+                if command_context is None or sgtk_context_key.same_context(
+                    command_context,
+                    self.engine.context,
+                ):
                     node_menu_handle.addCommand(cmd.name, cmd.callback, icon=icon)
             elif cmd.type == "context_menu":
                 cmd.add_command_to_menu(self._context_menu)
@@ -538,8 +587,7 @@ class NukeMenuGenerator(BaseMenuGenerator):
         """
         self.create_menu(add_commands=False)
 
-        import nuke
-        callback = lambda m = msg: nuke.message(m)
+        callback = self._show_disabled_message
         cmd = NukeAppCommand(
             self.engine,
             cmd_name,
@@ -562,6 +610,7 @@ class NukeMenuGenerator(BaseMenuGenerator):
         # the menu by iteration (if you store the handle object, they may expire
         # and when you try to access them they underlying object is gone and things 
         # will crash). The clearMenu() method seems to work on both v6 and v7.
+        self._disabled_cmd_name = None
         menus = ["Nuke", "Pane", "Nodes"]
         for menu in menus:
             # Find the menu and iterate over all items.
@@ -577,8 +626,7 @@ class NukeMenuGenerator(BaseMenuGenerator):
 
         :param menu_handle: A handle to Nuke's top-level menu manager object.
         """        
-        ctx = self.engine.context
-        ctx_name = str(ctx)
+        ctx_name = self._get_context_name()
 
         # Create the menu object.
         ctx_menu = menu_handle.addMenu(ctx_name, icon=self._shotgun_logo_blue)
@@ -791,6 +839,8 @@ class HieroAppCommand(BaseAppCommand):
         :param icon:    The path to an image to use as the icon for the
                         command.
         """
+        from tank.platform.qt import QtGui
+
         icon = icon or self.properties.get("icon")
         action = menu.addAction(self.name)
         action.setEnabled(enabled)
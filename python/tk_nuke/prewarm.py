@@ -0,0 +1,249 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Resolution of the contexts of Nuke's recent files ahead of time.
+
+Most of the scripts opened in a new Nuke session are in its File->Open Recent
+menu. Once the engine has started and Nuke is idle, the prewarmer resolves
+the contexts of the engine's prewarm_recent_files most recent of them, for
+up to its prewarm_time_budget seconds, on a few worker threads, into the
+session's context cache and the on-disk context store, and records them to be
+handed down to the processes file->open spawns, so that opening them doesn't
+wait for their contexts to be resolved.
+
+The contexts are cached by path, so they are used whatever context the
+session has switched to since. Prewarming stops once its time budget has run
+out, and as soon as a script is opened or saved, or the context changes, so
+that the contexts handed down to new processes aren't inherited from a
+context the session has left.
+"""
+
+import os
+import time
+import Queue
+import threading
+
+import nuke
+import tank
+
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_trace
+
+from .snapshot import normalize_path, record_context
+from .tank_pool import get_tank_pool
+from .context_cache import get_context_cache
+from .context_store import get_context_store
+
+# The number of worker threads resolving contexts at once.
+MAX_WORKERS = 2
+
+DEFAULT_TIME_BUDGET = 30.0
+
+
+def get_recent_files(count):
+    """
+    Returns the paths in Nuke's recent files list that exist, most recent
+    first. Must be called on the main thread.
+
+    :param count:   The maximum number of paths to return.
+    """
+    paths = []
+    index = 1
+    while len(paths) < count:
+        try:
+            path = nuke.recentFile(index)
+        except RuntimeError:
+            # Past the end of the list.
+            break
+        index += 1
+        if path and os.path.isfile(path):
+            paths.append(path)
+    return paths
+
+
+class ContextPrewarmer(object):
+    """
+    Resolves the contexts of a list of scripts in the background, within a
+    time budget, until it is cancelled.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        self.runs = 0
+        self.resolved = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def start_when_idle(self, engine, count, time_budget=DEFAULT_TIME_BUDGET):
+        """
+        Prewarms the contexts of the most recent files once Nuke's main thread
+        is idle. Must be called on the main thread.
+
+        :param engine:      The running engine, whose context the recent files'
+                            contexts are resolved from.
+        :param count:       The number of recent files to prewarm.
+        :param time_budget: How long to keep prewarming for, in seconds.
+        """
+        with self._lock:
+            generation = self._generation
+        nuke.executeInMainThread(
+            self._start,
+            args=(generation, engine.context, count, time_budget),
+        )
+
+    def cancel(self):
+        """
+        Stops prewarming. The contexts being resolved are still cached, but no
+        more are started.
+        """
+        with self._lock:
+            self._generation += 1
+
+    def stats(self):
+        """
+        Returns a dict of the prewarmer's counters.
+        """
+        return dict(
+            runs=self.runs,
+            resolved=self.resolved,
+            failed=self.failed,
+            cancelled=self.cancelled,
+        )
+
+    def _start(self, generation, context, count, time_budget):
+        """
+        Starts the workers, on the main thread, unless prewarming has been
+        cancelled since it was requested.
+        """
+        if not self._is_current(generation):
+            return
+
+        current = normalize_path(nuke.root().name())
+        paths = [p for p in get_recent_files(count + 1) if normalize_path(p) != current]
+        if not paths:
+            return
+
+        queue = Queue.Queue()
+        for path in paths[:count]:
+            queue.put(path)
+
+        with self._lock:
+            self.runs += 1
+        deadline = time.time() + time_budget
+        workers = []
+        for index in range(min(MAX_WORKERS, queue.qsize())):
+            worker = threading.Thread(
+                target=self._run,
+                args=(generation, queue, context, deadline),
+                name="tk-nuke-prewarm-%d" % index,
+            )
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        waiter = threading.Thread(
+            target=self._wait,
+            args=(generation, workers, time.time()),
+            name="tk-nuke-prewarm",
+        )
+        waiter.daemon = True
+        waiter.start()
+
+    def _run(self, generation, queue, context, deadline):
+        """
+        Resolves the contexts of the queued paths until there are none left,
+        the time budget has run out, or prewarming is cancelled.
+        """
+        try:
+            self._resolve_queued(generation, queue, context, deadline)
+        finally:
+            get_context_store().close()
+
+    def _resolve_queued(self, generation, queue, context, deadline):
+        """
+        Does the work of :meth:`_run`.
+        """
+        while self._is_current(generation) and time.time() < deadline:
+            try:
+                path = queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                with sgtk_trace.span("tk_nuke.prewarm_context", category="callbacks", path=path):
+                    tk = get_tank_pool().tank_from_path(path)
+                    new_context = get_context_cache().context_from_path(tk, path, context)
+            except Exception:
+                # The script may not be in a project at all, it will be
+                # reported if it is opened.
+                self._count("failed")
+                continue
+
+            # Contexts inherited from a previous context aren't handed down.
+            if self._is_current(generation):
+                record_context(path, new_context)
+                self._count("resolved")
+
+    def _wait(self, generation, workers, start_time):
+        """
+        Waits for the workers, and hands the contexts they resolved down to
+        the processes spawned by file->open, on the main thread.
+        """
+        for worker in workers:
+            worker.join()
+
+        if not self._is_current(generation):
+            self._count("cancelled")
+            return
+
+        sgtk_trace.instant(
+            "tk_nuke.prewarm_done",
+            category="callbacks",
+            elapsed=time.time() - start_time,
+            resolved=self.resolved,
+        )
+        nuke.executeInMainThread(self._write_snapshot, args=(generation,))
+
+    def _write_snapshot(self, generation):
+        """
+        Writes the engine's state snapshot, with the contexts prewarmed.
+        """
+        engine = tank.platform.current_engine()
+        if engine and self._is_current(generation):
+            engine.write_state_snapshot()
+
+    def _is_current(self, generation):
+        """
+        Whether prewarming hasn't been cancelled since the given generation.
+        """
+        with self._lock:
+            return generation == self._generation
+
+    def _count(self, counter):
+        """
+        Increments one of the counters.
+
+        :param counter: The name of the counter.
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+# The prewarmer shared by everything in the session.
+_context_prewarmer = ContextPrewarmer()
+
+
+def get_context_prewarmer():
+    """
+    Returns the context prewarmer shared by the whole session.
+    """
+    return _context_prewarmer
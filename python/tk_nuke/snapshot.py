@@ -0,0 +1,309 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Engine state hand-off between a Nuke session and the processes it spawns.
+
+Every file->new and file->open in Nuke starts a new process, which would
+otherwise have to rediscover the pipeline configuration and resolve its
+context from scratch. The running engine writes what it has already resolved
+to a small snapshot file and passes its location down through the
+environment. The child process loads it, checks that the pipeline
+configuration has not changed since it was written, and reuses its contents.
+
+Snapshots are written to the user's private directory, see sgtk_userdir in
+the startup directory, and removed when the engine that wrote them is
+destroyed. A snapshot file that doesn't belong to the current user is never
+read.
+"""
+
+import os
+import json
+
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_handoff
+import sgtk_context_key
+import sgtk_userdir
+from sgtk_paths import normalize_path, get_config_hash
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_ENV_VAR = "TANK_NUKE_ENGINE_INIT_SNAPSHOT"
+
+# Encoded contexts for the script paths resolved in this session, and in
+# the sessions this one was spawned from, keyed by normalized path.
+_seen_contexts = dict()
+
+# The snapshot written by this process, removed when the engine is destroyed,
+# and what was written to it.
+_written_snapshot_path = None
+_written_snapshot_data = None
+
+# The snapshot handed down to this process, loaded on first use.
+_loaded_snapshot = None
+_snapshot_loaded = False
+
+
+def record_context(path, context):
+    """
+    Remembers the context resolved for a script path, so that it can be
+    handed down to new processes.
+
+    :param path:    The path of the script the context was resolved from.
+    :param context: The resolved sgtk.context.Context.
+    """
+    _seen_contexts[normalize_path(path)] = sgtk_handoff.encode_context(
+        context,
+        inline=True,
+    )
+
+
+def get_recorded_context(path, tk=None):
+    """
+    Returns the context last resolved for a script path in this session, or
+    in the sessions this one was spawned from, or None if there is none.
+
+    :param path:    The path of the script.
+    :param tk:      An optional Toolkit API instance, which is used for the
+                    context if it belongs to the right pipeline configuration.
+    """
+    load_engine_snapshot()
+    ctx_str = _seen_contexts.get(normalize_path(path))
+    if ctx_str is None:
+        return None
+    return sgtk_handoff.decode_context(ctx_str, tk)
+
+
+class EngineSnapshot(object):
+    """
+    The engine state handed down from a parent Nuke session.
+    """
+    def __init__(self, data):
+        """
+        Initializes a new snapshot.
+
+        :param data:    The snapshot's contents, as written by
+                        :meth:`write_engine_snapshot`.
+        """
+        self._data = data
+        self._context = None
+        self._tk = None
+
+    @property
+    def pipeline_config_path(self):
+        """
+        The root path of the pipeline configuration the snapshot was
+        written for.
+        """
+        return self._data["pipeline_config_path"]
+
+    @property
+    def project_root(self):
+        """
+        The project root directory path of the parent session.
+        """
+        return self._data["project_root"]
+
+    @property
+    def contexts(self):
+        """
+        A dict of encoded contexts keyed by normalized script path.
+        """
+        return self._data["contexts"]
+
+    @property
+    def context(self):
+        """
+        The sgtk.context.Context the parent engine was running in.
+        """
+        if self._context is None:
+            self._context = self._decode_context(self._data["context"])
+        return self._context
+
+    def is_valid(self):
+        """
+        Whether the snapshot can be used. Snapshots written by a different
+        version of the engine, or for a pipeline configuration that has
+        changed since, are not valid.
+        """
+        if self._data.get("version") != SNAPSHOT_VERSION:
+            return False
+        current_hash = get_config_hash(self.pipeline_config_path)
+        return current_hash == self._data.get("config_hash")
+
+    def get_context(self, script_path):
+        """
+        Returns the context the parent session resolved for the given script,
+        or None if it never saw it.
+
+        :param script_path: The path to a script file on disk.
+        """
+        ctx_str = self.contexts.get(normalize_path(script_path))
+        if ctx_str is None:
+            return None
+        return self._decode_context(ctx_str)
+
+    def _decode_context(self, ctx_str):
+        """
+        Decodes a context from the snapshot, sharing one Toolkit API
+        instance between all of the contexts decoded from it.
+
+        :param ctx_str: The encoded context.
+        """
+        context = sgtk_handoff.decode_context(ctx_str, self._tk)
+        self._tk = context.tank
+        return context
+
+    def get_gizmo_folder(self, app_location):
+        """
+        Returns the gizmo folder of an app as found by the parent session.
+
+        :param app_location:    The app's location on disk.
+
+        :returns: A tuple of whether the app was known to the parent session
+                  and its gizmo folder, which is None if it has none.
+        """
+        folders = self._data["gizmo_folders"]
+        if app_location not in folders:
+            return (False, None)
+        return (True, folders[app_location])
+
+    def get_favourite_dirs(self, context):
+        """
+        Returns the favourite directories the parent session set up, if
+        they apply to the given context.
+
+        :param context: The sgtk.context.Context the favourites are needed for.
+
+        :returns: A list of favourite directory dicts, or None if the parent
+                  session was running in a different context.
+        """
+        if not sgtk_context_key.same_context(context, self.context):
+            return None
+        return self._data["favourite_dirs"]
+
+
+def write_engine_snapshot(engine, gizmo_folders=None, favourite_dirs=None):
+    """
+    Writes the state of the given engine to a snapshot file, and points the
+    environment at it so that processes spawned from now on pick it up.
+    The file is left alone if the state hasn't changed since it was written.
+
+    :param engine:          The running tk-nuke engine.
+    :param gizmo_folders:   A dict of app locations and their gizmo folders.
+    :param favourite_dirs:  A list of favourite directory dicts, as set up
+                            in the file dialogs.
+    """
+    config_path = engine.tank.pipeline_configuration.get_path()
+
+    data = dict(
+        version=SNAPSHOT_VERSION,
+        pipeline_config_path=config_path,
+        # Shared with the caches, so this rarely walks the configuration.
+        config_hash=get_config_hash(config_path),
+        project_root=engine.tank.project_path,
+        context=sgtk_handoff.encode_context(engine.context, inline=True),
+        contexts=dict(_seen_contexts),
+        gizmo_folders=gizmo_folders or dict(),
+        favourite_dirs=favourite_dirs or [],
+    )
+
+    global _written_snapshot_path, _written_snapshot_data
+
+    # Nothing has changed since the last snapshot, which is the case for
+    # most saves.
+    if (
+        data == _written_snapshot_data
+        and os.environ.get(SNAPSHOT_ENV_VAR) == _written_snapshot_path
+        and os.path.exists(_written_snapshot_path)
+    ):
+        return
+
+    # Write to a temporary file first and move it into place, so that a
+    # process spawned mid-write never reads a partial snapshot.
+    try:
+        snapshot_path = os.path.join(
+            sgtk_userdir.get_user_dir(),
+            "snapshot-%d.json" % os.getpid(),
+        )
+        temp_path = "%s.tmp" % snapshot_path
+        with open(temp_path, "w") as fh:
+            json.dump(data, fh)
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        os.rename(temp_path, snapshot_path)
+    except (IOError, OSError), e:
+        engine.log_debug("Unable to write engine snapshot: %s" % e)
+        return
+
+    _written_snapshot_path = snapshot_path
+    _written_snapshot_data = data
+    os.environ[SNAPSHOT_ENV_VAR] = snapshot_path
+
+
+def remove_engine_snapshot():
+    """
+    Removes the snapshot written by this process, if any. Processes spawned
+    from now on resolve their state from scratch, until a new one is written.
+    """
+    global _written_snapshot_path, _written_snapshot_data
+
+    snapshot_path = _written_snapshot_path
+    if snapshot_path is None:
+        return
+    _written_snapshot_path = None
+    _written_snapshot_data = None
+
+    if os.environ.get(SNAPSHOT_ENV_VAR) == snapshot_path:
+        del os.environ[SNAPSHOT_ENV_VAR]
+    try:
+        os.remove(snapshot_path)
+    except OSError:
+        pass
+
+
+def load_engine_snapshot():
+    """
+    Returns the snapshot handed down from the parent session, or None if
+    there is none or it is no longer valid.
+
+    The snapshot is only read once per process. The script contexts it
+    holds are carried over, so that they are handed down again from this
+    process.
+    """
+    global _loaded_snapshot, _snapshot_loaded
+
+    if _snapshot_loaded:
+        return _loaded_snapshot
+    _snapshot_loaded = True
+
+    snapshot_path = os.environ.get(SNAPSHOT_ENV_VAR)
+    if not snapshot_path:
+        return None
+
+    # The snapshot decides which pipeline configuration gets loaded, so one
+    # planted by another user must never be read.
+    if not sgtk_userdir.is_owned(snapshot_path):
+        return None
+
+    try:
+        with open(snapshot_path) as fh:
+            snapshot = EngineSnapshot(json.load(fh))
+        if not snapshot.is_valid():
+            return None
+    except Exception:
+        # A missing, unreadable or stale snapshot just means the
+        # state is resolved from scratch.
+        return None
+
+    for (path, ctx_str) in snapshot.contexts.iteritems():
+        _seen_contexts.setdefault(path, ctx_str)
+
+    _loaded_snapshot = snapshot
+    return snapshot
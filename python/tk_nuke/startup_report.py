@@ -0,0 +1,160 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Startup report of batch sessions, showing what the farm profile saves.
+
+Batch sessions (`nuke -t`) started with the TK_NUKE_FARM_PROFILE environment
+variable set only run the startup subsystems listed in the engine's
+farm_profile_subsystems setting. Every batch session started without it
+records how long its engine took to start and how much memory the process
+used once it had, as the baseline of its pipeline configuration and engine
+instance, in the user's private directory, see sgtk_userdir in the startup
+directory. Farm profile sessions report their own figures along with the
+time and memory they saved against the latest baseline.
+
+The memory is the resident size of the process once the engine has started
+where it can be read, and its peak resident size otherwise.
+"""
+
+import os
+import sys
+import json
+import time
+
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_userdir
+
+# The environment variable that turns the farm profile on.
+FARM_PROFILE_ENV_VAR = "TK_NUKE_FARM_PROFILE"
+
+# The file holding the baselines, in the user's private directory.
+_BASELINE_FILE_NAME = "farm-baseline.json"
+
+
+def get_memory():
+    """
+    Returns the memory used by the process in megabytes: its current
+    resident size on Linux, and its peak resident size elsewhere, or None
+    where neither can be determined.
+    """
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows.
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X reports bytes.
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def get_baseline_key(engine):
+    """
+    Returns the key the baseline of the given engine is stored under.
+
+    :param engine:  The running tk-nuke engine.
+    """
+    return "%s:%s" % (engine.tank.pipeline_configuration.get_path(), engine.instance_name)
+
+
+def _get_baseline_path():
+    """
+    Returns the path of the baselines file.
+
+    :raises OSError: If the user's directory can't be used.
+    """
+    return os.path.join(sgtk_userdir.get_user_dir(), _BASELINE_FILE_NAME)
+
+
+def _read_baselines(baseline_path):
+    """
+    Returns the dict of the baselines stored in the given file, empty if it
+    is missing, unreadable or doesn't belong to the current user.
+
+    :param baseline_path:   The path of the baselines file.
+    """
+    if not sgtk_userdir.is_owned(baseline_path):
+        return dict()
+    try:
+        with open(baseline_path) as fh:
+            baselines = json.load(fh)
+    except (IOError, ValueError):
+        return dict()
+    if not isinstance(baselines, dict):
+        return dict()
+    return baselines
+
+
+def read_baseline(key):
+    """
+    Returns the baseline stored under the given key.
+
+    :param key: The key, as returned by :func:`get_baseline_key`.
+
+    :returns: A dict with the "elapsed" time in seconds, the "memory" in
+              megabytes, which may be None, and the "time" it was recorded
+              at, or None if there is no baseline.
+    """
+    try:
+        return _read_baselines(_get_baseline_path()).get(key)
+    except OSError:
+        return None
+
+
+def write_baseline(key, elapsed, memory):
+    """
+    Stores the startup figures of a session run without the farm profile as
+    the baseline of the given key.
+
+    :param key:     The key, as returned by :func:`get_baseline_key`.
+    :param elapsed: The time the engine took to start, in seconds.
+    :param memory:  The memory used once it had, in megabytes, or None.
+
+    :raises OSError, IOError: If the baseline can't be written.
+    """
+    baseline_path = _get_baseline_path()
+    baselines = _read_baselines(baseline_path)
+    baselines[key] = dict(elapsed=elapsed, memory=memory, time=time.time())
+
+    # Write to a temporary file first and move it into place, so that a
+    # farm session never reads a partial file.
+    temp_path = "%s.%d.tmp" % (baseline_path, os.getpid())
+    with open(temp_path, "w") as fh:
+        json.dump(baselines, fh)
+    if os.path.exists(baseline_path):
+        os.remove(baseline_path)
+    os.rename(temp_path, baseline_path)
+
+
+def get_savings(baseline, elapsed, memory):
+    """
+    Returns what a farm profile session saved against a baseline.
+
+    :param baseline:    The baseline, as returned by :func:`read_baseline`.
+    :param elapsed:     The time the engine took to start, in seconds.
+    :param memory:      The memory used once it had, in megabytes, or None.
+
+    :returns: A tuple of the time saved in seconds, and of the memory saved
+              in megabytes, or None if either figure is unknown.
+    """
+    saved_memory = None
+    if memory is not None and baseline.get("memory") is not None:
+        saved_memory = baseline["memory"] - memory
+    return (baseline["elapsed"] - elapsed, saved_memory)
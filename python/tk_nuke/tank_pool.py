@@ -0,0 +1,344 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pool of Toolkit API instances, keyed by pipeline configuration.
+
+`tank.tank_from_path()` discovers and parses a pipeline configuration every
+time it is called, and the callbacks call it on every save and script load.
+The pool keeps the instances it has created, and finds the one a path belongs
+to with a prefix tree over their storage roots, so that a path inside a
+project whose configuration is already loaded never causes it to be parsed
+again. An instance is evicted when its configuration has changed on disk.
+
+Several configurations can share storage roots, such as a project's primary
+configuration and its sandboxes, so each node of the tree holds all the
+configurations of its root, along with their project. A path is only served
+from the pool if the configurations of its deepest root all belong to the same
+project, by the one of them added last.
+
+Paths that aren't part of any project are remembered too, for the number of
+seconds of the engine's unmanaged_path_cache_ttl setting, along with the
+error resolving them raised. The
+error is raised again without asking Toolkit for any other path in the same
+folder, so that saving over and over to an unmanaged location only pays
+for the first failure.
+"""
+
+import os
+import time
+import threading
+import collections
+
+import tank
+
+from .snapshot import normalize_path, get_config_hash
+from .cache_settings import on_configure
+
+DEFAULT_NEGATIVE_CACHE_TTL = 60.0
+
+
+class _PrefixNode(object):
+    """
+    A node of the prefix tree, standing for one path component.
+    """
+    __slots__ = ("children", "configs")
+
+    def __init__(self):
+        self.children = dict()
+        # The project id of each configuration with a root here, in the
+        # order they were added.
+        self.configs = collections.OrderedDict()
+
+
+class TankPool(object):
+    """
+    Live Toolkit API instances, found by the paths they manage.
+    """
+    def __init__(self, negative_cache_ttl=DEFAULT_NEGATIVE_CACHE_TTL):
+        """
+        :param negative_cache_ttl:  How long a path found not to be part of
+                                    any project is remembered, in seconds. A
+                                    project created under it in the meantime
+                                    is only seen once this has run out. 0
+                                    disables it.
+        """
+        self.negative_cache_ttl = negative_cache_ttl
+        self._root = _PrefixNode()
+        self._instances = dict()
+        self._config_hashes = dict()
+        self._failures = dict()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.negative_hits = 0
+        self.negative_expirations = 0
+
+    def add(self, tk):
+        """
+        Adds an instance to the pool, making it the one used for the paths
+        under its storage roots.
+
+        :param tk:  The Toolkit API instance.
+        """
+        config_path = tk.pipeline_configuration.get_path()
+        project_id = tk.pipeline_configuration.get_project_id()
+        with self._lock:
+            self._instances[config_path] = tk
+            # Hashed on the first lookup, so that adding the engine's own
+            # instance at startup doesn't walk the configuration.
+            self._config_hashes[config_path] = None
+            for root in tk.roots.values():
+                configs = self._get_node(root, create=True).configs
+                # Re-added configurations are preferred again.
+                configs.pop(config_path, None)
+                configs[config_path] = project_id
+                # The paths under the new roots are managed now.
+                self._forget_failures(root)
+
+    def tank_from_path(self, path):
+        """
+        Returns the Toolkit API instance for the given path, from the pool if
+        possible, and from `tank.tank_from_path()` otherwise.
+
+        :param path:    A path inside a project, or a project root.
+
+        :raises: `tank.TankError` if the path isn't part of any project,
+                 which is raised again for the paths next to it until
+                 negative_cache_ttl seconds have passed.
+        """
+        config_path = self._find_config_path(path)
+        if config_path is not None and self._is_current(config_path):
+            with self._lock:
+                tk = self._instances.get(config_path)
+                if tk is not None:
+                    self.hits += 1
+                    return tk
+
+        error = self._find_failure(path)
+        if error is not None:
+            raise error
+
+        with self._lock:
+            self.misses += 1
+        try:
+            tk = tank.tank_from_path(path)
+        except tank.TankError, e:
+            now = time.time()
+            with self._lock:
+                for (folder, (error, expiry)) in self._failures.items():
+                    if now >= expiry:
+                        del self._failures[folder]
+                        self.negative_expirations += 1
+                if self.negative_cache_ttl > 0:
+                    self._failures[normalize_path(os.path.dirname(path))] = (
+                        e,
+                        now + self.negative_cache_ttl,
+                    )
+            raise
+        self.add(tk)
+        return tk
+
+    def peek(self, path):
+        """
+        Returns the pooled instance for the given path, without checking
+        whether its configuration has changed or creating one.
+
+        :param path:    A path inside a project, or a project root.
+
+        :returns: The Toolkit API instance, or None if the pool has none.
+        """
+        config_path = self._find_config_path(path)
+        with self._lock:
+            return self._instances.get(config_path)
+
+    def evict(self, config_path):
+        """
+        Removes the instance of the given configuration from the pool.
+
+        :param config_path: The root path of the pipeline configuration.
+        """
+        with self._lock:
+            if self._instances.pop(config_path, None) is None:
+                return
+            self._config_hashes.pop(config_path, None)
+            self.evictions += 1
+            self._prune(self._root, config_path)
+
+    def stats(self):
+        """
+        Returns a dict of the pool's counters.
+        """
+        return dict(
+            instances=len(self._instances),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            negative_entries=len(self._failures),
+            negative_hits=self.negative_hits,
+            negative_expirations=self.negative_expirations,
+        )
+
+    def forget_failures(self):
+        """
+        Forgets all the paths found not to be part of any project, for when a
+        project has just been set up for one of them.
+        """
+        with self._lock:
+            self._failures.clear()
+
+    def _get_node(self, path, create=False):
+        """
+        Returns the prefix tree node of the given path.
+
+        :param path:    The path to look up.
+        :param create:  Whether to create the nodes that don't exist yet.
+
+        :returns: The node, or None if it doesn't exist and create is False.
+        """
+        node = self._root
+        for component in self._split(path):
+            child = node.children.get(component)
+            if child is None:
+                if not create:
+                    return None
+                child = _PrefixNode()
+                node.children[component] = child
+            node = child
+        return node
+
+    def _find_config_path(self, path):
+        """
+        Returns the configuration added last of the deepest storage root
+        holding the given path, or None if no instance in the pool manages
+        it, or if the configurations of that root belong to different
+        projects, which only Toolkit can tell apart.
+
+        :param path:    The path to look up.
+        """
+        with self._lock:
+            node = self._root
+            configs = node.configs
+            for component in self._split(path):
+                node = node.children.get(component)
+                if node is None:
+                    break
+                if node.configs:
+                    configs = node.configs
+            if not configs or len(set(configs.values())) != 1:
+                return None
+            return next(reversed(configs))
+
+    def _find_failure(self, path):
+        """
+        Returns the error raised for the folder of the given path, if it
+        hasn't expired yet.
+
+        Folders above it aren't looked at, as a project may well live below
+        a folder that isn't part of any project itself.
+
+        :param path:    The path to look up.
+
+        :returns: A `tank.TankError`, or None.
+        """
+        with self._lock:
+            if not self._failures:
+                return None
+
+            folder = normalize_path(os.path.dirname(path))
+            failure = self._failures.get(folder)
+            if failure is None:
+                return None
+
+            (error, expiry) = failure
+            if time.time() >= expiry:
+                del self._failures[folder]
+                self.negative_expirations += 1
+                return None
+
+            self.negative_hits += 1
+            return error
+
+    def _forget_failures(self, root):
+        """
+        Forgets the failures of the given folder and of everything below it.
+
+        :param root:    The folder to forget the failures of.
+        """
+        norm_root = normalize_path(root)
+        prefix = norm_root.rstrip(os.path.sep) + os.path.sep
+        for folder in self._failures.keys():
+            if folder == norm_root or folder.startswith(prefix):
+                del self._failures[folder]
+
+    def _prune(self, node, config_path):
+        """
+        Clears the given configuration from a node and everything below it,
+        removing the branches left empty.
+
+        :param node:        The node to prune from.
+        :param config_path: The root path of the pipeline configuration.
+
+        :returns: Whether the node is now empty.
+        """
+        node.configs.pop(config_path, None)
+        for (component, child) in node.children.items():
+            if self._prune(child, config_path):
+                del node.children[component]
+        return not node.configs and not node.children
+
+    def _is_current(self, config_path):
+        """
+        Whether the given configuration has not changed since its instance
+        was first looked up, as far as its hash tells, see
+        sgtk_paths.get_config_hash(). The instance is evicted if it has.
+
+        :param config_path: The root path of the pipeline configuration.
+        """
+        config_hash = get_config_hash(config_path)
+
+        with self._lock:
+            known_hash = self._config_hashes.get(config_path)
+            if known_hash is not None and known_hash != config_hash:
+                self.evict(config_path)
+                return False
+            self._config_hashes[config_path] = config_hash
+            return True
+
+    def _split(self, path):
+        """
+        Returns the components of a normalized path.
+
+        :param path:    The path to split.
+        """
+        return [c for c in normalize_path(path).split(os.path.sep) if c]
+
+
+# The pool shared by everything in the session.
+_tank_pool = TankPool()
+
+
+def _configure(settings):
+    """
+    Applies the engine's settings to the session's pool.
+    """
+    if "unmanaged_path_cache_ttl" in settings:
+        _tank_pool.negative_cache_ttl = settings["unmanaged_path_cache_ttl"]
+
+on_configure(_configure)
+
+
+def get_tank_pool():
+    """
+    Returns the Toolkit API instance pool shared by the whole session.
+    """
+    return _tank_pool
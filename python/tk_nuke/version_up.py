@@ -0,0 +1,162 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Fast path for the context of version-up saves.
+
+Most saves go from one version of a script to the next, such as from
+shot_comp_v012.nk to shot_comp_v013.nk, and the new path is never in the
+context cache. `tk.context_from_path()` derives a context from the folders
+above a file, never from its name, so when the new script is in the same
+folder as the script the current context was resolved from, and matches the
+same template, only fields of the file name such as the version or the name
+have changed, and the context is the current one. The save callbacks check
+this first, which costs no filesystem or Shotgun access.
+"""
+
+import os
+import threading
+
+from tank import TankError
+
+# Imported from the startup directory by the tk_nuke package.
+import sgtk_context_key
+
+from .snapshot import normalize_path
+from .tank_pool import get_tank_pool
+
+
+class _ScriptRecord(object):
+    """
+    The script the current context was resolved from.
+    """
+    def __init__(self, path, tk, context):
+        """
+        :param path:    The path of the script.
+        :param tk:      The Toolkit API instance it was resolved with.
+        :param context: The sgtk.context.Context resolved for it.
+        """
+        self.path = path
+        self.folder = normalize_path(os.path.dirname(path))
+        self.tk = tk
+        self.context_key = sgtk_context_key.get_context_key(context)
+        self._template = None
+        self._template_found = False
+
+    @property
+    def template(self):
+        """
+        The template the script matches, or None.
+        """
+        if not self._template_found:
+            self._template = _get_template(self.tk, self.path)
+            self._template_found = True
+        return self._template
+
+
+def _get_template(tk, path):
+    """
+    Returns the template matching the given path, or None if there isn't
+    exactly one.
+
+    :param tk:      The Toolkit API instance.
+    :param path:    The path to match.
+    """
+    try:
+        return tk.template_from_path(path)
+    except TankError:
+        # More than one template matches.
+        return None
+
+
+class VersionUpTracker(object):
+    """
+    Remembers the script the current context was resolved from, and reuses
+    that context for the other versions of the script.
+    """
+    def __init__(self):
+        self._record = None
+        self._lock = threading.Lock()
+
+        self.checks = 0
+        self.hits = 0
+
+    def record(self, path, tk, context):
+        """
+        Remembers the script a context was resolved from.
+
+        :param path:    The path of the script.
+        :param tk:      The Toolkit API instance it was resolved with.
+        :param context: The sgtk.context.Context resolved for it.
+        """
+        record = _ScriptRecord(path, tk, context)
+        with self._lock:
+            self._record = record
+
+    def derive_context(self, path, context):
+        """
+        Returns the Toolkit instance and the context for the given script if
+        it is another version of the recorded script, and the given context,
+        usually the current one, is the one resolved for it.
+
+        :param path:    The path of the script being saved.
+        :param context: The current sgtk.context.Context.
+
+        :returns: A tuple of the Toolkit instance and the context, or None if
+                  the context has to be resolved.
+        """
+        with self._lock:
+            self.checks += 1
+            record = self._record
+
+        if record is None or context is None:
+            return None
+
+        if normalize_path(os.path.dirname(path)) != record.folder:
+            return None
+
+        if sgtk_context_key.get_context_key(context) != record.context_key:
+            return None
+
+        # The instance has been evicted if its configuration has changed.
+        if get_tank_pool().peek(path) is not record.tk:
+            return None
+
+        template = record.template
+        if template is None:
+            return None
+        new_template = _get_template(record.tk, path)
+        if new_template is None or new_template.name != template.name:
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return (record.tk, context)
+
+    def stats(self):
+        """
+        Returns a dict of the tracker's counters.
+        """
+        return dict(
+            checks=self.checks,
+            hits=self.hits,
+            hit_rate=float(self.hits) / self.checks if self.checks else 0.0,
+        )
+
+
+# The tracker shared by everything in the session.
+_version_up_tracker = VersionUpTracker()
+
+
+def get_version_up_tracker():
+    """
+    Returns the version-up tracker shared by the whole session.
+    """
+    return _version_up_tracker
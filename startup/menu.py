@@ -33,6 +33,17 @@ if not nuke.env.get("hiero"):
     # down the engine's python folder location to us via an env var.
     path = os.environ.get("TANK_NUKE_ENGINE_MOD_PATH")
     if path:
+        # Serve the engine's and the apps' modules from the Python bundle
+        # or the module index before anything gets imported from them.
+        sys.path.append(os.path.join(path, "startup"))
+        try:
+            import sgtk_finder
+            import sgtk_bundle
+        finally:
+            sys.path.pop()
+        sgtk_finder.install(path)
+        sgtk_bundle.install()
+
         sys.path.append(path)
         handle_new_tank_session()
     else:
@@ -0,0 +1,182 @@
+# Copyright (c) 2016 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Tests of tk_nuke.entity_cache against a mockgun Shotgun server.
+
+They need Toolkit core, whose bundled mockgun and test schema are used. The
+tk_nuke package imports the nuke module, which is stood in for outside of
+Nuke, as the entity cache doesn't use it, so they run with any Python that
+can import Toolkit:
+
+    python -m unittest discover -s tests
+
+The schema is looked up in tk-core's tests/fixtures/mockgun folder, or in the
+folder set in TK_NUKE_MOCKGUN_SCHEMA_DIR.
+"""
+
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python"))
+
+try:
+    __import__("nuke")
+except ImportError:
+    # Only imported by the parts of tk_nuke the tests don't use.
+    sys.modules["nuke"] = types.ModuleType("nuke")
+
+try:
+    import tank
+    from tank_vendor.shotgun_api3.lib import mockgun
+    from tk_nuke.entity_cache import EntityCache
+except ImportError, e:
+    _skip_reason = "Needs Toolkit core: %s" % e
+else:
+    _skip_reason = None
+
+
+def _get_schema_dir():
+    """
+    Returns the folder holding mockgun's schema files, or None.
+    """
+    schema_dir = os.environ.get("TK_NUKE_MOCKGUN_SCHEMA_DIR")
+    if not schema_dir and _skip_reason is None:
+        # tank lives in python/tank in a tk-core checkout.
+        core_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(tank.__file__))))
+        schema_dir = os.path.join(core_root, "tests", "fixtures", "mockgun")
+    if schema_dir and os.path.isfile(os.path.join(schema_dir, "schema.pickle")):
+        return schema_dir
+    return None
+
+
+class _CountingShotgun(object):
+    """
+    A Shotgun connection counting the find() calls made through it.
+    """
+    def __init__(self, shotgun):
+        self._shotgun = shotgun
+        self.finds = 0
+
+    def find(self, *args, **kwargs):
+        self.finds += 1
+        return self._shotgun.find(*args, **kwargs)
+
+
+class TestEntityCache(unittest.TestCase):
+    """
+    Checks that the entity cache only reads each entity from Shotgun once,
+    and prefetches them in batches.
+    """
+    def setUp(self):
+        if _skip_reason:
+            self.skipTest(_skip_reason)
+        schema_dir = _get_schema_dir()
+        if schema_dir is None:
+            self.skipTest("No mockgun schema found, set TK_NUKE_MOCKGUN_SCHEMA_DIR")
+
+        mockgun.Shotgun.set_schema_paths(
+            os.path.join(schema_dir, "schema.pickle"),
+            os.path.join(schema_dir, "schema_entity.pickle"),
+        )
+        mock = mockgun.Shotgun("http://unit_test_mock_sg", "mock_user", "mock_key")
+        self.project = mock.create("Project", {"name": "big_show"})
+        self.shot = mock.create("Shot", {"code": "ABC_123", "project": self.project})
+        self.mock = mock
+        self.shotgun = _CountingShotgun(mock)
+
+    def test_reads_missing_names_once(self):
+        """
+        Names missing from an entity dict are read once, then from the cache.
+        """
+        cache = EntityCache(ttl=300.0)
+        shot = {"type": "Shot", "id": self.shot["id"]}
+
+        self.assertEqual(cache.get_name(self.shotgun, shot), "ABC_123")
+        self.assertEqual(cache.get_name(self.shotgun, shot), "ABC_123")
+        self.assertEqual(self.shotgun.finds, 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_uses_names_of_entity_dicts(self):
+        """
+        Names the entity dicts hold are never read from Shotgun.
+        """
+        cache = EntityCache(ttl=300.0)
+        self.assertEqual(cache.get_name(self.shotgun, self.project), "big_show")
+        self.assertEqual(self.shotgun.finds, 0)
+
+    def test_missing_entities(self):
+        """
+        Entities that don't exist are None, and aren't cached.
+        """
+        cache = EntityCache(ttl=300.0)
+        self.assertIsNone(cache.find_one(self.shotgun, "Shot", self.shot["id"] + 1000))
+        self.assertIsNone(cache.find_one(self.shotgun, "Shot", self.shot["id"] + 1000))
+        self.assertEqual(self.shotgun.finds, 2)
+
+    def test_invalidate(self):
+        """
+        Invalidated entities are read again.
+        """
+        cache = EntityCache(ttl=300.0)
+        cache.find_one(self.shotgun, "Shot", self.shot["id"])
+        cache.invalidate()
+        cache.find_one(self.shotgun, "Shot", self.shot["id"])
+        self.assertEqual(self.shotgun.finds, 2)
+
+    def test_prefetch_reads_each_type_once(self):
+        """
+        Prefetched entities are read with one query per type, and are then
+        served from the cache.
+        """
+        cache = EntityCache(ttl=300.0)
+        other_shot = self.mock.create("Shot", {"code": "ABC_456", "project": self.project})
+        entities = [
+            {"type": "Project", "id": self.project["id"]},
+            {"type": "Shot", "id": self.shot["id"]},
+            {"type": "Shot", "id": other_shot["id"]},
+            {"type": "Shot", "id": self.shot["id"]},
+        ]
+
+        self.assertEqual(cache.prefetch(self.shotgun, entities), 3)
+        self.assertEqual(self.shotgun.finds, 2)
+        self.assertEqual(cache.get_name(self.shotgun, {"type": "Shot", "id": other_shot["id"]}), "ABC_456")
+        self.assertEqual(cache.prefetch(self.shotgun, entities), 0)
+        self.assertEqual(self.shotgun.finds, 2)
+
+    def test_prefetch_size(self):
+        """
+        A prefetch reads no more than the prefetch size, first entities first.
+        """
+        cache = EntityCache(ttl=300.0, prefetch_size=1)
+        entities = [
+            {"type": "Shot", "id": self.shot["id"]},
+            {"type": "Project", "id": self.project["id"]},
+        ]
+
+        self.assertEqual(cache.prefetch(self.shotgun, entities), 1)
+        self.assertEqual(self.shotgun.finds, 1)
+        self.assertIsNotNone(cache.find_one(self.shotgun, "Shot", self.shot["id"]))
+        self.assertEqual(self.shotgun.finds, 1)
+
+    def test_disabled(self):
+        """
+        A ttl of 0 disables the cache.
+        """
+        cache = EntityCache(ttl=0)
+        cache.find_one(self.shotgun, "Shot", self.shot["id"])
+        cache.find_one(self.shotgun, "Shot", self.shot["id"])
+        self.assertEqual(self.shotgun.finds, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()